@@ -1,115 +1,322 @@
-import uuid
 import subprocess
 import os
-import boto3
+import botocore
 import json
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+
+import scheduler
+import spans
+import workers
 
 # Import utility helpers
 sys.path.insert(1, os.path.realpath(os.path.pardir))
-import helpers
+sys.path.insert(1, os.path.realpath(os.path.join(os.path.pardir, 'util')))
+import client_pool
+import job_state
 
 # Get configuration
 from configparser import ConfigParser
 config = ConfigParser(os.environ)
 config.read('ann_config.ini')
 
+# Pool of warm AnnTools workers, when WorkerMode = warm
+warm_pool = None
 
+# Seconds to wait after a failed receive before receiving again
+RECEIVE_ERROR_BACKOFF = 1
 
-def annotations():
-    # Connect to SQS and get the message queue
-    sqs = boto3.client('sqs', region_name=config['aws']['AwsRegionName'])
-    queue_url = config['aws']['AwsSQSRequestsUrl']
-    # Enable long polling on an existing SQS queue
-    sqs.set_queue_attributes(
-        QueueUrl=queue_url,
-        Attributes={'ReceiveMessageWaitTimeSeconds': '20'}
-    )
-
-    # Poll the message queue in a loop
-    while True:
-        # Attempt to read a message from the queue
-        try:
-            # Attempt to read a message from the queue
-            response = sqs.receive_message(QueueUrl=queue_url)
-            message = json.loads(
-                json.loads(response['Messages'][0]['Body'])['Message']
-            )
-            receipt_handle = response['Messages'][0]['ReceiptHandle']
-        except KeyError:
-            # keep listening until reading an message
-            continue
+"""Download the input file and run the AnnTools runner for one job
+Runs on a pool thread; returns True once run.py has exited successfully,
+so the caller knows the SQS message can be deleted. sent_time is when
+the request reached the queue, in epoch seconds.
+"""
+def process_job(message, sent_time):
+    # Extract job parameters from the message body as before
+    key = message['s3_key_input_file']
+    name = key.split('/')
+    path = '/'.join(name[0:2])
+    UUID = message['job_id']
+    input_file = message['input_file_name']
+    bucket = message['s3_inputs_bucket']
 
-        # If message read, extract job parameters from the message body as before
-        key = message['s3_key_input_file']
-        name = key.split('/')
-        path = '/'.join(name[0:2])
-        UUID = message['job_id']
-        input_file = message['input_file_name']
-        bucket = message['s3_inputs_bucket']
-        
+    os.makedirs('jobs/{}'.format(UUID), exist_ok=True)
+    job_spans = spans.Spans(UUID)
+    job_spans.add('queue_wait', time.time() - sent_time)
 
+    if config['ann']['JobMode'] == 'stream':
+        # run.py reads the input object itself as it annotates
+        input_path = 's3://{}/{}'.format(bucket, key)
+    else:
+        # Get the input file S3 object and copy it to a local file
+        with job_spans.span('download'):
+            s3_client = client_pool.client('s3', config['aws']['AwsRegionName'])
+            s3_client.download_file(bucket, key, 'jobs/{}/{}'.format(UUID, input_file))
+        input_path = '../jobs/{}/{}'.format(UUID, input_file)
 
+    dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
+    table = dynamo.Table(config['aws']['AwsDynamoTable'])
 
-        dir_exist = os.path.isdir('jobs')
-        if not dir_exist:
-            subprocess.Popen(['sh', '-c', 'mkdir jobs'])
-        create_ID_folder = 'mkdir jobs/{}'.format(UUID)
-        os.system(create_ID_folder)
-        
-        # Get the input file S3 object and copy it to a local file
-        s3_client = boto3.resource('s3', region_name=config['aws']['AwsRegionName'])
-        s3_client.meta.client.download_file(bucket, key, '{}'.format(input_file))
-
-    
-        move_file = 'mv {} jobs/{}'.format(input_file, UUID)
-        os.system(move_file)
-
-
-        dynamo = boto3.resource('dynamodb', region_name=config['aws']['AwsRegionName'])
-        table = dynamo.Table(config['aws']['AwsDynamoTable'])
-
-        response = table.get_item(Key ={ 'job_id': UUID})
-        status = response['Item']['job_status']
-
-        # Change your database update code such that the job_status key is 
-        # only updated to “RUNNING” only if its current status is “PENDING”.
-        if status == 'COMPLETED':
-            print({"code": 200,
-                            "data": {
-                                "job_id": UUID,
-                                "input_file": input_file,
-                                    },
-                            "Comment": "Job has already been completed!"
-                })
-        elif status == 'PENDING':
-            try:
-                table.update_item(Key= {'job_id': UUID},
-                                UpdateExpression="set job_status = :s",
-                                ExpressionAttributeValues={':s': 'RUNNING'},
-                                ReturnValues="UPDATED_NEW"
-                                )
-            except botocore.exceptions.ClientError:
-                print({
-                    'code': 500,
-                    'status': 'error',
-                    'message': 'INTERNAL_SERVER_ERROR'
-                })
+    # Only a PENDING job (or one whose earlier run failed) becomes RUNNING
+    try:
+        job_state.transition(table, UUID, job_state.JOB_STATUS, job_state.RUNNING)
+    except job_state.TransitionError as e:
+        # Already completed, or no such job: either way the request is
+        # done with
+        print({"code": 200 if e.item else 404,
+                        "data": {
+                            "job_id": UUID,
+                            "input_file": input_file,
+                                },
+                        "Comment": "Job has already been completed!" if e.item else "No such job!"
+            })
+        return True
+    except botocore.exceptions.ClientError:
+        print({
+            'code': 500,
+            'status': 'error',
+            'message': 'INTERNAL_SERVER_ERROR'
+        })
+        return False
 
-        # Launch annotation job as a background process
-        try:
-            subprocess.Popen(['sh', '-c', 'cd anntools && python run.py ../jobs/{}/{} {} {} {}'.format(UUID, input_file, UUID, input_file, path)])
-        except subprocess.CalledProcessError:
+    # run.py picks up the phases timed so far from the job directory
+    job_spans.save('jobs/{}'.format(UUID))
+
+    # Run the annotation job and wait for it, so the pool slot stays
+    # occupied for as long as the job actually runs
+    if warm_pool is not None:
+        if not warm_pool.run_job(input_path, UUID, input_file, path):
             print({
                     'code': 500,
                     'status': 'error',
-                    'message': 'INTERNAL_SERVER_ERROR'
+                    'message': 'INTERNAL_SERVER_ERROR',
+                    'job_id': UUID
             })
-        
-        # Delete the message from the queue, if job was successfully submitted
-        sqs.delete_message(
-            QueueUrl=queue_url,
-            ReceiptHandle=receipt_handle
+            return False
+        return True
+
+    proc = subprocess.run([sys.executable, 'run.py', input_path, UUID, input_file, path],
+        cwd='anntools')
+    if proc.returncode != 0:
+        print({
+                'code': 500,
+                'status': 'error',
+                'message': 'INTERNAL_SERVER_ERROR',
+                'job_id': UUID
+        })
+        return False
+    return True
+
+
+"""Request queues polled by the annotator, one per job class and lane,
+highest priority first, from the JobClasses and Lanes options and their
+[class.<name>] and [lane.<name>] sections
+"""
+def job_classes():
+    classes = []
+    lanes = config['ann']['Lanes'].replace(',', ' ').split()
+    for name in config['ann']['JobClasses'].replace(',', ' ').split():
+        class_section = config['class.{}'.format(name)]
+        for lane in lanes:
+            lane_section = config['lane.{}'.format(lane)]
+            classes.append(scheduler.JobClass('{}.{}'.format(name, lane),
+                class_section['QueueUrl'].format(lane=lane),
+                int(class_section['Weight']) * int(lane_section['Weight']),
+                lane, int(lane_section['MaxRunning'])))
+    return classes
+
+
+def annotations():
+    global warm_pool
+    # Connect to SQS and get the message queues, one per job class
+    sqs = client_pool.client('sqs', config['aws']['AwsRegionName'])
+    classes = job_classes()
+    job_state.publish_events(client_pool.client('sns', config['aws']['AwsRegionName']),
+        config['aws']['AwsSNSJobStatusArn'])
+    # Enable long polling on the existing SQS queues; receives ask for
+    # their own wait, so a queue left without it still works
+    for job_class in classes:
+        try:
+            sqs.set_queue_attributes(
+                QueueUrl=job_class.queue_url,
+                Attributes={'ReceiveMessageWaitTimeSeconds': '20'}
+            )
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            print({'code': 500, 'status': 'error', 'message': str(e)})
+
+    max_concurrency = config.getint('ann', 'MaxConcurrency')
+    visibility_timeout = config.getint('ann', 'VisibilityTimeout')
+    heartbeat_interval = config.getint('ann', 'HeartbeatInterval')
+    idle_wait = config.getint('ann', 'IdleWaitSeconds')
+    stats_interval = config.getint('ann', 'QueueStatsInterval')
+    job_scheduler = scheduler.WeightedScheduler(classes, config.getint('ann', 'StarvationSecs'))
+
+    # Start the warm workers before any message is received, unless the
+    # caller (e.g. util/ann_load.py) has set up its own
+    if config['ann']['WorkerMode'] == 'warm' and warm_pool is None:
+        warm_pool = workers.WarmPool(max_concurrency, config.getint('ann', 'WorkerMaxJobs'))
+
+    # Jobs currently running: receipt handle -> [future, last heartbeat,
+    # queue url]
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    # Long polls in flight, at most one per queue, each for one message:
+    # queue url -> (JobClass, future of the receive)
+    polls = {}
+    receivers = ThreadPoolExecutor(max_workers=len(classes))
+    last_stats = time.time()
+
+    """Start the jobs of a receive from a class's queue; returns the
+    number started
+    """
+    def start_jobs(job_class, response):
+        waits = []
+        for sqs_message in response.get('Messages', []):
+            try:
+                message = json.loads(json.loads(sqs_message['Body'])['Message'])
+            except (KeyError, ValueError):
+                # keep listening; malformed messages are left to expire
+                continue
+            sent_time = int(sqs_message['Attributes']['SentTimestamp']) / 1000.0
+            waits.append(time.time() - sent_time)
+            future = executor.submit(process_job, message, sent_time)
+            running[sqs_message['ReceiptHandle']] = [future, time.time(), job_class.queue_url]
+        job_scheduler.polled(job_class, waits)
+        return len(waits)
+
+    def receive(job_class, count, wait):
+        return sqs.receive_message(
+            QueueUrl=job_class.queue_url,
+            MaxNumberOfMessages=count,
+            VisibilityTimeout=visibility_timeout,
+            WaitTimeSeconds=wait,
+            AttributeNames=['SentTimestamp']
         )
-# run annotations
-annotations()
\ No newline at end of file
+
+    """Record a receive that failed; the class is polled again later
+    """
+    def receive_failed(job_class, e):
+        print({'code': 500, 'status': 'error', 'message': str(e)})
+        job_scheduler.polled(job_class, [])
+
+    def lane_running(job_class):
+        return sum(1 for entry in running.values() if entry[2] == job_class.queue_url) + \
+            (1 if job_class.queue_url in polls else 0)
+
+    # Poll the message queues in a loop
+    while True:
+        # Reap finished jobs; only delete the message once the job is done
+        for receipt_handle, (future, _, queue_url) in list(running.items()):
+            if not future.done():
+                continue
+            del running[receipt_handle]
+            try:
+                succeeded = future.result()
+            except Exception as e:
+                print({'code': 500, 'status': 'error', 'message': str(e)})
+                succeeded = False
+            if succeeded:
+                try:
+                    sqs.delete_message(
+                        QueueUrl=queue_url,
+                        ReceiptHandle=receipt_handle
+                    )
+                except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                    # The request is redelivered, and finds its job done
+                    print({'code': 500, 'status': 'error', 'message': str(e)})
+            # Failed jobs are left on the queue and become visible again
+            # once their visibility timeout runs out
+
+        # Keep messages of running jobs invisible to other annotators
+        now = time.time()
+        for receipt_handle, entry in running.items():
+            if now - entry[1] >= heartbeat_interval:
+                try:
+                    sqs.change_message_visibility(
+                        QueueUrl=entry[2],
+                        ReceiptHandle=receipt_handle,
+                        VisibilityTimeout=visibility_timeout
+                    )
+                    entry[1] = now
+                except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                    print({'code': 500, 'status': 'error', 'message': str(e)})
+
+        if now - last_stats >= stats_interval:
+            print(json.dumps({'queue_waits': job_scheduler.stats()}, sort_keys=True))
+            last_stats = now
+
+        # Start the jobs of the long polls that have returned
+        received = 0
+        failed = False
+        for queue_url, (job_class, poll) in list(polls.items()):
+            if not poll.done():
+                continue
+            del polls[queue_url]
+            try:
+                received += start_jobs(job_class, poll.result())
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                receive_failed(job_class, e)
+                failed = True
+
+        # Only receive as many messages as there are free slots; each
+        # long poll in flight holds one
+        free_slots = max_concurrency - len(running) - len(polls)
+        if free_slots <= 0:
+            # Wake as soon as a job finishes, to hand its slot on
+            wait_futures([entry[0] for entry in running.values()] +
+                [poll for _, poll in polls.values()], timeout=1,
+                return_when=FIRST_COMPLETED)
+            continue
+
+        # Share the free slots out between the classes; slots a class
+        # leaves unused carry over to the classes after it. Queues are
+        # not waited on here, so one empty queue does not hold up the
+        # others; queues with a long poll in flight are left to it.
+        taken = 0
+        allotted = 0
+        for job_class, slots in job_scheduler.plan(free_slots):
+            allotted += slots
+            if job_class.queue_url in polls:
+                continue
+            wanted = min(allotted - taken, free_slots - taken)
+            if job_class.max_running:
+                # Leave the rest of the node to the other lanes
+                wanted = min(wanted, job_class.max_running - lane_running(job_class))
+            if wanted <= 0:
+                continue
+            try:
+                taken += start_jobs(job_class, receive(job_class, min(wanted, 10), 0))
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                receive_failed(job_class, e)
+                failed = True
+        received += taken
+        if received:
+            continue
+        if failed:
+            # Back off rather than retry a failing queue at once
+            time.sleep(RECEIVE_ERROR_BACKOFF)
+            continue
+
+        # Nothing to receive: long poll every queue with room at once, so
+        # a request on any of them is picked up as soon as it arrives, and
+        # wait for one of the polls to return or a job to finish
+        free_slots -= taken
+        for job_class in job_scheduler.classes:
+            if free_slots <= 0:
+                break
+            if job_class.queue_url in polls or \
+                (job_class.max_running and lane_running(job_class) >= job_class.max_running):
+                continue
+            polls[job_class.queue_url] = (job_class,
+                receivers.submit(receive, job_class, 1, idle_wait))
+            free_slots -= 1
+        wait_futures([entry[0] for entry in running.values()] +
+            [poll for _, poll in polls.values()],
+            timeout=min(idle_wait, heartbeat_interval),
+            return_when=FIRST_COMPLETED)
+
+
+if __name__ == '__main__':
+    # run annotations
+    annotations()
@@ -0,0 +1,51 @@
+# bgzf.py
+#
+# BGZF (blocked gzip) compression of annotation results
+#
+# BGZF files are ordinary multi-member gzip files, so gunzip and browsers
+# read them as usual, while samtools/tabix can index and seek into them.
+#
+##
+
+import struct
+import zlib
+
+# Uncompressed bytes per block, as used by htslib
+BLOCK_SIZE = 0xff00
+
+# Empty block that marks the end of a BGZF file
+EOF_BLOCK = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def _block(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    # gzip header with the BC extra subfield holding the block size - 1
+    header = struct.pack('<4BI2BH2B2H', 0x1f, 0x8b, 8, 4, 0, 0, 0xff,
+        6, ord('B'), ord('C'), 2, len(deflated) + 25)
+    trailer = struct.pack('<2I', zlib.crc32(data) & 0xffffffff, len(data))
+    return header + deflated + trailer
+
+
+"""Compress bytes into BGZF blocks, without the EOF marker
+Blocks can be concatenated, so callers producing output piecewise can
+compress each piece on its own and append EOF_BLOCK at the very end.
+"""
+def compress(data, level=6):
+    return b''.join(_block(data[i:i + BLOCK_SIZE], level)
+        for i in range(0, len(data), BLOCK_SIZE))
+
+
+"""Compress a file into a complete BGZF file
+"""
+def compress_file(src_path, dst_path, level=6):
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        while True:
+            data = src.read(BLOCK_SIZE)
+            if not data:
+                break
+            dst.write(_block(data, level))
+        dst.write(EOF_BLOCK)
+
+### EOF
@@ -0,0 +1,175 @@
+# result_cache.py
+#
+# Content-addressed cache of annotation results
+#
+# Results are keyed by a digest of the input file's contents plus the
+# annotator version, so an input that has been annotated before is served
+# by copying the stored results instead of running AnnTools again.
+#
+##
+
+import hashlib
+import random
+import time
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+# Index items holding the cache counters: every fetch and store counts,
+# so the counters are spread over several items to keep any one of them
+# from becoming a hot key, and summed when read
+STATS_KEY = '__stats__'
+STATS_SHARDS = 10
+COUNTERS = ('hits', 'misses', 'evictions', 'bytes')
+
+# Lines of a count log that belong to the job that wrote it
+JOB_TIMINGS = b'Job timings:'
+
+
+"""Digest identifying the results of annotating a file
+"""
+def input_digest(input_path, version):
+    sha = hashlib.sha256()
+    sha.update(version.encode('utf-8'))
+    sha.update(b'\0')
+    with open(input_path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ResultCache(object):
+    """Cached results are server-side copies kept under their own prefix
+    in the results bucket, so archiving a user's results does not empty
+    the cache. The index is a DynamoDB table keyed by digest.
+    """
+    def __init__(self, s3, table, bucket, prefix, max_bytes, max_age):
+        self.s3 = s3
+        self.table = table
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _count(self, counter, amount=1):
+        shard = '{}{}'.format(STATS_KEY, random.randrange(STATS_SHARDS))
+        self.table.update_item(Key={'digest': shard},
+            UpdateExpression='ADD #c :n',
+            ExpressionAttributeNames={'#c': counter},
+            ExpressionAttributeValues={':n': amount})
+
+    def _copy(self, key, bucket, dest_key):
+        self.s3.copy({'Bucket': self.bucket, 'Key': key}, bucket, dest_key)
+
+    """Copy cached results to a job's keys
+    Returns True on a hit. Entries older than max_age count as a miss
+    and are evicted.
+    """
+    def fetch(self, digest, bucket, result_key, log_key):
+        entry = self.table.get_item(Key={'digest': digest}).get('Item')
+        if entry and time.time() - int(entry['created']) > self.max_age:
+            self._evict(entry)
+            entry = None
+        if not entry:
+            self._count('misses')
+            return False
+
+        try:
+            self._copy(entry['result_key'], bucket, result_key)
+            self._copy(entry['log_key'], bucket, log_key)
+        except ClientError:
+            # Cached objects are gone; drop the entry and annotate as usual
+            self._evict(entry)
+            self._count('misses')
+            return False
+
+        self.table.update_item(Key={'digest': digest},
+            UpdateExpression='SET last_hit = :t ADD hits :n',
+            ExpressionAttributeValues={':t': int(time.time()), ':n': 1})
+        self._count('hits')
+        return True
+
+    """Add a job's results to the cache
+    """
+    def store(self, digest, bucket, result_key, log_key):
+        suffix = result_key.partition('~')[2].partition('.')[2]
+        cache_result_key = '{}{}.{}'.format(self.prefix, digest, suffix)
+        cache_log_key = '{}{}.vcf.count.log'.format(self.prefix, digest)
+        self.s3.copy({'Bucket': bucket, 'Key': result_key}, self.bucket, cache_result_key)
+        # The log as the job wrote it, less the job's own timings
+        log = self.s3.get_object(Bucket=bucket, Key=log_key)['Body'].read()
+        self.s3.put_object(Bucket=self.bucket, Key=cache_log_key,
+            Body=b''.join(line for line in log.splitlines(True)
+                if not line.startswith(JOB_TIMINGS)))
+        size = self.s3.head_object(Bucket=self.bucket, Key=cache_result_key)['ContentLength']
+
+        now = int(time.time())
+        try:
+            self.table.put_item(Item={
+                    'digest': digest,
+                    'result_key': cache_result_key,
+                    'log_key': cache_log_key,
+                    'size': size,
+                    'created': now,
+                    'last_hit': now,
+                    'hits': 0
+                },
+                ConditionExpression=Attr('digest').not_exists())
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # Another node cached the same input first
+            return
+        self._count('bytes', size)
+
+        if self.stats()['bytes'] > self.max_bytes:
+            self.evict()
+
+    """Drop an entry, unless another node has dropped or replaced it
+    already; only the node whose delete succeeds uncounts its bytes
+    """
+    def _evict(self, entry):
+        try:
+            self.table.delete_item(Key={'digest': entry['digest']},
+                ConditionExpression=Attr('created').eq(entry['created']))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return
+        for key in (entry['result_key'], entry['log_key']):
+            self.s3.delete_object(Bucket=self.bucket, Key=key)
+        self._count('bytes', -int(entry['size']))
+        self._count('evictions')
+
+    """Evict expired entries, then least recently hit entries until the
+    cache is within max_bytes
+    """
+    def evict(self):
+        entries = []
+        scan = {'FilterExpression': Attr('result_key').exists()}
+        while True:
+            response = self.table.scan(**scan)
+            entries.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        now = time.time()
+        total = sum(int(entry['size']) for entry in entries)
+        for entry in sorted(entries, key=lambda entry: int(entry['last_hit'])):
+            if now - int(entry['created']) > self.max_age or total > self.max_bytes:
+                self._evict(entry)
+                total -= int(entry['size'])
+
+    """Hit, miss and eviction counters and the cached bytes
+    """
+    def stats(self):
+        stats = dict.fromkeys(COUNTERS, 0)
+        for shard in range(STATS_SHARDS):
+            item = self.table.get_item(
+                Key={'digest': '{}{}'.format(STATS_KEY, shard)}).get('Item', {})
+            for counter in COUNTERS:
+                stats[counter] += int(item.get(counter, 0))
+        return stats
+
+### EOF
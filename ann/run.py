@@ -14,11 +14,23 @@ import driver
 import boto3
 import os
 import botocore
+from boto3.s3.transfer import TransferConfig
 import json
+import shutil
 
 # Import utility helpers
 sys.path.insert(0, '../../util')
-import helpers
+import client_pool
+import job_state
+
+# Import annotator modules
+sys.path.insert(0, '..')
+import bgzf
+import result_cache
+import shard
+import spans
+import streaming
+import variant_cache
 
 # Get configuration
 from configparser import ConfigParser
@@ -26,88 +38,246 @@ config = ConfigParser(os.environ)
 config.read('../ann_config.ini')
 
 
-"""A rudimentary timer for coarse-grained profiling
+"""AWS clients used by run_job
+Created once per process, so warm workers (see workers.py) reuse them
+across jobs instead of paying for client setup on every job.
 """
+_clients = {}
 
 
-class Timer(object):
-    def __init__(self, verbose=True):
-        self.verbose = verbose
+def aws_clients():
+    if not _clients:
+        _clients['s3'] = client_pool.client('s3', config['aws']['AwsRegionName'])
+        dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
+        _clients['table'] = dynamo.Table(config['aws']['AwsDynamoTable'])
+        _clients['sns'] = client_pool.client('sns', config['aws']['AwsRegionName'])
+        job_state.publish_events(_clients['sns'], config['aws']['AwsSNSJobStatusArn'])
+        _clients['sqs'] = client_pool.client('sqs', config['aws']['AwsRegionName'])
+        if config.getboolean('cache', 'Enabled'):
+            _clients['cache'] = result_cache.ResultCache(_clients['s3'],
+                dynamo.Table(config['cache']['AwsDynamoCacheTable']),
+                config['aws']['AwsS3ResultsBuckets'],
+                config['cache']['CachePrefix'],
+                config.getint('cache', 'MaxBytes'),
+                config.getint('cache', 'MaxAge'))
+    return _clients
 
-    def __enter__(self):
-        self.start = time.time()
-        return self
 
-    def __exit__(self, *args):
-        self.end = time.time()
-        self.secs = self.end - self.start
-        if self.verbose:
-            print(f"Approximate runtime: {self.secs:.2f} seconds")
+"""AnnTools entry point used by run_job
+driver.run, behind the node's per-variant annotation cache when that is
+enabled.
+"""
+_annotate = []
 
 
-if __name__ == '__main__':
-    # Call the AnnTools pipeline
-    if len(sys.argv) > 1:
-        with Timer():
-            driver.run(sys.argv[1], 'vcf')
-        s3_client = boto3.client('s3', region_name=config['aws']['AwsRegionName'])
-        UUID = sys.argv[2]
-        input_file = sys.argv[3]
-        path = sys.argv[4]
-        prefix = input_file.partition('.')[0]
+def annotator():
+    if not _annotate:
+        if config.getboolean('memo', 'Enabled'):
+            _annotate.append(variant_cache.MemoAnnotator(driver.run,
+                variant_cache.VariantCache(config['memo']['Path'],
+                    config['memo']['ReferenceVersion'],
+                    config.getint('memo', 'MaxBytes'),
+                    config.getint('memo', 'MmapBytes'))))
+        else:
+            _annotate.append(driver.run)
+    return _annotate[0]
+
+
+"""Multipart transfer settings for result uploads
+"""
+def transfer_config():
+    part_size = config.getint('ann', 'UploadPartSize')
+    return TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=config.getint('ann', 'UploadConcurrency'),
+        use_threads=True
+    )
+
+
+# Longest delay SQS allows on a message
+MAX_SQS_DELAY = 900
+
+
+"""Queue the archival of a free user's results, due RetentionSecs after
+the job completed
+Delays longer than SQS allows are made up by util/archive, which holds
+back requests that arrive early.
+"""
+def schedule_archive(sqs, job):
+    due_time = int(job['complete_time']) + config.getint('archive', 'RetentionSecs')
+    sqs.send_message(QueueUrl=config['aws']['AwsSQSArchiveRequestsUrl'],
+        MessageBody=json.dumps({
+            'job_id': job['job_id'],
+            'user_id': job['user_id'],
+            's3_results_bucket': job['s3_results_bucket'],
+            's3_key_result_file': job['s3_key_result_file'],
+            'due_time': due_time
+        }),
+        DelaySeconds=max(0, min(due_time - int(time.time()), MAX_SQS_DELAY)))
+
+
+"""Annotate one input file, upload the results and notify the user
+input_path is either a local file or, in streaming mode, an
+s3://<bucket>/<key> URL of the input object. All per-job state lives
+in local variables and the job's own ../jobs/<UUID> directory, which is
+removed when the job is done.
+"""
+def run_job(input_path, UUID, input_file, path):
+    clients = aws_clients()
+    annotate = annotator()
+    s3_client = clients['s3']
+    prefix = input_file.partition('.')[0]
+    compress = config.getboolean('ann', 'CompressResults')
+    results_bucket = config['aws']['AwsS3ResultsBuckets']
+    result_key = '{}/{}~{}.annot.vcf{}'.format(path, UUID, prefix, '.gz' if compress else '')
+    log_key = '{}/{}~{}.vcf.count.log'.format(path, UUID, prefix)
+    # Phases already timed by the annotator (queue wait, download)
+    job_spans = spans.Spans.load(UUID, '../jobs/{}'.format(UUID))
+
+    # Look up results of an identical earlier input (download mode only,
+    # as the digest needs the whole input file)
+    cache = clients.get('cache')
+    digest = None
+    cached = False
+    if cache is not None and not input_path.startswith('s3://'):
+        with job_spans.span('cache_lookup'):
+            digest = result_cache.input_digest(input_path,
+                config['cache']['AnnotatorVersion'] + ('.gz' if compress else ''))
+            try:
+                cached = cache.fetch(digest, results_bucket, result_key, log_key)
+            except botocore.exceptions.ClientError as e:
+                # The cache is an optimization; annotate as usual
+                print('Error in looking up cached results: {}'.format(e))
+
+    if input_path.startswith('s3://'):
+        # Streaming mode: annotate straight from and to S3; download and
+        # result upload overlap with, and are timed as part of, annotation
+        input_bucket, _, input_key = input_path[len('s3://'):].partition('/')
+        os.makedirs('../jobs/{}'.format(UUID), exist_ok=True)
+        with job_spans.span('annotate'):
+            count_log = streaming.annotate_stream(s3_client, annotate,
+                input_bucket, input_key,
+                results_bucket, result_key,
+                '../jobs/{}'.format(UUID),
+                config.getint('ann', 'StreamBlockRecords'),
+                config.getint('ann', 'StreamPartSize'),
+                compress)
+    elif cached:
+        # The log was copied from the cache too
+        count_log = None
+        print('Results copied from cache: {}'.format(digest))
+    else:
+        with job_spans.span('annotate'):
+            if config['ann']['ShardMode'] != 'off' and \
+                os.path.getsize(input_path) >= config.getint('ann', 'ShardMinBytes'):
+                # Large input: annotate shards of it in parallel
+                shard.annotate_sharded(annotate, input_path,
+                    '../jobs/{}/{}.annot.vcf'.format(UUID, prefix),
+                    '../jobs/{}/{}.vcf.count.log'.format(UUID, prefix),
+                    '../jobs/{}'.format(UUID),
+                    config['ann']['ShardMode'],
+                    config.getint('ann', 'ShardRecords'),
+                    config.getint('ann', 'ShardProcesses'))
+            else:
+                annotate(input_path, 'vcf')
+
+        result_file = '../jobs/{}/{}.annot.vcf'.format(UUID, prefix)
+        if compress:
+            with job_spans.span('compress'):
+                bgzf.compress_file(result_file, result_file + '.gz')
+            result_file += '.gz'
 
         try:
-            # Upload the results file
-            s3_client.upload_file('../jobs/{}/{}.annot.vcf'.format(UUID, prefix), config['aws']['AwsS3ResultsBuckets'], '{}/{}~{}.annot.vcf'.format(path, UUID, prefix))
-            # Upload the log file
-            s3_client.upload_file('../jobs/{}/{}.vcf.count.log'.format(UUID, prefix), config['aws']['AwsS3ResultsBuckets'], '{}/{}~{}.vcf.count.log'.format(path, UUID, prefix))
+            # Upload the results file as concurrent multipart parts
+            with job_spans.span('result_upload'):
+                s3_client.upload_file(result_file, results_bucket, result_key, Config=transfer_config())
+            with open('../jobs/{}/{}.vcf.count.log'.format(UUID, prefix)) as log:
+                count_log = log.read()
         except boto3.exceptions.S3UploadFailedError:
             print('Error in uploading files!')
+            count_log = None
 
-        
-        try:
-            # Updates the job item in your DynamoDB table
-            dynamo = boto3.resource('dynamodb', region_name=config['aws']['AwsRegionName'])
-            table = dynamo.Table(config['aws']['AwsDynamoTable'])
-            table.update_item( Key= {'job_id': UUID},
-                            UpdateExpression="set job_status = :s, s3_results_bucket = :rb, s3_key_result_file = :rf, s3_key_log_file = :lf, complete_time = :ct",
-                            ExpressionAttributeValues={
-                                    ':s': 'COMPLETED',
-                                    ':rb': config['aws']['AwsS3ResultsBuckets'],
-                                    ':rf': '{}/{}~{}.annot.vcf'.format(path, UUID, prefix),
-                                    ':lf': '{}/{}~{}.vcf.count.log'.format(path, UUID, prefix),
-                                    ':ct': int(time.time())
-                                    },
-                            ReturnValues="UPDATED_NEW"
-                            )
-        except botocore.exceptions.ClientError:
-            print('Error in updating table!')
-        
-        # Send message to request queue
-        profile = helpers.get_user_profile(id=table.get_item(Key ={ 'job_id': UUID})['Item']['user_id'])
+    table = clients['table']
+    job = None
+    try:
+        # Mark the job COMPLETED, getting back the item for the notification
+        with job_spans.span('dynamodb_update'):
+            job = job_state.transition(table, UUID, job_state.JOB_STATUS, job_state.COMPLETED, {
+                's3_results_bucket': results_bucket,
+                's3_key_result_file': result_key,
+                's3_key_log_file': log_key,
+                'complete_time': int(time.time())
+            })
+    except job_state.TransitionError as e:
+        # Another run of the job got there first and has notified the user
+        print(str(e))
+    except botocore.exceptions.ClientError:
+        print('Error in updating table!')
+
+    if job is not None:
+        # Send message to request queue; util/notify looks up the user's
+        # email address
         try:
             # publish a notification message to the SNS topic
-            sns = boto3.client('sns', region_name=config['aws']['AwsRegionName'])
-            response = table.get_item(Key ={ 'job_id': UUID})['Item']
-            data = {  "job_id": response['job_id'],
-              "user_id": response['user_id'],
-              "input_file_name": response['input_file_name'],
-              "s3_inputs_bucket": response['s3_inputs_bucket'],
-              "s3_key_input_file": response['s3_key_input_file'],
-              "submit_time": int(time.time()),
-              "job_status": response['job_status'],
-              "user_email": profile[2]
-            }
-            sns.publish(TopicArn=config['aws']['AwsSNSResultsArn'], Message=json.dumps(data))
+            with job_spans.span('sns_publish'):
+                sns = clients['sns']
+                data = {  "job_id": job['job_id'],
+                  "user_id": job['user_id'],
+                  "input_file_name": job['input_file_name'],
+                  "s3_inputs_bucket": job['s3_inputs_bucket'],
+                  "s3_key_input_file": job['s3_key_input_file'],
+                  "submit_time": int(time.time()),
+                  "job_status": job['job_status']
+                }
+                sns.publish(TopicArn=config['aws']['AwsSNSResultsArn'], Message=json.dumps(data))
         except botocore.exceptions.ClientError:
             print('Error in publishing a notification!')
-        
-        # Clean up (delete) local job files
+
+        # Premium results are kept; util/archive checks the user's role
+        # again when the request is due
+        if job.get('job_class', 'free') == 'free':
+            try:
+                with job_spans.span('archive_schedule'):
+                    schedule_archive(clients['sqs'], job)
+            except botocore.exceptions.ClientError:
+                print('Error in scheduling archival!')
+
+    # Store the complete timing record with the job, and log it
+    record = job_spans.record()
+    print(json.dumps(record, sort_keys=True))
+    try:
+        table.update_item(Key={'job_id': UUID},
+            UpdateExpression="set job_timings = :t",
+            ExpressionAttributeValues={':t': record})
+    except botocore.exceptions.ClientError:
+        print('Error in updating table!')
+
+    # Upload the log file last, so the timings it ends with are the same
+    # complete record; the log upload and cache store are not in it
+    if count_log is not None:
+        count_log += 'Job timings: {}\n'.format(json.dumps(record, sort_keys=True))
         try:
-            os.system('rm -r ../jobs/{}'.format(UUID))
-        except KeyError:
-            print('File not exists!')
+            s3_client.put_object(Bucket=results_bucket, Key=log_key, Body=count_log.encode('utf-8'))
+        except botocore.exceptions.ClientError:
+            print('Error in uploading files!')
+            digest = None
+
+        # The cache keeps the log without its timings
+        if digest:
+            try:
+                cache.store(digest, results_bucket, result_key, log_key)
+            except botocore.exceptions.ClientError:
+                print('Error in caching results!')
+
+    # Clean up (delete) local job files
+    shutil.rmtree('../jobs/{}'.format(UUID), ignore_errors=True)
 
+
+if __name__ == '__main__':
+    # Call the AnnTools pipeline
+    if len(sys.argv) > 1:
+        run_job(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
     else:
         print("A valid .vcf file must be provided as input to this program.")
 ### EOF
@@ -0,0 +1,113 @@
+# scheduler.py
+#
+# Weighted fair polling of the per-class job request queues
+#
+# Premium and free requests arrive on separate queues, one per lane
+# (small, medium and large estimated runtime). Free job slots are shared
+# out between the queues by smooth weighted round robin, so under load
+# each queue gets slots in proportion to its weight, and no queue with
+# work is ever skipped entirely. A queue that is starving (its last
+# requests waited longer than starvation_secs, or it has not been polled
+# for that long) is polled before the others.
+#
+##
+
+import time
+from collections import deque
+
+# Queue waits kept per class for the wait-time metrics
+WAIT_SAMPLES = 1000
+
+
+class JobClass(object):
+    """The request queue of one job class and lane; max_running caps the
+    node's running jobs from it (0 for no cap)
+    """
+    def __init__(self, name, queue_url, weight, lane=None, max_running=0):
+        self.name = name
+        self.queue_url = queue_url
+        self.weight = weight
+        self.lane = lane
+        self.max_running = max_running
+        # Smooth weighted round robin state
+        self.current = 0
+        self.last_polled = time.time()
+        self.starving = False
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.received = 0
+
+
+"""Nearest-rank percentile of a sorted list
+"""
+def _percentile(values, pct):
+    rank = max(int(-(-pct * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+class WeightedScheduler(object):
+    """classes is a list of JobClass, highest priority first; ties in the
+    round robin go to the earlier class
+    """
+    def __init__(self, classes, starvation_secs):
+        self.classes = classes
+        self.starvation_secs = starvation_secs
+        self.total_weight = sum(job_class.weight for job_class in classes)
+
+    def _next(self):
+        for job_class in self.classes:
+            job_class.current += job_class.weight
+        chosen = max(self.classes, key=lambda job_class: job_class.current)
+        chosen.current -= self.total_weight
+        return chosen
+
+    """Receives to make for up to slots jobs: a list of (JobClass, slots)
+    Starving classes come first, with at least one slot each; the other
+    classes follow, most slots first, and classes given no slots are
+    listed last so they can take up slots the others leave unused. The
+    caller stops receiving once all its slots are taken.
+    """
+    def plan(self, slots):
+        counts = dict((job_class.name, 0) for job_class in self.classes)
+        for _ in range(slots):
+            counts[self._next().name] += 1
+
+        now = time.time()
+        starving = [job_class for job_class in self.classes if job_class.starving or
+            now - job_class.last_polled > self.starvation_secs]
+        for job_class in starving:
+            counts[job_class.name] = max(counts[job_class.name], 1)
+
+        rest = sorted((job_class for job_class in self.classes if job_class not in starving),
+            key=lambda job_class: -counts[job_class.name])
+        return [(job_class, counts[job_class.name]) for job_class in starving + rest]
+
+    """Record a receive from a class, with the queue wait in seconds of
+    each request received
+    """
+    def polled(self, job_class, waits):
+        job_class.last_polled = time.time()
+        job_class.received += len(waits)
+        job_class.waits.extend(waits)
+        if waits:
+            job_class.starving = max(waits) > self.starvation_secs
+        else:
+            # An empty queue has nothing waiting
+            job_class.starving = False
+
+    """Queue wait percentiles per class over the recent requests
+    """
+    def stats(self):
+        summary = {}
+        for job_class in self.classes:
+            waits = sorted(job_class.waits)
+            entry = {'received': job_class.received, 'starving': job_class.starving}
+            if waits:
+                entry.update({
+                    'p50_secs': round(_percentile(waits, 50), 3),
+                    'p95_secs': round(_percentile(waits, 95), 3),
+                    'max_secs': round(waits[-1], 3)
+                })
+            summary[job_class.name] = entry
+        return summary
+
+### EOF
@@ -0,0 +1,99 @@
+# shard.py
+#
+# Sharded parallel annotation of large VCF files
+#
+##
+
+import os
+import shutil
+import multiprocessing
+
+import vcf
+
+
+"""Split a VCF file into shard files in workdir
+Every shard gets the full header. In 'chrom' mode a new shard starts at
+each change of chromosome (and whenever a shard reaches shard_records
+records); in 'records' mode shards are consecutive ranges of
+shard_records records. Returns the shard names in input order.
+"""
+def split_shards(input_path, workdir, mode, shard_records):
+    header = []
+    names = []
+    shard = None
+    count = 0
+    chrom = None
+    with open(input_path) as vcf_file:
+        for line in vcf_file:
+            if not names and shard is None and line.startswith('#'):
+                header.append(line)
+                continue
+            line_chrom = line.partition('\t')[0]
+            if shard is None or count >= shard_records or \
+                (mode == 'chrom' and line_chrom != chrom):
+                if shard is not None:
+                    shard.close()
+                names.append('shard{:06d}'.format(len(names)))
+                shard = open(os.path.join(workdir, '{}.vcf'.format(names[-1])), 'w')
+                shard.writelines(header)
+                count = 0
+            shard.write(line)
+            count += 1
+            chrom = line_chrom
+    if shard is not None:
+        shard.close()
+    return names
+
+
+def _annotate_shard(args):
+    annotate, shard_path = args
+    annotate(shard_path, 'vcf')
+
+
+"""Annotate a VCF file in parallel shards
+Writes the merged results to output_path and the merged count log to
+log_path, the same files driver.run would have produced. Shards are
+annotated in a pool of processes and concatenated in input order: the
+header comes from the first shard, records from every shard. As AnnTools
+annotates each record on its own, the output is the same as that of a
+single driver.run over the whole file.
+"""
+def annotate_sharded(annotate, input_path, output_path, log_path,
+    workdir, mode, shard_records, processes):
+    shard_dir = os.path.join(workdir, 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+    try:
+        names = split_shards(input_path, shard_dir, mode, shard_records)
+        if not names:
+            # No records, nothing to shard
+            annotate(input_path, 'vcf')
+            return
+
+        tasks = [(annotate, os.path.join(shard_dir, '{}.vcf'.format(name))) for name in names]
+        if multiprocessing.current_process().daemon:
+            # Warm workers are daemonic and cannot start their own pool
+            for task in tasks:
+                _annotate_shard(task)
+        else:
+            with multiprocessing.Pool(processes or None) as pool:
+                pool.map(_annotate_shard, tasks)
+
+        # Merge the shards back together in input order
+        count_logs = []
+        with open(output_path, 'w') as output:
+            for i, name in enumerate(names):
+                with open(os.path.join(shard_dir, '{}.annot.vcf'.format(name))) as annotated:
+                    for line in annotated:
+                        if i and line.startswith('#'):
+                            continue
+                        output.write(line)
+                shard_log = os.path.join(shard_dir, '{}.vcf.count.log'.format(name))
+                if os.path.exists(shard_log):
+                    with open(shard_log) as log:
+                        count_logs.append(log.read())
+        with open(log_path, 'w') as log:
+            log.write(vcf.merge_count_logs(count_logs))
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+### EOF
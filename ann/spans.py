@@ -0,0 +1,62 @@
+# spans.py
+#
+# Per-phase timing of annotation jobs
+#
+##
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# File in a job's directory holding the phases timed by the annotator
+# before run.py takes over
+SPANS_FILE = 'spans.json'
+
+
+class Spans(object):
+    """Phase durations of one job, in milliseconds, in the order the
+    phases first ran
+    """
+    def __init__(self, job_id, phases=None):
+        self.job_id = job_id
+        self.phases = dict(phases or {})
+
+    @contextmanager
+    def span(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start)
+
+    def add(self, phase, secs):
+        self.phases[phase] = self.phases.get(phase, 0) + int(round(secs * 1000))
+
+    def record(self):
+        return {
+            'job_id': self.job_id,
+            'recorded_time': int(time.time()),
+            'phases_ms': dict(self.phases),
+            'total_ms': sum(self.phases.values())
+        }
+
+    def to_json(self):
+        return json.dumps(self.record(), sort_keys=True)
+
+    """Hand the phases timed so far to the next process via the job's
+    directory
+    """
+    def save(self, job_dir):
+        with open(os.path.join(job_dir, SPANS_FILE), 'w') as spans_file:
+            json.dump(self.phases, spans_file)
+
+    @classmethod
+    def load(cls, job_id, job_dir):
+        path = os.path.join(job_dir, SPANS_FILE)
+        if not os.path.exists(path):
+            return cls(job_id)
+        with open(path) as spans_file:
+            return cls(job_id, json.load(spans_file))
+
+### EOF
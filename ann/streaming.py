@@ -0,0 +1,151 @@
+# streaming.py
+#
+# Streaming job mode: S3 download -> annotate -> multipart upload,
+# with the three stages overlapped
+#
+##
+
+import queue
+import threading
+
+import bgzf
+import vcf
+
+# Smallest part size S3 accepts for all but the last part of an upload
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+"""Read VCF records from an S3 object as they arrive
+Puts the list of header lines on out_q first, then blocks of up to
+block_records record lines. An empty object puts nothing before the
+end. out_q is bounded, so reading pauses while annotation is behind and
+memory use stays bounded.
+"""
+def _read_blocks(s3, bucket, key, block_records, out_q, errors):
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key)['Body']
+        header = []
+        records = []
+        in_header = True
+        for raw in body.iter_lines(keepends=True):
+            line = raw.decode('utf-8')
+            if in_header and line.startswith('#'):
+                header.append(line)
+                continue
+            if in_header:
+                out_q.put(header)
+                in_header = False
+            records.append(line)
+            if len(records) >= block_records:
+                out_q.put(records)
+                records = []
+        if in_header and header:
+            out_q.put(header)
+        if records:
+            out_q.put(records)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        out_q.put(_DONE)
+
+
+"""Upload annotated output to S3 as it is produced
+Buffers annotated text until a part is at least part_size bytes, then
+uploads it as the next part of the multipart upload.
+"""
+def _upload_parts(s3, bucket, key, upload_id, part_size, in_q, parts, errors):
+    buffer = bytearray()
+    try:
+        while True:
+            data = in_q.get()
+            if data is not _DONE:
+                buffer.extend(data)
+            # Upload full parts; after the last block, whatever is left
+            if len(buffer) >= part_size or (data is _DONE and (buffer or not parts)):
+                response = s3.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id,
+                    PartNumber=len(parts) + 1, Body=bytes(buffer))
+                parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+                buffer = bytearray()
+            if data is _DONE:
+                return
+    except Exception as e:
+        errors.append(e)
+        # Keep draining so the annotating thread never blocks on a full queue
+        while data is not _DONE:
+            data = in_q.get()
+
+
+"""Annotate an S3 object and write the results to another S3 object
+The input is read as a byte stream and annotated one block of records
+at a time in workdir; each annotated block is handed to a multipart
+upload. Download, annotation and upload run concurrently, and local disk
+holds only the block being annotated. With compress set, the result
+object is written as BGZF. Returns the merged count log.
+"""
+def annotate_stream(s3, annotate, input_bucket, input_key,
+    result_bucket, result_key, workdir, block_records, part_size,
+    compress=False):
+    part_size = max(part_size, MIN_PART_SIZE)
+    errors = []
+    blocks = queue.Queue(maxsize=2)
+    annotated = queue.Queue(maxsize=2)
+    parts = []
+
+    upload_id = s3.create_multipart_upload(Bucket=result_bucket, Key=result_key)['UploadId']
+    reader = threading.Thread(target=_read_blocks,
+        args=(s3, input_bucket, input_key, block_records, blocks, errors))
+    uploader = threading.Thread(target=_upload_parts,
+        args=(s3, result_bucket, result_key, upload_id, part_size, annotated, parts, errors))
+    reader.start()
+    uploader.start()
+
+    count_logs = []
+    block = None
+    try:
+        header = blocks.get()
+        if header is _DONE:
+            block = _DONE
+            raise IOError('Empty input file: {}'.format(input_key))
+        block = blocks.get()
+        index = 0
+        # Annotate at least once, so a header with no records still
+        # gets an annotated header
+        while True:
+            records = [] if block is _DONE else block
+            annot_header, annot_records, count_log = vcf.annotate_block(
+                annotate, header, records, workdir, 'block{:06d}'.format(index))
+            count_logs.append(count_log)
+            lines = annot_records if index else annot_header + annot_records
+            data = ''.join(lines).encode('utf-8')
+            annotated.put(bgzf.compress(data) if compress else data)
+            index += 1
+            if block is _DONE:
+                break
+            block = blocks.get()
+            if block is _DONE:
+                break
+        if compress:
+            annotated.put(bgzf.EOF_BLOCK)
+    except Exception as e:
+        errors.append(e)
+        # Unblock the reader if it is waiting on a full queue
+        while block is not _DONE:
+            block = blocks.get()
+    finally:
+        annotated.put(_DONE)
+        reader.join()
+        uploader.join()
+
+    if errors:
+        s3.abort_multipart_upload(Bucket=result_bucket, Key=result_key, UploadId=upload_id)
+        raise errors[0]
+
+    s3.complete_multipart_upload(Bucket=result_bucket, Key=result_key,
+        UploadId=upload_id, MultipartUpload={'Parts': parts})
+    return vcf.merge_count_logs(count_logs)
+
+### EOF
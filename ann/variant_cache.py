@@ -0,0 +1,236 @@
+# variant_cache.py
+#
+# Per-node cache of AnnTools annotations for individual variants
+#
+# Annotations are stored per (CHROM, POS, REF, ALT) in a memory-mapped
+# SQLite database shared by every job on the node. A job only sends the
+# variants that are not in the cache through AnnTools; the cached ones
+# are filled in from the database.
+#
+##
+
+import os
+import time
+import sqlite3
+
+# Variants looked up or stored per statement
+BATCH_SIZE = 500
+
+
+def _columns(line):
+    return line.rstrip('\r\n').split('\t')
+
+
+def variant_key(columns):
+    return '\t'.join((columns[0], columns[1], columns[3], columns[4]))
+
+
+"""What AnnTools added to a record, or None if it cannot be reused
+AnnTools keeps all columns except ID and INFO, and only appends to INFO;
+records annotated in any other way are not cached.
+"""
+def annotation_of(columns, annot_columns):
+    if len(columns) < 8 or len(annot_columns) != len(columns):
+        return None
+    if annot_columns[:2] != columns[:2] or annot_columns[3:7] != columns[3:7] \
+        or annot_columns[8:] != columns[8:]:
+        return None
+    if not annot_columns[7].startswith(columns[7]):
+        return None
+    return annot_columns[2], annot_columns[7][len(columns[7]):]
+
+
+class VariantCache(object):
+    """The database is opened lazily, so the cache can be handed to the
+    shard pool's worker processes.
+    """
+    def __init__(self, path, version, max_bytes, mmap_bytes):
+        self.path = path
+        self.version = version
+        self.max_bytes = max_bytes
+        self.mmap_bytes = mmap_bytes
+        self._db = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_db'] = None
+        return state
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('PRAGMA mmap_size={}'.format(int(self.mmap_bytes)))
+            db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS variants (key TEXT PRIMARY KEY, '
+                'id TEXT, info TEXT, size INTEGER, last_used INTEGER)')
+            db.execute('CREATE INDEX IF NOT EXISTS variants_last_used ON variants (last_used)')
+
+            # Drop everything annotated against another reference version
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+            if row is None or row[0] != self.version:
+                db.execute('DELETE FROM variants')
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+            db.execute('COMMIT')
+            self._db = db
+        return self._db
+
+    """Cached (ID, INFO suffix) for each of the given keys that is cached
+    """
+    def get_many(self, keys):
+        found = {}
+        keys = list(set(keys))
+        now = int(time.time())
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = keys[i:i + BATCH_SIZE]
+            marks = ','.join('?' * len(batch))
+            rows = self.db.execute(
+                'SELECT key, id, info FROM variants WHERE key IN ({})'.format(marks),
+                batch).fetchall()
+            for key, variant_id, info in rows:
+                found[key] = (variant_id, info)
+            if rows:
+                self.db.execute(
+                    'UPDATE variants SET last_used = ? WHERE key IN ({})'.format(
+                        ','.join('?' * len(rows))),
+                    [now] + [row[0] for row in rows])
+        return found
+
+    def put_many(self, annotations):
+        now = int(time.time())
+        rows = [(key, variant_id, info, len(key) + len(variant_id) + len(info), now)
+            for key, (variant_id, info) in annotations.items()]
+        if not rows:
+            return
+        self.db.execute('BEGIN IMMEDIATE')
+        self.db.executemany('INSERT OR REPLACE INTO variants VALUES (?, ?, ?, ?, ?)', rows)
+        self.db.execute('COMMIT')
+        self.evict()
+
+    """Evict least recently used variants until the cache is within
+    max_bytes (to 90% of it, so eviction does not run on every job)
+    """
+    def evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM variants').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * 0.9)
+        self.db.execute('BEGIN IMMEDIATE')
+        cursor = self.db.execute('SELECT key, size FROM variants ORDER BY last_used')
+        evicted = []
+        for key, size in cursor:
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        cursor.close()
+        self.db.executemany('DELETE FROM variants WHERE key = ?', evicted)
+        self.db.execute('COMMIT')
+
+
+class MemoAnnotator(object):
+    """Drop-in replacement for driver.run that consults a VariantCache
+    Writes the same <prefix>.annot.vcf and <input>.count.log files as
+    driver.run. Only the variants missing from the cache are annotated
+    by AnnTools; the count log covers those and adds the number of
+    variants filled in from the cache.
+    """
+    def __init__(self, annotate, cache):
+        self.annotate = annotate
+        self.cache = cache
+
+    def __call__(self, input_path, file_type):
+        workdir = os.path.dirname(input_path)
+        prefix = os.path.basename(input_path).partition('.')[0]
+        output_path = os.path.join(workdir, '{}.annot.vcf'.format(prefix))
+        log_path = '{}.count.log'.format(input_path)
+        misses_path = os.path.join(workdir, '{}_memo.vcf'.format(prefix))
+        misses_output = os.path.join(workdir, '{}_memo.annot.vcf'.format(prefix))
+        misses_log = '{}.count.log'.format(misses_path)
+        # Annotated lines of the cached records, and an empty line for
+        # each record AnnTools has to annotate
+        hits_path = os.path.join(workdir, '{}_memo.hits'.format(prefix))
+
+        try:
+            hit_count = self._split(input_path, misses_path, hits_path)
+            self.annotate(misses_path, file_type)
+            self._learn(misses_path, misses_output)
+            self._merge(misses_output, hits_path, output_path)
+
+            with open(log_path, 'w') as log:
+                if os.path.exists(misses_log):
+                    with open(misses_log) as annotated_log:
+                        log.write(annotated_log.read())
+                log.write('Variants from annotation cache: {}\n'.format(hit_count))
+        finally:
+            for memo_file in (misses_path, misses_output, misses_log, hits_path):
+                if os.path.exists(memo_file):
+                    os.remove(memo_file)
+
+    def _split(self, input_path, misses_path, hits_path):
+        hit_count = 0
+        with open(input_path) as vcf_file, open(misses_path, 'w') as misses, \
+            open(hits_path, 'w') as hits:
+            batch = []
+            for line in vcf_file:
+                if line.startswith('#'):
+                    misses.write(line)
+                    continue
+                batch.append(line)
+                if len(batch) >= BATCH_SIZE * 10:
+                    hit_count += self._split_batch(batch, misses, hits)
+                    batch = []
+            hit_count += self._split_batch(batch, misses, hits)
+        return hit_count
+
+    def _split_batch(self, lines, misses, hits):
+        records = [_columns(line) for line in lines]
+        cached = self.cache.get_many(
+            [variant_key(columns) for columns in records if len(columns) >= 8])
+        hit_count = 0
+        for line, columns in zip(lines, records):
+            annotation = cached.get(variant_key(columns)) if len(columns) >= 8 else None
+            if annotation is None:
+                misses.write(line)
+                hits.write('\n')
+            else:
+                columns[2] = annotation[0]
+                columns[7] += annotation[1]
+                hits.write('\t'.join(columns) + '\n')
+                hit_count += 1
+        return hit_count
+
+    def _learn(self, misses_path, misses_output):
+        annotations = {}
+        with open(misses_path) as misses, open(misses_output) as annotated:
+            records = (line for line in misses if not line.startswith('#'))
+            annot_records = (line for line in annotated if not line.startswith('#'))
+            for line, annot_line in zip(records, annot_records):
+                columns = _columns(line)
+                annotation = annotation_of(columns, _columns(annot_line))
+                if annotation is not None:
+                    annotations[variant_key(columns)] = annotation
+                if len(annotations) >= BATCH_SIZE * 10:
+                    self.cache.put_many(annotations)
+                    annotations = {}
+        self.cache.put_many(annotations)
+
+    def _merge(self, misses_output, hits_path, output_path):
+        with open(misses_output) as annotated, open(hits_path) as hits, \
+            open(output_path, 'w') as output:
+            line = annotated.readline()
+            while line.startswith('#'):
+                output.write(line)
+                line = annotated.readline()
+            for hit in hits:
+                if hit == '\n':
+                    output.write(line)
+                    line = annotated.readline()
+                else:
+                    output.write(hit)
+
+### EOF
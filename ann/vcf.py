@@ -0,0 +1,82 @@
+# vcf.py
+#
+# Helpers for annotating a VCF file a block of records at a time
+#
+##
+
+import os
+import re
+
+
+"""Annotate a block of VCF records with AnnTools
+Writes the header and records to <workdir>/<name>.vcf, runs the given
+AnnTools entry point (driver.run) on it and returns the annotated
+header lines, the annotated record lines and the contents of the count
+log. Lines keep their line endings. The block's files are removed
+before returning, so at most one block is on disk at a time.
+"""
+def annotate_block(annotate, header, records, workdir, name):
+    input_path = os.path.join(workdir, '{}.vcf'.format(name))
+    output_path = os.path.join(workdir, '{}.annot.vcf'.format(name))
+    log_path = os.path.join(workdir, '{}.vcf.count.log'.format(name))
+
+    with open(input_path, 'w') as block:
+        block.writelines(header)
+        block.writelines(records)
+
+    try:
+        annotate(input_path, 'vcf')
+
+        annot_header = []
+        annot_records = []
+        with open(output_path) as annotated:
+            for line in annotated:
+                if line.startswith('#'):
+                    annot_header.append(line)
+                else:
+                    annot_records.append(line)
+        count_log = ''
+        if os.path.exists(log_path):
+            with open(log_path) as log:
+                count_log = log.read()
+    finally:
+        for block_file in (input_path, output_path, log_path):
+            if os.path.exists(block_file):
+                os.remove(block_file)
+
+    return annot_header, annot_records, count_log
+
+
+# A counter of the count log: a label, a colon and a whole number, e.g.
+# "Total number of lines: 355". Times, ratios and the job timings are not
+# counters.
+_COUNT_LINE = re.compile(r'^([^:\d][^:]*:[ \t]*)(\d+)([ \t]*\r?\n?)$')
+
+
+"""Combine the count logs of the blocks of one input file
+Counter lines are summed across blocks; all other lines are taken from
+the first block's log.
+"""
+def merge_count_logs(logs):
+    logs = [log for log in logs if log]
+    if not logs:
+        return ''
+
+    lines = logs[0].splitlines(True)
+    totals = [0] * len(lines)
+    for log in logs:
+        for i, line in enumerate(log.splitlines(True)[:len(lines)]):
+            match = _COUNT_LINE.match(line)
+            if match:
+                totals[i] += int(match.group(2))
+
+    merged = []
+    for i, line in enumerate(lines):
+        match = _COUNT_LINE.match(line)
+        if match:
+            merged.append('{}{}{}'.format(match.group(1), totals[i], match.group(3)))
+        else:
+            merged.append(line)
+    return ''.join(merged)
+
+### EOF
@@ -0,0 +1,73 @@
+# workers.py
+#
+# Pool of warm, long-lived AnnTools worker processes
+#
+##
+
+import os
+import sys
+import traceback
+import multiprocessing
+
+# The run module, imported once per worker process by _init_worker
+_run = None
+
+
+"""Prepare a worker process
+Moves into the AnnTools directory (the same working directory run.py
+gets when it is spawned with 'cd anntools'), imports AnnTools (driver)
+and run.py, which reads ann_config.ini, and creates its AWS clients.
+All of this happens once per worker instead of once per job.
+"""
+def _init_worker(anntools_dir):
+    global _run
+    os.chdir(anntools_dir)
+    sys.path.insert(0, anntools_dir)
+    import driver
+    import run
+    run.aws_clients()
+    _run = run
+
+
+"""Run one job inside a worker process
+Returns True if the job ran to completion. The working directory is
+restored after every job so a job that changes it cannot affect the next.
+"""
+def _run_job(args):
+    cwd = os.getcwd()
+    try:
+        _run.run_job(*args)
+        return True
+    except Exception:
+        traceback.print_exc()
+        return False
+    finally:
+        os.chdir(cwd)
+
+
+class WarmPool(object):
+    """Jobs are sent to the workers over the pool's IPC pipes. Workers are
+    replaced after max_jobs jobs, which bounds whatever state driver keeps
+    between runs. Workers, replacements included, are started by a fork
+    server rather than forked from the annotator: a fork copies the locks
+    its receiver and job threads hold (logging, boto3's connection pools)
+    into the child, where nothing will release them. They get the
+    annotator's environment, so backends are selected by GAS_BACKEND.
+    """
+    def __init__(self, processes, max_jobs, anntools_dir='anntools'):
+        self.pool = multiprocessing.get_context('forkserver').Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(os.path.abspath(anntools_dir),),
+            maxtasksperchild=max_jobs
+        )
+
+    def run_job(self, input_path, UUID, input_file, path):
+        # Blocks the calling thread until a worker has finished the job
+        return self.pool.apply(_run_job, ((input_path, UUID, input_file, path),))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+### EOF
@@ -0,0 +1,74 @@
+# conftest.py
+#
+# Shared fixtures of the GAS tests
+#
+# The tests import ann, util and web modules the way those processes do,
+# and run against the local backend (util/local_backend.py), so they need
+# neither an AWS account nor AnnTools.
+#
+##
+
+import os
+import sys
+import json
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# web last, so it comes first: web and util both have a helpers module
+for directory in ('util', 'ann', 'web'):
+    sys.path.insert(0, os.path.join(REPO_DIR, directory))
+
+
+"""Local backend under a fresh directory, handed out by client_pool
+"""
+@pytest.fixture
+def backend(tmp_path):
+    import client_pool
+    import local_backend
+    previous = client_pool.backend()
+    backend = local_backend.LocalBackend(str(tmp_path / 'local'))
+    client_pool.use_backend(backend)
+    yield backend
+    client_pool.use_backend(previous)
+
+
+"""The web app, on the local backend with an in-memory accounts database
+(see web_settings.py); gas can only be imported once, so it is shared by
+every test
+"""
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('web'))
+    secrets = {
+        'gas/web_server': {'flask_secret_key': 'test'},
+        'rds/accounts_database': {'username': 'gas', 'password': 'gas',
+            'host': 'localhost', 'port': 5432},
+        'globus/auth_client': {'gas_client_id': 'test', 'gas_client_secret': 'test'}
+    }
+    for secret_id, secret in secrets.items():
+        path = os.path.join(root, 'local', 'secrets', secret_id + '.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as secret_file:
+            json.dump(secret, secret_file)
+    web_dir = os.path.join(REPO_DIR, 'web')
+    os.environ.update({
+        'GAS_BACKEND': 'local',
+        'GAS_LOCAL_ROOT': os.path.join(root, 'local'),
+        'GAS_SETTINGS': 'web_settings.TestingConfig',
+        'GAS_HOST_IP': '127.0.0.1',
+        'GAS_HOST_PORT': '5000',
+        'GAS_APP_HOST': 'localhost',
+        'ACCOUNTS_DATABASE_TABLE': 'accounts',
+        # Relative to the web directory
+        'GAS_LOG_FILE_PATH': '/' + os.path.relpath(os.path.join(root, 'log'), web_dir)
+    })
+
+    import client_pool
+    client_pool.use_backend(client_pool._backend_from_env())
+    from gas import app, db
+    with app.app_context():
+        db.create_all()
+    return app
+
+### EOF
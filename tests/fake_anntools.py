@@ -0,0 +1,49 @@
+# fake_anntools.py
+#
+# Stand-in for the AnnTools driver in tests
+#
+# run() writes the same files as driver.run: <prefix>.annot.vcf next to
+# the input, with an ID and an INFO entry added to every record, and
+# <input>.count.log. Each record is annotated on its own, as by AnnTools.
+#
+##
+
+import os
+
+
+def annotate_line(line):
+    columns = line.rstrip('\n').split('\t')
+    columns[2] = 'rs{}'.format(columns[1])
+    columns[7] += ';FAKE={}'.format(columns[0])
+    return '\t'.join(columns) + '\n'
+
+
+def run(input_path, file_type):
+    workdir = os.path.dirname(input_path)
+    prefix = os.path.basename(input_path).partition('.')[0]
+    records = 0
+    with open(input_path) as vcf_file, \
+        open(os.path.join(workdir, '{}.annot.vcf'.format(prefix)), 'w') as output:
+        for line in vcf_file:
+            if line.startswith('#'):
+                if line.startswith('#CHROM'):
+                    output.write('##INFO=<ID=FAKE,Number=1,Type=String>\n')
+                output.write(line)
+            else:
+                output.write(annotate_line(line))
+                records += 1
+    with open('{}.count.log'.format(input_path), 'w') as log:
+        log.write('Total number of lines: {}\n'.format(records))
+        log.write('Annotation time: 0.01 seconds\n')
+
+
+"""Text of a VCF file with the given (CHROM, POS) records
+"""
+def vcf_text(positions):
+    lines = ['##fileformat=VCFv4.1\n',
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n']
+    for chrom, pos in positions:
+        lines.append('{}\t{}\t.\tA\tG\t50\tPASS\tDP=10\n'.format(chrom, pos))
+    return ''.join(lines)
+
+### EOF
@@ -0,0 +1,78 @@
+# test_bgzf.py
+#
+# BGZF output reads back as gzip, block by block
+#
+##
+
+import gzip
+import os
+import random
+import struct
+
+import bgzf
+
+
+"""Split BGZF data into its blocks, using each block's BSIZE field
+"""
+def _blocks(data):
+    blocks = []
+    offset = 0
+    while offset < len(data):
+        assert data[offset:offset + 4] == b'\x1f\x8b\x08\x04'
+        assert data[offset + 12:offset + 16] == b'BC\x02\x00'
+        size = struct.unpack('<H', data[offset + 16:offset + 18])[0] + 1
+        blocks.append(data[offset:offset + size])
+        offset += size
+    assert offset == len(data)
+    return blocks
+
+
+def _sample(size):
+    generator = random.Random(size)
+    lines = []
+    while sum(len(line) for line in lines) < size:
+        lines.append('chr{}\t{}\t.\tA\tG\t50\tPASS\tDP={}\n'.format(
+            generator.randint(1, 22), generator.randint(1, 10 ** 8), generator.randint(1, 99)))
+    return ''.join(lines).encode('ascii')[:size]
+
+
+def test_round_trip():
+    data = _sample(3 * bgzf.BLOCK_SIZE + 1000)
+    compressed = bgzf.compress(data) + bgzf.EOF_BLOCK
+    assert gzip.decompress(compressed) == data
+
+    blocks = _blocks(compressed)
+    assert len(blocks) == 5
+    assert blocks[-1] == bgzf.EOF_BLOCK
+    for block in blocks[:-1]:
+        assert len(block) <= 0x10000
+        assert len(gzip.decompress(block)) <= bgzf.BLOCK_SIZE
+
+
+def test_pieces_concatenate():
+    pieces = [_sample(100), _sample(bgzf.BLOCK_SIZE + 7), b'', _sample(5)]
+    compressed = b''.join(bgzf.compress(piece) for piece in pieces) + bgzf.EOF_BLOCK
+    assert gzip.decompress(compressed) == b''.join(pieces)
+
+
+def test_empty():
+    assert bgzf.compress(b'') == b''
+    assert gzip.decompress(bgzf.EOF_BLOCK) == b''
+
+
+def test_compress_file(tmp_path):
+    src_path = str(tmp_path / 'job.annot.vcf')
+    dst_path = src_path + '.gz'
+    data = _sample(2 * bgzf.BLOCK_SIZE)
+    with open(src_path, 'wb') as src:
+        src.write(data)
+    bgzf.compress_file(src_path, dst_path, level=1)
+
+    with open(dst_path, 'rb') as dst:
+        compressed = dst.read()
+    assert compressed.endswith(bgzf.EOF_BLOCK)
+    assert len(_blocks(compressed)) == 3
+    assert gzip.decompress(compressed) == data
+    assert os.path.getsize(src_path) == len(data)
+
+### EOF
@@ -0,0 +1,254 @@
+# test_cache.py
+#
+# The web tier's cache of job items and presigned URLs
+#
+##
+
+import time
+import uuid
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def cache(app):
+    import cache
+    # A fresh per-process store for every test
+    cache._store[:] = []
+    yield cache
+    cache._store[:] = []
+
+
+@pytest.fixture
+def table(backend):
+    return backend.dynamodb.create_table(TableName='annotations',
+        KeySchema=[{'AttributeName': 'job_id', 'KeyType': 'HASH'}])
+
+
+class CountingS3(object):
+    """S3 client counting the URLs it presigns
+    """
+    def __init__(self, s3):
+        self.s3 = s3
+        self.presigned = 0
+
+    def generate_presigned_url(self, *args, **kwargs):
+        self.presigned += 1
+        return self.s3.generate_presigned_url(*args, **kwargs)
+
+
+def _put(table, job_id, user_id='u1', **attributes):
+    item = dict({'job_id': job_id, 'user_id': user_id, 'submit_time': 1,
+        'job_status': 'RUNNING'}, **attributes)
+    table.put_item(Item=item)
+    return item
+
+
+def test_job_cached_until_invalidated(cache, table):
+    _put(table, 'j1')
+    assert cache.get_job(table, 'j1', 'u1')['job_status'] == 'RUNNING'
+    _put(table, 'j1', job_status='COMPLETED', complete_time=5)
+    assert cache.get_job(table, 'j1', 'u1')['job_status'] == 'RUNNING'
+
+    cache.invalidate_job('j1', 'u1')
+    assert cache.get_job(table, 'j1', 'u1')['job_status'] == 'COMPLETED'
+
+
+def test_jobs_of_other_users(cache, table):
+    _put(table, 'j1', user_id='u2')
+    assert cache.get_job(table, 'j1', 'u1') is None
+    assert cache.get_job(table, 'j1', 'u2')['user_id'] == 'u2'
+    assert cache.get_job(table, 'j1', 'u1') is None
+    assert cache.get_job(table, 'missing', 'u1') is None
+
+
+def test_invalidate_user(cache, table, backend):
+    s3 = CountingS3(backend.s3)
+    _put(table, 'j1')
+    _put(table, 'j2', user_id='u2')
+    cache.presigned_url(s3, 'j1', 'u1', 'results', 'u1/j1~a.annot.vcf')
+    for job_id, user_id in (('j1', 'u1'), ('j2', 'u2')):
+        cache.get_job(table, job_id, user_id)
+        _put(table, job_id, user_id=user_id, job_status='COMPLETED', complete_time=5)
+
+    cache.invalidate_user('u1')
+    assert cache.get_job(table, 'j1', 'u1')['job_status'] == 'COMPLETED'
+    assert cache.get_job(table, 'j2', 'u2')['job_status'] == 'RUNNING'
+    cache.presigned_url(s3, 'j1', 'u1', 'results', 'u1/j1~a.annot.vcf')
+    assert s3.presigned == 2
+
+
+def test_jobs_read_in_batches(cache, table, backend):
+    for i in range(3):
+        _put(table, 'j{}'.format(i))
+    _put(table, 'other', user_id='u2')
+    cache.get_job(table, 'j0', 'u1')
+    _put(table, 'j0', job_status='COMPLETED', complete_time=5)
+
+    reads = []
+    batch_get_item = backend.dynamodb.batch_get_item
+    backend.dynamodb.batch_get_item = lambda **kwargs: reads.append(kwargs) or batch_get_item(**kwargs)
+    jobs = cache.get_jobs(backend.dynamodb, 'annotations', ['j0', 'j1', 'j2', 'other', 'missing'], 'u1')
+    assert sorted(jobs) == ['j0', 'j1', 'j2']
+    # Cached items are not read again
+    assert jobs['j0']['job_status'] == 'RUNNING'
+    assert [len(read['RequestItems']['annotations']['Keys']) for read in reads] == [4]
+    assert cache.get_jobs(backend.dynamodb, 'annotations', ['j1', 'j2'], 'u1') == \
+        {'j1': jobs['j1'], 'j2': jobs['j2']}
+    assert len(reads) == 1
+
+
+def test_wait_for_change(cache, app):
+    seen = cache.changes('u1')
+    start = time.time()
+    assert not cache.wait_for_change('u1', seen, 0.2)
+    assert time.time() - start >= 0.2
+
+    timer = threading.Timer(0.1, cache.invalidate_job, ('j1', 'u1'))
+    timer.start()
+    start = time.time()
+    assert cache.wait_for_change('u1', seen, 5)
+    assert time.time() - start < app.config['STATUS_CHECK_SECS']
+    timer.join()
+    assert cache.changes('u1') == seen + 1
+    # Other users' changes do not count
+    cache.invalidate_user('u2')
+    assert not cache.wait_for_change('u1', seen + 1, 0)
+
+
+def test_item_ttl(cache, app):
+    active = app.config['JOB_CACHE_ACTIVE_TTL']
+    settled = app.config['JOB_CACHE_SETTLED_TTL']
+    retention = app.config['FREE_USER_DATA_RETENTION']
+    now = int(time.time())
+    assert cache._item_ttl({'job_status': 'RUNNING'}) == active
+    assert cache._item_ttl({'job_status': 'COMPLETED', 'complete_time': now,
+        'storage_status': 'RETRIEVING'}) == active
+    assert cache._item_ttl({'job_status': 'COMPLETED', 'complete_time': now,
+        'job_class': 'premium'}) == settled
+    assert cache._item_ttl({'job_status': 'COMPLETED', 'complete_time': now - 10 ** 6,
+        'storage_status': 'ARCHIVED'}) == settled
+    # Never past a free job's archival
+    ttl = cache._item_ttl({'job_status': 'COMPLETED', 'complete_time': now - retention + 60})
+    assert active <= ttl <= min(60, settled)
+    assert cache._item_ttl({'job_status': 'COMPLETED', 'complete_time': now - retention}) == active
+
+
+def test_presigned_url_cached(cache, backend):
+    s3 = CountingS3(backend.s3)
+    url = cache.presigned_url(s3, 'j1', 'u1', 'results', 'u1/j1~a.annot.vcf')
+    assert url.startswith(backend.s3.base_url + '/results/u1/j1~a.annot.vcf?')
+    assert cache.presigned_url(s3, 'j1', 'u1', 'results', 'u1/j1~a.annot.vcf') == url
+    assert s3.presigned == 1
+    # Cached per user
+    cache.presigned_url(s3, 'j1', 'u2', 'results', 'u1/j1~a.annot.vcf')
+    assert s3.presigned == 2
+
+
+def test_local_store_expiry(cache):
+    store = cache.LocalStore(10)
+    store.set('a', 1, 60)
+    store.set('b', 2, -1)
+    assert store.get('a') == 1
+    assert store.get('b') is None
+    store.delete('a')
+    assert store.get('a') is None
+    assert store.incr('gen:u1') == 1
+    assert store.incr('gen:u1') == 2
+    assert store.counter('gen:u1') == 2
+    assert store.counter('gen:u2') == 0
+
+
+def test_local_store_evicts_least_recently_used(cache):
+    store = cache.LocalStore(3)
+    store.incr('gen:u1')
+    for key in ('a', 'b', 'c'):
+        store.set(key, key, 60)
+    store.get('a')
+    store.set('d', 'd', 60)
+    assert list(store.entries) == ['c', 'a', 'd']
+
+    # Expired entries go before any that are still current
+    store.set('e', 'e', -1)
+    store.set('f', 'f', 60)
+    assert list(store.entries) == ['a', 'd', 'f']
+    assert store.counter('gen:u1') == 1
+
+
+@pytest.fixture
+def profile(app):
+    from gas import db
+    from models import Profile
+    with app.app_context():
+        profile = Profile(identity_id=uuid.uuid4(), name='n', email='e@x', role='free_user')
+        db.session.add(profile)
+        db.session.commit()
+        yield profile
+
+
+@pytest.fixture
+def shared_store(cache, app, monkeypatch):
+    # Stands in for Redis, which every worker sees
+    monkeypatch.setitem(app.config, 'JOB_CACHE_REDIS_URL', 'redis://shared')
+    cache._store[:] = [cache.LocalStore(100)]
+    return cache._store[0]
+
+
+def test_profile_cached(cache, app, profile, shared_store):
+    from gas import db
+    identity_id = str(profile.identity_id)
+    with app.test_request_context():
+        assert cache.get_profile(identity_id)['role'] == 'free_user'
+        db.session.execute(db.text("UPDATE profiles SET role = 'premium_user'"))
+        db.session.commit()
+    with app.test_request_context():
+        assert cache.get_profile(identity_id)['role'] == 'free_user'
+        cache.invalidate_profile(identity_id)
+        assert cache.get_profile(identity_id)['role'] == 'premium_user'
+    assert cache.get_profile(None) is None
+
+
+def test_profile_read_per_request_without_shared_store(cache, app, profile):
+    from gas import db
+    identity_id = str(profile.identity_id)
+    # Each request in an app context of its own, as when served
+    with app.app_context(), app.test_request_context():
+        assert cache.get_profile(identity_id)['role'] == 'free_user'
+        # Another worker's commit, which this worker does not see
+        db.session.execute(db.text("UPDATE profiles SET role = 'premium_user'"))
+        db.session.commit()
+        assert cache.get_profile(identity_id)['role'] == 'free_user'
+    with app.app_context(), app.test_request_context():
+        assert cache.get_profile(identity_id)['role'] == 'premium_user'
+    assert cache.store().get('profile:{}'.format(identity_id)) is None
+
+
+def test_profile_dropped_once_committed(cache, app, profile, shared_store):
+    from gas import db
+    identity_id = str(profile.identity_id)
+    with app.test_request_context():
+        cache.get_profile(identity_id)
+        profile.role = 'premium_user'
+        db.session.flush()
+        # Until the commit, other requests still read the old role
+        assert cache.store().get('profile:{}'.format(identity_id))['role'] == 'free_user'
+        db.session.commit()
+        assert cache.store().get('profile:{}'.format(identity_id)) is None
+        assert cache.get_profile(identity_id)['role'] == 'premium_user'
+
+
+def test_profile_kept_on_rollback(cache, app, profile, shared_store):
+    from gas import db
+    identity_id = str(profile.identity_id)
+    with app.test_request_context():
+        cache.get_profile(identity_id)
+        profile.role = 'premium_user'
+        db.session.flush()
+        db.session.rollback()
+        assert 'profiles_written' not in db.session.info
+        db.session.commit()
+        assert cache.get_profile(identity_id)['role'] == 'free_user'
+        assert cache.store().get('profile:{}'.format(identity_id)) is not None
+
+### EOF
@@ -0,0 +1,111 @@
+# test_job_state.py
+#
+# Job state moves only along its allowed transitions, once
+#
+##
+
+import json
+
+import pytest
+
+import job_state
+
+TOPIC = 'arn:aws:sns:us-east-1:000000000000:job_status'
+QUEUE = 'https://sqs.local/job_status'
+
+
+@pytest.fixture
+def table(backend):
+    return backend.dynamodb.create_table(TableName='annotations',
+        KeySchema=[{'AttributeName': 'job_id', 'KeyType': 'HASH'}])
+
+
+@pytest.fixture
+def events(backend):
+    backend.sns.subscribe(TopicArn=TOPIC, Protocol='sqs', Endpoint=QUEUE)
+    job_state.publish_events(backend.sns, TOPIC)
+    yield backend.sqs
+    job_state._events.clear()
+
+
+def _job(table, job_id='j1'):
+    return job_state.create(table, {'job_id': job_id, 'user_id': 'u1', 'submit_time': 1})
+
+
+def test_create(table):
+    item = _job(table)
+    assert item[job_state.JOB_STATUS] == job_state.PENDING
+    assert table.get_item(Key={'job_id': 'j1'})['Item'] == item
+    with pytest.raises(job_state.TransitionError) as error:
+        _job(table)
+    assert error.value.item is None
+
+
+def test_job_status_transitions(table):
+    _job(table)
+    item = job_state.transition(table, 'j1', job_state.JOB_STATUS, job_state.RUNNING)
+    assert item[job_state.JOB_STATUS] == job_state.RUNNING
+    # A redelivered request runs the job again
+    job_state.transition(table, 'j1', job_state.JOB_STATUS, job_state.RUNNING)
+    item = job_state.transition(table, 'j1', job_state.JOB_STATUS, job_state.COMPLETED,
+        {'complete_time': 5, 's3_key_result_file': 'u1/j1~input.annot.vcf'})
+    assert item == dict(table.get_item(Key={'job_id': 'j1'})['Item'])
+    assert (item[job_state.JOB_STATUS], item['complete_time']) == (job_state.COMPLETED, 5)
+
+
+@pytest.mark.parametrize('path,state', [
+    ((), job_state.COMPLETED),
+    ((job_state.RUNNING, job_state.COMPLETED), job_state.RUNNING),
+    ((job_state.RUNNING, job_state.COMPLETED), job_state.COMPLETED),
+])
+def test_job_status_conflicts(table, path, state):
+    _job(table)
+    for step in path:
+        job_state.transition(table, 'j1', job_state.JOB_STATUS, step)
+    before = table.get_item(Key={'job_id': 'j1'})['Item']
+
+    with pytest.raises(job_state.TransitionError) as error:
+        job_state.transition(table, 'j1', job_state.JOB_STATUS, state, {'complete_time': 9})
+    # The error carries the job as it stands, which is left unchanged
+    assert error.value.item == before
+    assert (error.value.field, error.value.state) == (job_state.JOB_STATUS, state)
+    assert table.get_item(Key={'job_id': 'j1'})['Item'] == before
+
+
+def test_missing_job(table):
+    with pytest.raises(job_state.TransitionError) as error:
+        job_state.transition(table, 'nope', job_state.JOB_STATUS, job_state.RUNNING)
+    assert error.value.item is None
+    assert 'Item' not in table.get_item(Key={'job_id': 'nope'})
+
+
+def test_storage_status_transitions(table):
+    _job(table)
+    with pytest.raises(job_state.TransitionError):
+        job_state.transition(table, 'j1', job_state.STORAGE_STATUS, job_state.RETRIEVING)
+    for state in (job_state.ARCHIVED, job_state.RETRIEVING, job_state.RESTORED, job_state.ARCHIVED):
+        item = job_state.transition(table, 'j1', job_state.STORAGE_STATUS, state)
+        assert item[job_state.STORAGE_STATUS] == state
+    # Only one of two archivers racing on a job moves it
+    with pytest.raises(job_state.TransitionError) as error:
+        job_state.transition(table, 'j1', job_state.STORAGE_STATUS, job_state.ARCHIVED)
+    assert error.value.item[job_state.STORAGE_STATUS] == job_state.ARCHIVED
+
+
+def test_changes_are_announced(table, events):
+    _job(table)
+    job_state.transition(table, 'j1', job_state.JOB_STATUS, job_state.RUNNING)
+    with pytest.raises(job_state.TransitionError):
+        job_state.transition(table, 'j1', job_state.JOB_STATUS, job_state.PENDING)
+    job_state.transition(table, 'j1', job_state.JOB_STATUS, job_state.COMPLETED,
+        {'complete_time': 5})
+
+    messages = events.receive_message(QueueUrl=QUEUE, MaxNumberOfMessages=10)['Messages']
+    announced = [json.loads(json.loads(message['Body'])['Message']) for message in messages]
+    assert announced == [
+        {'job_id': 'j1', 'user_id': 'u1', 'job_status': job_state.PENDING},
+        {'job_id': 'j1', 'user_id': 'u1', 'job_status': job_state.RUNNING},
+        {'job_id': 'j1', 'user_id': 'u1', 'job_status': job_state.COMPLETED, 'complete_time': 5}
+    ]
+
+### EOF
@@ -0,0 +1,119 @@
+# test_local_backend.py
+#
+# Local S3 keeps objects inside their bucket and checks presigned requests
+#
+##
+
+import os
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+from botocore.exceptions import ClientError
+
+
+def _code(error):
+    return error.value.response['Error']['Code']
+
+
+def test_nested_keys(backend):
+    s3 = backend.s3
+    s3.put_object(Bucket='inputs', Key='u1/job~input.vcf', Body=b'data')
+    assert s3.get_object(Bucket='inputs', Key='u1/job~input.vcf')['Body'].read() == b'data'
+    assert os.path.isfile(os.path.join(s3.root, 'inputs', 'u1', 'job~input.vcf'))
+    assert s3.list_objects(Bucket='inputs')['Contents'] == [{'Key': 'u1/job~input.vcf', 'Size': 4}]
+
+
+@pytest.mark.parametrize('bucket,key', [
+    ('inputs', '../results/u1/job.vcf'),
+    ('inputs', 'u1/../../results/job.vcf'),
+    ('inputs', 'u1/./job.vcf'),
+    ('inputs', '/etc/passwd'),
+    ('..', 'inputs/job.vcf'),
+    ('inputs/u1', 'job.vcf'),
+    ('', 'job.vcf'),
+])
+def test_keys_outside_bucket_are_refused(backend, bucket, key):
+    s3 = backend.s3
+    with pytest.raises(ClientError) as error:
+        s3.put_object(Bucket=bucket, Key=key, Body=b'data')
+    assert _code(error) == 'InvalidArgument'
+    for call in (s3.get_object, s3.head_object, s3.delete_object):
+        with pytest.raises(ClientError) as error:
+            call(Bucket=bucket, Key=key)
+        assert _code(error) == 'InvalidArgument'
+    s3.put_object(Bucket='inputs', Key='u1/job.vcf', Body=b'data')
+    with pytest.raises(ClientError) as error:
+        s3.copy({'Bucket': 'inputs', 'Key': 'u1/job.vcf'}, bucket, key)
+    assert _code(error) == 'InvalidArgument'
+
+
+def test_links_outside_bucket_are_refused(backend, tmp_path):
+    s3 = backend.s3
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    (outside / 'secret').write_bytes(b'secret')
+    s3.put_object(Bucket='inputs', Key='u1/job.vcf', Body=b'data')
+    os.symlink(str(outside), os.path.join(s3.root, 'inputs', 'u1', 'link'))
+
+    with pytest.raises(ClientError) as error:
+        s3.get_object(Bucket='inputs', Key='u1/link/secret')
+    assert _code(error) == 'InvalidArgument'
+    with pytest.raises(ClientError):
+        s3.put_object(Bucket='inputs', Key='u1/link/new', Body=b'data')
+    assert not os.path.exists(str(outside / 'new'))
+
+
+def test_presigned_url(backend):
+    s3 = backend.s3
+    url = s3.generate_presigned_url('get_object',
+        Params={'Bucket': 'results', 'Key': 'u1/job~input.annot.vcf'}, ExpiresIn=60)
+    params = dict(parse_qsl(urlsplit(url).query))
+    s3.check_presigned_url('results', 'u1/job~input.annot.vcf', params)
+
+    for bucket, key, changed in (
+        ('results', 'u2/job~input.annot.vcf', {}),
+        ('inputs', 'u1/job~input.annot.vcf', {}),
+        ('results', 'u1/job~input.annot.vcf', {'Expires': str(int(params['Expires']) + 3600)}),
+        ('results', 'u1/job~input.annot.vcf', {'Signature': ''})):
+        with pytest.raises(ClientError) as error:
+            s3.check_presigned_url(bucket, key, dict(params, **changed))
+        assert _code(error) == 'SignatureDoesNotMatch'
+
+
+def test_presigned_url_expires(backend):
+    s3 = backend.s3
+    url = s3.generate_presigned_url('get_object',
+        Params={'Bucket': 'results', 'Key': 'u1/job.vcf'}, ExpiresIn=-1)
+    with pytest.raises(ClientError) as error:
+        s3.check_presigned_url('results', 'u1/job.vcf', dict(parse_qsl(urlsplit(url).query)))
+    assert _code(error) == 'AccessDenied'
+
+
+def test_presigned_post(backend):
+    s3 = backend.s3
+    post = s3.generate_presigned_post(Bucket='inputs', Key='u1/job~${filename}',
+        Fields={'success_action_redirect': 'http://gas/annotate/job'},
+        Conditions=[{'success_action_redirect': 'http://gas/annotate/job'}], ExpiresIn=60)
+    form = post['fields']
+    s3.check_presigned_post('inputs', 'u1/job~input.vcf', form)
+
+    for bucket, key, changed in (
+        ('inputs', 'u2/job~input.vcf', {}),
+        ('results', 'u1/job~input.vcf', {}),
+        ('inputs', 'u1/job~input.vcf', {'success_action_redirect': 'http://evil/'})):
+        with pytest.raises(ClientError) as error:
+            s3.check_presigned_post(bucket, key, dict(form, **changed))
+        assert _code(error) == 'AccessDenied'
+    with pytest.raises(ClientError) as error:
+        s3.check_presigned_post('inputs', 'u1/job~input.vcf', dict(form, signature='0' * 64))
+    assert _code(error) == 'SignatureDoesNotMatch'
+
+
+def test_signing_key_is_shared(backend):
+    import local_backend
+    other = local_backend.LocalS3(backend.s3.root)
+    url = backend.s3.generate_presigned_url('get_object',
+        Params={'Bucket': 'results', 'Key': 'k'}, ExpiresIn=60)
+    other.check_presigned_url('results', 'k', dict(parse_qsl(urlsplit(url).query)))
+
+### EOF
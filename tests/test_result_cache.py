@@ -0,0 +1,145 @@
+# test_result_cache.py
+#
+# Results cache hits, misses and eviction, against the local backend
+#
+##
+
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+import result_cache
+
+BUCKET = 'results'
+CACHE_BUCKET = 'results-cache'
+RESULT = b'#CHROM\tPOS\nchr1\t1\n' * 50
+LOG = b'Total number of lines: 50\nJob timings: download=0.1s annotate=0.2s\n'
+
+
+@pytest.fixture
+def table(backend):
+    return backend.dynamodb.create_table(TableName='results_cache',
+        KeySchema=[{'AttributeName': 'digest', 'KeyType': 'HASH'}])
+
+
+def _cache(backend, table, max_bytes=10 ** 9, max_age=3600):
+    return result_cache.ResultCache(backend.s3, table, CACHE_BUCKET, 'cache/',
+        max_bytes, max_age)
+
+
+"""Upload the results of job to the results bucket; returns their keys
+"""
+def _job(backend, job, result=RESULT):
+    result_key = 'u1/{}~input.annot.vcf'.format(job)
+    log_key = 'u1/{}~input.vcf.count.log'.format(job)
+    backend.s3.put_object(Bucket=BUCKET, Key=result_key, Body=result)
+    backend.s3.put_object(Bucket=BUCKET, Key=log_key, Body=LOG)
+    return result_key, log_key
+
+
+def _read(backend, key, bucket=BUCKET):
+    return backend.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+def test_input_digest(tmp_path):
+    path = tmp_path / 'input.vcf'
+    path.write_bytes(RESULT)
+    digest = result_cache.input_digest(str(path), '1.0')
+    assert digest == result_cache.input_digest(str(path), '1.0')
+    assert digest != result_cache.input_digest(str(path), '1.1')
+
+
+def test_store_then_fetch(backend, table):
+    cache = _cache(backend, table)
+    cache.store('d1', BUCKET, *_job(backend, 'job1'))
+
+    result_key, log_key = 'u1/job2~input.annot.vcf', 'u1/job2~input.vcf.count.log'
+    assert cache.fetch('d1', BUCKET, result_key, log_key)
+    assert _read(backend, result_key) == RESULT
+    # The cached log leaves out the timings of the job that wrote it
+    assert _read(backend, log_key) == b'Total number of lines: 50\n'
+    assert not cache.fetch('d2', BUCKET, result_key, log_key)
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 1, 0)
+    assert stats['bytes'] == len(RESULT)
+    assert table.get_item(Key={'digest': 'd1'})['Item']['hits'] == 1
+
+
+def test_store_twice_counts_once(backend, table):
+    cache = _cache(backend, table)
+    cache.store('d1', BUCKET, *_job(backend, 'job1'))
+    cache.store('d1', BUCKET, *_job(backend, 'job2'))
+    assert cache.stats()['bytes'] == len(RESULT)
+
+
+def test_expired_entry_is_evicted(backend, table):
+    cache = _cache(backend, table, max_age=60)
+    cache.store('d1', BUCKET, *_job(backend, 'job1'))
+    entry = table.get_item(Key={'digest': 'd1'})['Item']
+    table.update_item(Key={'digest': 'd1'}, UpdateExpression='SET created = :t',
+        ExpressionAttributeValues={':t': int(time.time()) - 120})
+
+    assert not cache.fetch('d1', BUCKET, *_job(backend, 'job2'))
+    assert 'Item' not in table.get_item(Key={'digest': 'd1'})
+    with pytest.raises(ClientError):
+        _read(backend, entry['result_key'], CACHE_BUCKET)
+    stats = cache.stats()
+    assert (stats['misses'], stats['evictions'], stats['bytes']) == (1, 1, 0)
+
+
+def test_missing_objects_are_a_miss(backend, table):
+    cache = _cache(backend, table)
+    cache.store('d1', BUCKET, *_job(backend, 'job1'))
+    entry = table.get_item(Key={'digest': 'd1'})['Item']
+    backend.s3.delete_object(Bucket=CACHE_BUCKET, Key=entry['result_key'])
+
+    assert not cache.fetch('d1', BUCKET, *_job(backend, 'job2'))
+    assert 'Item' not in table.get_item(Key={'digest': 'd1'})
+    assert cache.stats()['misses'] == 1
+
+
+def test_evicts_least_recently_hit(backend, table):
+    cache = _cache(backend, table, max_bytes=int(len(RESULT) * 2.5))
+    cache.store('d1', BUCKET, *_job(backend, 'job1'))
+    cache.store('d2', BUCKET, *_job(backend, 'job2'))
+    now = int(time.time())
+    for digest, last_hit in (('d1', now + 100), ('d2', now - 100)):
+        table.update_item(Key={'digest': digest}, UpdateExpression='SET last_hit = :t',
+            ExpressionAttributeValues={':t': last_hit})
+
+    # The third entry takes the cache over max_bytes
+    cache.store('d3', BUCKET, *_job(backend, 'job3'))
+    assert 'Item' in table.get_item(Key={'digest': 'd1'})
+    assert 'Item' not in table.get_item(Key={'digest': 'd2'})
+    assert 'Item' in table.get_item(Key={'digest': 'd3'})
+    stats = cache.stats()
+    assert (stats['evictions'], stats['bytes']) == (1, 2 * len(RESULT))
+
+
+def test_evict_skips_replaced_entry(backend, table):
+    cache = _cache(backend, table)
+    cache.store('d1', BUCKET, *_job(backend, 'job1'))
+    stale = dict(table.get_item(Key={'digest': 'd1'})['Item'])
+    # Another node evicted the entry and cached the input again since
+    table.update_item(Key={'digest': 'd1'}, UpdateExpression='SET created = :t',
+        ExpressionAttributeValues={':t': int(stale['created']) + 1})
+
+    cache._evict(stale)
+    assert 'Item' in table.get_item(Key={'digest': 'd1'})
+    assert _read(backend, stale['result_key'], CACHE_BUCKET) == RESULT
+    stats = cache.stats()
+    assert (stats['evictions'], stats['bytes']) == (0, len(RESULT))
+
+
+def test_stats_are_sharded(backend, table):
+    cache = _cache(backend, table)
+    for _ in range(50):
+        cache.fetch('missing', BUCKET, 'u1/a~b.annot.vcf', 'u1/a~b.vcf.count.log')
+    shards = [table.get_item(Key={'digest': '{}{}'.format(result_cache.STATS_KEY, shard)})
+        for shard in range(result_cache.STATS_SHARDS)]
+    assert sum(1 for shard in shards if 'Item' in shard) > 1
+    assert cache.stats()['misses'] == 50
+
+### EOF
@@ -0,0 +1,82 @@
+# test_scheduler.py
+#
+# Job slots are shared out by weight, and starving queues go first
+#
+##
+
+import time
+
+import scheduler
+
+
+def _classes():
+    return [
+        scheduler.JobClass('premium_small', 'q/premium_small', 4, 'small'),
+        scheduler.JobClass('free_small', 'q/free_small', 2, 'small'),
+        scheduler.JobClass('free_large', 'q/free_large', 1, 'large')
+    ]
+
+
+def _counts(plan):
+    return dict((job_class.name, slots) for job_class, slots in plan)
+
+
+def test_slots_follow_weights():
+    classes = _classes()
+    weighted = scheduler.WeightedScheduler(classes, starvation_secs=60)
+    totals = dict((job_class.name, 0) for job_class in classes)
+    for _ in range(70):
+        for name, slots in _counts(weighted.plan(1)).items():
+            totals[name] += slots
+    assert totals == {'premium_small': 40, 'free_small': 20, 'free_large': 10}
+
+
+def test_no_queue_skipped_for_long():
+    weighted = scheduler.WeightedScheduler(_classes(), starvation_secs=60)
+    # The lightest class gets a slot in every round of total_weight slots
+    for _ in range(10):
+        assert _counts(weighted.plan(7))['free_large'] == 1
+
+
+def test_plan_order():
+    weighted = scheduler.WeightedScheduler(_classes(), starvation_secs=60)
+    plan = weighted.plan(2)
+    # Most slots first; classes without slots last, to take up unused ones
+    assert [job_class.name for job_class, _ in plan] == ['premium_small', 'free_small', 'free_large']
+    assert [slots for _, slots in plan] == [1, 1, 0]
+
+
+def test_starving_class_goes_first():
+    classes = _classes()
+    weighted = scheduler.WeightedScheduler(classes, starvation_secs=60)
+    free_large = classes[2]
+    weighted.polled(free_large, [75.0, 3.0])
+    assert free_large.starving
+
+    plan = weighted.plan(1)
+    assert plan[0] == (free_large, 1)
+    assert sum(slots for _, slots in plan) == 2
+
+    weighted.polled(free_large, [])
+    assert not free_large.starving
+    assert weighted.plan(1)[0][0] is not free_large
+
+
+def test_unpolled_class_is_starving():
+    classes = _classes()
+    weighted = scheduler.WeightedScheduler(classes, starvation_secs=60)
+    classes[1].last_polled = time.time() - 120
+    plan = weighted.plan(1)
+    assert plan[0] == (classes[1], 1)
+
+
+def test_stats():
+    classes = _classes()
+    weighted = scheduler.WeightedScheduler(classes, starvation_secs=60)
+    weighted.polled(classes[0], [float(wait) for wait in range(1, 101)])
+    stats = weighted.stats()
+    assert stats['premium_small'] == {'received': 100, 'starving': True,
+        'p50_secs': 50.0, 'p95_secs': 95.0, 'max_secs': 100.0}
+    assert stats['free_small'] == {'received': 0, 'starving': False}
+
+### EOF
@@ -0,0 +1,87 @@
+# test_shard.py
+#
+# Sharded annotation gives the same results as annotating the whole file
+#
+##
+
+import os
+
+import pytest
+
+import fake_anntools
+import shard
+import vcf
+
+POSITIONS = [('chr1', pos) for pos in range(1, 8)] + \
+    [('chr2', pos) for pos in range(1, 4)] + [('chrX', 5)]
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    path = tmp_path / 'job.vcf'
+    path.write_text(fake_anntools.vcf_text(POSITIONS))
+    return str(path)
+
+
+def _records(path):
+    with open(path) as vcf_file:
+        return [line for line in vcf_file if not line.startswith('#')]
+
+
+def test_split_by_chromosome(input_path, tmp_path):
+    names = shard.split_shards(input_path, str(tmp_path), 'chrom', 5)
+    shards = [_records(str(tmp_path / '{}.vcf'.format(name))) for name in names]
+    # chr1 is split at 5 records; every shard holds one chromosome
+    assert [len(records) for records in shards] == [5, 2, 3, 1]
+    for records in shards:
+        assert len(set(line.partition('\t')[0] for line in records)) == 1
+    assert sum(shards, []) == _records(input_path)
+
+
+def test_split_by_records(input_path, tmp_path):
+    names = shard.split_shards(input_path, str(tmp_path), 'records', 4)
+    shards = [_records(str(tmp_path / '{}.vcf'.format(name))) for name in names]
+    assert [len(records) for records in shards] == [4, 4, 3]
+    assert sum(shards, []) == _records(input_path)
+    with open(str(tmp_path / '{}.vcf'.format(names[-1]))) as last:
+        assert last.readline() == '##fileformat=VCFv4.1\n'
+
+
+def test_split_header_only(tmp_path):
+    path = tmp_path / 'empty.vcf'
+    path.write_text(fake_anntools.vcf_text([]))
+    assert shard.split_shards(str(path), str(tmp_path), 'chrom', 5) == []
+
+
+@pytest.mark.parametrize('mode,processes', [('chrom', 2), ('records', 1)])
+def test_sharded_matches_whole_file(input_path, tmp_path, mode, processes):
+    whole_dir = tmp_path / 'whole'
+    whole_dir.mkdir()
+    whole_path = str(whole_dir / 'job.vcf')
+    with open(input_path) as src, open(whole_path, 'w') as dst:
+        dst.write(src.read())
+    fake_anntools.run(whole_path, 'vcf')
+
+    output_path = str(tmp_path / 'job.annot.vcf')
+    log_path = str(tmp_path / 'job.vcf.count.log')
+    shard.annotate_sharded(fake_anntools.run, input_path, output_path, log_path,
+        str(tmp_path), mode, 3, processes)
+
+    with open(str(whole_dir / 'job.annot.vcf')) as whole, open(output_path) as sharded:
+        assert sharded.read() == whole.read()
+    with open(whole_path + '.count.log') as whole, open(log_path) as sharded:
+        assert sharded.read() == whole.read()
+    assert not os.path.exists(str(tmp_path / 'shards'))
+
+
+def test_merge_count_logs():
+    logs = [
+        'Total number of lines: 3\nAnnotation time: 0.5 seconds\nJob timings: 1.5\n',
+        'Total number of lines: 4\nAnnotation time: 0.7 seconds\nJob timings: 2.5\n',
+        ''
+    ]
+    assert vcf.merge_count_logs(logs) == \
+        'Total number of lines: 7\nAnnotation time: 0.5 seconds\nJob timings: 1.5\n'
+    assert vcf.merge_count_logs(['', '']) == ''
+
+### EOF
@@ -0,0 +1,57 @@
+# test_streaming.py
+#
+# Streaming job mode against the local backend, with the fake AnnTools
+#
+##
+
+import gzip
+
+import pytest
+from botocore.exceptions import ClientError
+
+import fake_anntools
+import streaming
+
+
+def _annotate(backend, tmp_path, text, compress=False, block_records=2):
+    backend.s3.put_object(Bucket='inputs', Key='u1/job~input.vcf', Body=text.encode('utf-8'))
+    count_log = streaming.annotate_stream(backend.s3, fake_anntools.run,
+        'inputs', 'u1/job~input.vcf', 'results', 'u1/job~input.annot.vcf',
+        str(tmp_path), block_records, 0, compress)
+    return backend.s3.get_object(Bucket='results', Key='u1/job~input.annot.vcf')['Body'].read(), count_log
+
+
+def test_blocks_annotated_in_order(backend, tmp_path):
+    positions = [('chr1', pos) for pos in range(1, 6)]
+    result, count_log = _annotate(backend, tmp_path, fake_anntools.vcf_text(positions))
+    lines = result.decode('utf-8').splitlines(True)
+    assert lines[:3] == ['##fileformat=VCFv4.1\n', '##INFO=<ID=FAKE,Number=1,Type=String>\n',
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n']
+    records = fake_anntools.vcf_text(positions).splitlines(True)[2:]
+    assert lines[3:] == [fake_anntools.annotate_line(line) for line in records]
+    assert 'Total number of lines: 5' in count_log
+
+
+def test_compressed(backend, tmp_path):
+    text = fake_anntools.vcf_text([('chr2', 7), ('chr2', 9), ('chr2', 11)])
+    result, _ = _annotate(backend, tmp_path, text, compress=True)
+    assert gzip.decompress(result).decode('utf-8').endswith(
+        fake_anntools.annotate_line(text.splitlines(True)[-1]))
+
+
+def test_header_only(backend, tmp_path):
+    result, _ = _annotate(backend, tmp_path, fake_anntools.vcf_text([]))
+    assert result.decode('utf-8') == ('##fileformat=VCFv4.1\n'
+        '##INFO=<ID=FAKE,Number=1,Type=String>\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+
+
+def test_empty_object(backend, tmp_path):
+    with pytest.raises(IOError) as error:
+        _annotate(backend, tmp_path, '')
+    assert 'Empty input file' in str(error.value)
+    # The multipart upload was aborted
+    with pytest.raises(ClientError):
+        backend.s3.head_object(Bucket='results', Key='u1/job~input.annot.vcf')
+
+### EOF
@@ -0,0 +1,110 @@
+# test_variant_cache.py
+#
+# The variant memo cache splits records into hits and misses and merges
+# them back into the output AnnTools would have written
+#
+##
+
+import os
+
+import pytest
+
+import fake_anntools
+import variant_cache
+
+
+class Recorder(object):
+    """fake_anntools.run, remembering the records it annotated
+    """
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, input_path, file_type):
+        with open(input_path) as vcf_file:
+            self.records.extend(line for line in vcf_file if not line.startswith('#'))
+        fake_anntools.run(input_path, file_type)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return variant_cache.VariantCache(str(tmp_path / 'cache' / 'variants.db'), 'hg19',
+        10 ** 9, 2 ** 20)
+
+
+"""Annotate positions with annotate; returns the output and count log
+"""
+def _annotate(annotate, workdir, positions):
+    os.makedirs(workdir, exist_ok=True)
+    input_path = os.path.join(workdir, 'job.vcf')
+    with open(input_path, 'w') as vcf_file:
+        vcf_file.write(fake_anntools.vcf_text(positions))
+    annotate(input_path, 'vcf')
+    with open(os.path.join(workdir, 'job.annot.vcf')) as output, \
+        open(input_path + '.count.log') as log:
+        return output.read(), log.read()
+
+
+def test_annotation_of():
+    columns = ['chr1', '5', '.', 'A', 'G', '50', 'PASS', 'DP=10']
+    annotated = ['chr1', '5', 'rs5', 'A', 'G', '50', 'PASS', 'DP=10;FAKE=chr1']
+    assert variant_cache.annotation_of(columns, annotated) == ('rs5', ';FAKE=chr1')
+    # Anything but ID and an appended INFO cannot be reused
+    assert variant_cache.annotation_of(columns, annotated[:5] + ['60'] + annotated[6:]) is None
+    assert variant_cache.annotation_of(columns, annotated[:7] + ['DP=1']) is None
+    assert variant_cache.annotation_of(columns, annotated + ['GT']) is None
+
+
+def test_split_and_merge(cache, tmp_path):
+    first = [('chr1', pos) for pos in range(1, 11)]
+    second = [('chr1', pos) for pos in range(6, 16)] + [('chr2', 3)]
+
+    recorder = Recorder()
+    memo = variant_cache.MemoAnnotator(recorder, cache)
+    output, log = _annotate(memo, str(tmp_path / 'first'), first)
+    assert output == _annotate(fake_anntools.run, str(tmp_path / 'plain1'), first)[0]
+    assert len(recorder.records) == 10
+    assert log.endswith('Variants from annotation cache: 0\n')
+
+    recorder.records = []
+    output, log = _annotate(memo, str(tmp_path / 'second'), second)
+    # Cached records are filled in, in input order, the rest annotated
+    assert output == _annotate(fake_anntools.run, str(tmp_path / 'plain2'), second)[0]
+    assert [line.split('\t')[:2] for line in recorder.records] == \
+        [['chr1', str(pos)] for pos in range(11, 16)] + [['chr2', '3']]
+    assert log.startswith('Total number of lines: 6\n')
+    assert log.endswith('Variants from annotation cache: 5\n')
+    assert sorted(os.listdir(str(tmp_path / 'second'))) == \
+        ['job.annot.vcf', 'job.vcf', 'job.vcf.count.log']
+
+
+def test_all_cached(cache, tmp_path):
+    positions = [('chrX', pos) for pos in range(1, 4)]
+    memo = variant_cache.MemoAnnotator(fake_anntools.run, cache)
+    expected = _annotate(memo, str(tmp_path / 'first'), positions)[0]
+
+    recorder = Recorder()
+    memo = variant_cache.MemoAnnotator(recorder, cache)
+    output, log = _annotate(memo, str(tmp_path / 'second'), positions)
+    assert output == expected
+    assert recorder.records == []
+    assert log.endswith('Variants from annotation cache: 3\n')
+
+
+def test_version_change_empties_cache(cache, tmp_path):
+    cache.put_many({'chr1\t1\tA\tG': ('rs1', ';FAKE=chr1')})
+    assert cache.get_many(['chr1\t1\tA\tG'])
+    other = variant_cache.VariantCache(cache.path, 'hg38', cache.max_bytes, cache.mmap_bytes)
+    assert other.get_many(['chr1\t1\tA\tG']) == {}
+
+
+def test_evicts_least_recently_used(cache):
+    keys = ['chr1\t{}\tA\tG'.format(pos) for pos in range(10)]
+    cache.put_many(dict((key, ('rs', ';FAKE=chr1')) for key in keys))
+    size = cache.db.execute('SELECT size FROM variants LIMIT 1').fetchone()[0]
+    cache.db.execute('UPDATE variants SET last_used = 0 WHERE key IN (?, ?)', keys[:2])
+
+    cache.max_bytes = size * 9
+    cache.evict()
+    assert set(cache.get_many(keys)) == set(keys[2:])
+
+### EOF
@@ -0,0 +1,165 @@
+# test_views.py
+#
+# The annotations list: filters, sort orders and paging; the job status
+# API; and pages that go by the user's role
+#
+##
+
+import calendar
+import time
+import uuid
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def table(app, backend):
+    return backend.dynamodb.create_table(TableName=app.config['AWS_DYNAMODB_ANNOTATIONS_TABLE'],
+        KeySchema=[{'AttributeName': 'job_id', 'KeyType': 'HASH'}],
+        GlobalSecondaryIndexes=[
+            {'IndexName': app.config[index], 'KeySchema': [
+                {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+                {'AttributeName': sort, 'KeyType': 'RANGE'}]}
+            for index, sort in (('AWS_DYNAMODB_USER_INDEX', 'submit_time'),
+                ('AWS_DYNAMODB_USER_COMPLETE_INDEX', 'complete_time'))])
+
+
+@pytest.fixture
+def client(app, table):
+    import cache
+    cache._store[:] = []
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(is_authenticated=True, primary_identity='u1', name='n', email='e@x')
+    return client
+
+
+def _put(table, job_id, submit_time, job_status='RUNNING', **attributes):
+    table.put_item(Item=dict({'job_id': job_id, 'user_id': 'u1', 'submit_time': submit_time,
+        'input_file_name': 'input.vcf', 'job_status': job_status}, **attributes))
+
+
+def test_complete_time_sort_lists_completed_jobs(client, table):
+    _put(table, 'running-job', 10)
+    _put(table, 'completed-job', 5, 'COMPLETED', complete_time=20)
+    for status in ('PENDING', 'RUNNING'):
+        response = client.get('/annotations?sort=complete_time&status=' + status)
+        assert response.status_code == 400
+
+    for query in ('sort=complete_time', 'sort=complete_time&status=COMPLETED'):
+        page = client.get('/annotations?' + query).get_data(as_text=True)
+        assert 'completed-job' in page and 'running-job' not in page
+
+
+def test_page_reads_are_capped(app, client, table, monkeypatch):
+    monkeypatch.setitem(app.config, 'ANNOTATIONS_PAGE_SIZE', 2)
+    monkeypatch.setitem(app.config, 'ANNOTATIONS_PAGE_MAX_READS', 3)
+    _put(table, 'completed-job', 1, 'COMPLETED', complete_time=100)
+    for i in range(10):
+        _put(table, 'running-job-{}'.format(i), 10 + i)
+
+    queries = []
+    query = type(table).query
+    monkeypatch.setattr(type(table), 'query',
+        lambda self, **kwargs: queries.append(kwargs) or query(self, **kwargs))
+    url = '/annotations?status=COMPLETED'
+    pages = []
+    while url:
+        queries[:] = []
+        page = client.get(url).get_data(as_text=True)
+        assert len(queries) <= 3
+        pages.append(page)
+        url = None
+        if 'Next page' in page:
+            url = page.split('<li class="next"><a href="')[1].split('"')[0].replace('&amp;', '&')
+    # Six jobs read per page, the completed job being the last of eleven
+    assert len(pages) == 2
+    assert 'No annotations found' in pages[0]
+    assert 'completed-job' in pages[1]
+
+
+def test_status_waits_for_changes(client, table):
+    import status
+    _put(table, 'job-1', 10)
+    response = client.get('/annotations/status?ids=job-1')
+    assert response.get_json()['jobs'][0]['job_status'] == 'RUNNING'
+    etag = response.headers['ETag']
+
+    # Without wait, or with nothing changed in time, a 304 at once
+    response = client.get('/annotations/status?ids=job-1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    start = time.time()
+    response = client.get('/annotations/status?ids=job-1&wait=0.3', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert time.time() - start >= 0.3
+
+    def complete():
+        _put(table, 'job-1', 10, 'COMPLETED', complete_time=20)
+        status.record({'job_id': 'job-1', 'user_id': 'u1'})
+    timer = threading.Timer(0.2, complete)
+    timer.start()
+    start = time.time()
+    response = client.get('/annotations/status?ids=job-1&wait=10', headers={'If-None-Match': etag})
+    timer.join()
+    assert time.time() - start < 2
+    assert response.status_code == 200
+    assert response.get_json()['jobs'] == [{'job_id': 'job-1', 'input_file_name': 'input.vcf',
+        'submit_time': 10, 'complete_time': 20, 'job_status': 'COMPLETED'}]
+
+
+@pytest.fixture
+def profile(app, client):
+    from gas import db
+    from models import Profile
+    identity_id = uuid.uuid4()
+    with app.app_context():
+        db.session.add(Profile(identity_id=identity_id, name='n', email='e@x', role='free_user'))
+        db.session.commit()
+    with client.session_transaction() as session:
+        # As signed in before the role changed
+        session.update(primary_identity=str(identity_id), role='premium_user')
+    return str(identity_id)
+
+
+def _set_role(app, identity_id, role):
+    from auth import update_profile
+    with app.app_context():
+        update_profile(identity_id=uuid.UUID(identity_id), role=role)
+
+
+def test_role_read_from_profile(app, client, table, profile):
+    _put(table, 'job-1', 10, 'COMPLETED', complete_time=20, user_id=profile)
+    assert 'upgrade to Premium for download' in client.get('/annotations/job-1').get_data(as_text=True)
+    assert client.get('/subscribe').status_code == 200
+    page = client.get('/profile').get_data(as_text=True)
+    assert 'upgrade to Premium plan' in page
+
+    _set_role(app, profile, 'premium_user')
+    assert 'upgrade to Premium for download' not in client.get('/annotations/job-1').get_data(as_text=True)
+    assert client.get('/subscribe').status_code == 302
+    page = client.get('/profile').get_data(as_text=True)
+    assert 'cancel my Premium plan' in page
+    with client.session_transaction() as session:
+        assert session['role'] == 'premium_user'
+
+
+@pytest.fixture
+def local_timezone(monkeypatch):
+    # Six hours behind UTC, whatever the machine's timezone
+    monkeypatch.setenv('TZ', 'Etc/GMT+6')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_dates_are_utc(client, table, local_timezone):
+    # Still 1 January in local time
+    _put(table, 'early-job', calendar.timegm((2026, 1, 2, 2, 0, 0)))
+    page = client.get('/annotations?from=2026-01-02&to=2026-01-02').get_data(as_text=True)
+    assert 'early-job' in page
+    page = client.get('/annotations?to=2026-01-01').get_data(as_text=True)
+    assert 'early-job' not in page
+
+### EOF
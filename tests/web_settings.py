@@ -0,0 +1,15 @@
+# web_settings.py
+#
+# Web app configuration of the tests
+#
+##
+
+import config
+
+
+class TestingConfig(config.TestingConfig):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SQLALCHEMY_BINDS = {}
+
+### EOF
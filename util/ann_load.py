@@ -0,0 +1,394 @@
+# ann_load.py
+#
+# Offline end-to-end load test of the annotator
+#
+# Runs the annotator (annotator.py and run.py, in this process) against
+# the local stand-ins for SQS, S3, DynamoDB and SNS in local_backend.py,
+# replays a mix of the VCF inputs under ann/jobs at a target arrival
+# rate, and reports throughput, queue latency, turnaround percentiles,
+# CPU time and peak RSS. No AWS account or network access is needed.
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import random
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+import threading
+from configparser import ConfigParser, RawConfigParser
+
+UTIL_DIR = os.path.dirname(os.path.abspath(__file__))
+ANN_DIR = os.path.join(os.path.dirname(UTIL_DIR), 'ann')
+
+sys.path.insert(1, UTIL_DIR)
+sys.path.insert(1, os.path.join(UTIL_DIR, 'timings'))
+import client_pool
+import job_state
+import local_backend
+import runtime_estimator
+from timings import percentile
+
+# Get configuration
+config = ConfigParser(os.environ)
+config.read(os.path.join(UTIL_DIR, 'ann_load_config.ini'))
+
+# Local SNS topics standing in for the web app's job request topics,
+# one per job class
+REQUESTS_TOPIC = 'arn:local:sns:job_requests_{}'
+LOAD_USER_ID = 'load-test-user'
+
+# Stand-in for AnnTools when no AnnTools directory is given: copies each
+# record, appending to INFO, and writes a count log, the way driver.run
+# lays out its output files
+STUB_DRIVER = '''\
+import os
+
+
+def run(input_path, file_type):
+    workdir = os.path.dirname(input_path)
+    prefix = os.path.basename(input_path).partition('.')[0]
+    records = 0
+    with open(input_path) as vcf_file, \\
+        open(os.path.join(workdir, prefix + '.annot.vcf'), 'w') as annot_file:
+        for line in vcf_file:
+            if line.startswith('#'):
+                annot_file.write(line)
+                continue
+            columns = line.rstrip('\\r\\n').split('\\t')
+            if len(columns) >= 8:
+                columns[7] += ';LOADTEST=1'
+            annot_file.write('\\t'.join(columns) + '\\n')
+            records += 1
+    with open(input_path + '.count.log', 'w') as log:
+        log.write('Total number of lines: {}\\n'.format(records))
+'''
+
+
+class ThreadRunner(object):
+    """Runs jobs by calling run.run_job on the annotator's pool threads,
+    in place of spawning run.py per job
+    """
+    def __init__(self, run):
+        self.run = run
+
+    def run_job(self, input_path, UUID, input_file, path):
+        try:
+            self.run.run_job(input_path, UUID, input_file, path)
+            return True
+        except Exception as e:
+            print({'code': 500, 'status': 'error', 'message': str(e), 'job_id': UUID})
+            return False
+
+
+"""Distinct VCF inputs to replay, one per content
+"""
+def find_inputs(pattern):
+    inputs = {}
+    for path in sorted(glob.glob(pattern)):
+        if path.endswith('.annot.vcf') or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as vcf_file:
+            digest = hashlib.sha256(vcf_file.read()).hexdigest()
+        inputs.setdefault(digest, path)
+    return sorted(inputs.values())
+
+
+"""Lay out a working directory like an annotator node's
+<workdir>/ann holds ann_config.ini and jobs/; <workdir>/ann/anntools is
+where run.py runs, and links back to both so that annotator.py's
+'jobs/...' and run.py's '../jobs/...' paths resolve to the same place
+from that one working directory.
+"""
+def prepare_workdir(workdir, anntools_dir, overrides):
+    ann_dir = os.path.join(workdir, 'ann')
+    run_dir = os.path.join(ann_dir, 'anntools')
+    os.makedirs(os.path.join(ann_dir, 'jobs'))
+    os.makedirs(run_dir)
+
+    ann_config = RawConfigParser()
+    ann_config.optionxform = str
+    ann_config.read(os.path.join(ANN_DIR, 'ann_config.ini'))
+    for override in overrides:
+        option, _, value = override.partition('=')
+        section, _, name = option.rpartition('.')
+        ann_config.set(section, name, value)
+    with open(os.path.join(ann_dir, 'ann_config.ini'), 'w') as config_file:
+        ann_config.write(config_file)
+
+    if anntools_dir:
+        for name in os.listdir(anntools_dir):
+            os.symlink(os.path.join(os.path.abspath(anntools_dir), name), os.path.join(run_dir, name))
+    else:
+        with open(os.path.join(run_dir, 'driver.py'), 'w') as driver_file:
+            driver_file.write(STUB_DRIVER)
+    for name in ('jobs', 'ann_config.ini'):
+        if not os.path.lexists(os.path.join(run_dir, name)):
+            os.symlink(os.path.join('..', name), os.path.join(run_dir, name))
+    return run_dir
+
+
+"""Start the annotator in this process, on the local backend
+Returns the annotator's config, as read from the working directory.
+"""
+def start_annotator(backend, run_dir, worker_mode):
+    os.chdir(run_dir)
+    sys.path.insert(0, run_dir)
+    sys.path.insert(0, ANN_DIR)
+    import annotator
+    import run
+
+    ann_config = annotator.config
+    backend.dynamodb.create_table(TableName=ann_config['aws']['AwsDynamoTable'],
+        KeySchema=[{'AttributeName': 'job_id', 'KeyType': 'HASH'}])
+    backend.dynamodb.create_table(TableName=ann_config['cache']['AwsDynamoCacheTable'],
+        KeySchema=[{'AttributeName': 'digest', 'KeyType': 'HASH'}])
+    # Each class's topic feeds its lane queues, as on AWS
+    for job_class in annotator.job_classes():
+        backend.sns.subscribe(TopicArn=REQUESTS_TOPIC.format(job_class.name.partition('.')[0]),
+            Protocol='sqs', Endpoint=job_class.queue_url,
+            Attributes={'FilterPolicy': json.dumps({'job_lane': [job_class.lane]})})
+
+    if worker_mode == 'warm':
+        import workers
+        annotator.warm_pool = workers.WarmPool(ann_config.getint('ann', 'MaxConcurrency'),
+            ann_config.getint('ann', 'WorkerMaxJobs'), run_dir)
+    else:
+        annotator.warm_pool = ThreadRunner(run)
+
+    threading.Thread(target=annotator.annotations, daemon=True).start()
+    return ann_config
+
+
+"""Submit one job the way the web app does: upload the input, size it,
+create the PENDING job item and publish the request to its lane
+"""
+def submit_job(backend, ann_config, inputs_bucket, input_path, job_class):
+    job_id = str(uuid.uuid4())
+    input_file = os.path.basename(input_path)
+    s3_key = '{}/{}/{}~{}'.format(config['load']['KeyPrefix'], LOAD_USER_ID, job_id, input_file)
+    backend.s3.upload_file(input_path, inputs_bucket, s3_key)
+    input_size, estimated_variants = runtime_estimator.sniff(backend.s3, inputs_bucket, s3_key)
+    estimated_secs = runtime_estimator.RuntimeModel().estimate(estimated_variants)
+    job_lane = runtime_estimator.lane(estimated_secs,
+        config.getfloat('load', 'SmallMaxSecs'), config.getfloat('load', 'MediumMaxSecs'))
+    data = {
+        'job_id': job_id,
+        'user_id': LOAD_USER_ID,
+        'input_file_name': input_file,
+        's3_inputs_bucket': inputs_bucket,
+        's3_key_input_file': s3_key,
+        'submit_time': int(time.time()),
+        'job_class': job_class,
+        'input_size': input_size,
+        'estimated_variants': estimated_variants,
+        'estimated_secs': int(round(estimated_secs)),
+        'job_lane': job_lane
+    }
+    table = backend.dynamodb.Table(ann_config['aws']['AwsDynamoTable'])
+    data = job_state.create(table, data)
+    backend.sns.publish(TopicArn=REQUESTS_TOPIC.format(job_class), Message=json.dumps(data),
+        MessageAttributes={'job_lane': {'DataType': 'String', 'StringValue': job_lane}})
+    return job_id
+
+
+def _collect(table, submitted, completed):
+    now = time.time()
+    for item in table.scan(FilterExpression='job_status = :s',
+        ExpressionAttributeValues={':s': job_state.COMPLETED})['Items']:
+        # run.py writes job_timings once the job is done; only the log
+        # upload follows
+        if item['job_id'] in submitted and item['job_id'] not in completed \
+            and 'job_timings' in item:
+            completed[item['job_id']] = (now, item)
+
+
+"""Submit jobs at the target rate while recording when each completes
+Completions are seen by polling the job items, which works for jobs run
+in warm worker processes too.
+"""
+def replay(backend, ann_config, inputs, jobs, rate, poisson, premium_share, seed, timeout, poll_interval):
+    rng = random.Random(seed)
+    table = backend.dynamodb.Table(ann_config['aws']['AwsDynamoTable'])
+    inputs_bucket = config['load']['InputsBucket']
+    submitted = {}
+    completed = {}
+
+    start = time.time()
+    next_arrival = start
+    for _ in range(jobs):
+        next_arrival += rng.expovariate(rate) if poisson else 1.0 / rate
+        while time.time() < next_arrival:
+            _collect(table, submitted, completed)
+            time.sleep(max(min(next_arrival - time.time(), poll_interval), 0))
+        input_path = rng.choice(inputs)
+        job_class = 'premium' if rng.random() < premium_share else 'free'
+        submitted[submit_job(backend, ann_config, inputs_bucket, input_path, job_class)] = \
+            (time.time(), input_path)
+
+    deadline = time.time() + timeout
+    while len(completed) < len(submitted) and time.time() < deadline:
+        _collect(table, submitted, completed)
+        time.sleep(poll_interval)
+    return start, submitted, completed
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': values[-1]
+    }
+
+
+def _usage():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'cpu_secs': self_usage.ru_utime + self_usage.ru_stime + children.ru_utime + children.ru_stime,
+        # Child figures cover reaped children only, so warm workers that
+        # are still running are not included; ru_maxrss is in KiB on Linux
+        'peak_rss_mb': self_usage.ru_maxrss / 1024.0,
+        'peak_child_rss_mb': children.ru_maxrss / 1024.0
+    }
+
+
+def report(start, end, submitted, completed, usage_before, usage_after, settings):
+    turnaround = [done - submitted[job_id][0] for job_id, (done, _) in completed.items()]
+    queue_wait = [int(item['job_timings']['phases_ms'].get('queue_wait', 0)) / 1000.0
+        for _, item in completed.values()]
+    annotate = [int(item['job_timings']['phases_ms'].get('annotate', 0)) / 1000.0
+        for _, item in completed.values()]
+    queue_wait_by_class = {}
+    for _, item in completed.values():
+        queue = '{}.{}'.format(item['job_class'], item['job_lane'])
+        queue_wait_by_class.setdefault(queue, []).append(
+            int(item['job_timings']['phases_ms'].get('queue_wait', 0)) / 1000.0)
+    elapsed = end - start
+    cpu_secs = usage_after['cpu_secs'] - usage_before['cpu_secs']
+    return {
+        'settings': settings,
+        'submitted': len(submitted),
+        'completed': len(completed),
+        'elapsed_secs': elapsed,
+        'jobs_per_sec': len(completed) / elapsed if elapsed else 0.0,
+        'queue_latency_secs': _summary(queue_wait),
+        'queue_latency_by_class_secs': dict((job_class, _summary(waits))
+            for job_class, waits in queue_wait_by_class.items()),
+        'annotate_secs': _summary(annotate),
+        'turnaround_secs': _summary(turnaround),
+        'cpu_secs': cpu_secs,
+        'cpu_utilization': cpu_secs / elapsed if elapsed else 0.0,
+        'peak_rss_mb': usage_after['peak_rss_mb'],
+        'peak_child_rss_mb': usage_after['peak_child_rss_mb']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline annotator load test')
+    parser.add_argument('--jobs', type=int, default=config.getint('load', 'Jobs'),
+        help='number of jobs to submit')
+    parser.add_argument('--rate', type=float, default=config.getfloat('load', 'ArrivalRate'),
+        help='target arrivals per second')
+    parser.add_argument('--poisson', action='store_true',
+        help='exponentially distributed gaps between arrivals instead of a fixed rate')
+    parser.add_argument('--premium-share', type=float, default=config.getfloat('load', 'PremiumShare'),
+        help='fraction of jobs submitted as premium jobs')
+    parser.add_argument('--inputs', default=os.path.join(ANN_DIR, 'jobs', '*', '*.vcf'),
+        help='glob of the VCF inputs to replay')
+    parser.add_argument('--anntools', default=None,
+        help='AnnTools directory to run; a pass-through stand-in is used otherwise')
+    parser.add_argument('--worker-mode', choices=('thread', 'warm'), default='thread',
+        help='run jobs on the annotator threads or in warm worker processes')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.OPTION=VALUE',
+        help='override an ann_config.ini option, e.g. ann.MaxConcurrency=8')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=config.getfloat('load', 'TimeoutSecs'),
+        help='seconds to wait for outstanding jobs after the last arrival')
+    parser.add_argument('--workdir', default=None,
+        help='working directory to use and keep (a temporary one is removed)')
+    parser.add_argument('--output', default='ann_load_results.json')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    inputs = find_inputs(os.path.abspath(args.inputs))
+    if not inputs:
+        print('No VCF inputs match {}'.format(args.inputs))
+        sys.exit(1)
+
+    # Both caches would serve most replayed inputs; measure the pipeline
+    # unless asked otherwise
+    overrides = ['cache.Enabled=no', 'memo.Enabled=no'] + args.set
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='ann_load_'))
+    run_dir = prepare_workdir(workdir, args.anntools, overrides)
+
+    backend = local_backend.LocalBackend(os.path.join(workdir, 'backend'))
+    client_pool.use_backend(backend)
+    # Warm workers are not forked from this process; they select the
+    # same backend from the environment
+    os.environ.update(GAS_BACKEND='local', GAS_LOCAL_ROOT=backend.root)
+    ann_config = start_annotator(backend, run_dir, args.worker_mode)
+
+    usage_before = _usage()
+    start, submitted, completed = replay(backend, ann_config, inputs, args.jobs,
+        args.rate, args.poisson, args.premium_share, args.seed, args.timeout, config.getfloat('load', 'PollInterval'))
+    end = max([done for done, _ in completed.values()] or [time.time()])
+    usage_after = _usage()
+
+    settings = {
+        'jobs': args.jobs,
+        'rate': args.rate,
+        'poisson': args.poisson,
+        'premium_share': args.premium_share,
+        'inputs': inputs,
+        'anntools': args.anntools,
+        'worker_mode': args.worker_mode,
+        'overrides': overrides,
+        'max_concurrency': ann_config.getint('ann', 'MaxConcurrency'),
+        'job_mode': ann_config['ann']['JobMode']
+    }
+    results = report(start, end, submitted, completed, usage_before, usage_after, settings)
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+    print('{} of {} jobs completed in {:.1f}s ({:.2f} jobs/sec)'.format(
+        results['completed'], results['submitted'], results['elapsed_secs'], results['jobs_per_sec']))
+    summaries = [('queue_latency_secs', results['queue_latency_secs']),
+        ('turnaround_secs', results['turnaround_secs'])]
+    summaries += [('queue_latency_secs.' + job_class, summary)
+        for job_class, summary in sorted(results['queue_latency_by_class_secs'].items())]
+    for name, summary in summaries:
+        if summary:
+            print('{}: p50={:.3f} p95={:.3f} p99={:.3f}'.format(
+                name, summary['p50'], summary['p95'], summary['p99']))
+    print('cpu={:.1f}s ({:.0%}) peak_rss={:.0f}MB'.format(
+        results['cpu_secs'], results['cpu_utilization'], results['peak_rss_mb']))
+    print('Results written to {}'.format(output))
+
+    if not args.workdir:
+        os.chdir(UTIL_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    # The annotator threads never return; exit without joining them
+    os._exit(0 if len(completed) == len(submitted) else 1)
+
+
+if __name__ == '__main__':
+    main()
+
+### EOF
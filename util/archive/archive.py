@@ -2,6 +2,15 @@
 #
 # NOTE: This file lives on the Utils instance
 #
+# Archives free users' results files to Glacier once they are due
+#
+# run.py queues an archive request for each free job it completes, due
+# when the job's retention period is over; this long-running consumer
+# archives each results file once, when its request falls due. Requests
+# that arrive early (SQS delays messages by 15 minutes at most) are held
+# back until then, and users who have become premium meanwhile keep
+# their results.
+#
 # Copyright (C) 2011-2019 Vas Vasiliadis
 # University of Chicago
 ##
@@ -9,94 +18,233 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
 import os
 import sys
-import boto3
-from datetime import datetime
+import time
 import botocore
 import json
+import argparse
+import tempfile
+from boto3.dynamodb.conditions import Attr
 
 # Import utility helpers
 sys.path.insert(1, os.path.realpath(os.path.pardir))
 import helpers
+import client_pool
+import job_state
 
 # Get configuration
 from configparser import ConfigParser
 config = ConfigParser(os.environ)
 config.read('archive_config.ini')
 
-# Add utility code here
-def archive():
-    glacier = boto3.client("glacier", region_name=config['aws']['AwsRegionName'])
+# Longest SQS message delay and visibility timeout
+MAX_SQS_DELAY = 900
+MAX_VISIBILITY_TIMEOUT = 43200
+
+# Fields every archive request has; requests without them are malformed
+REQUEST_FIELDS = ('job_id', 'user_id', 's3_results_bucket', 's3_key_result_file', 'due_time')
+
+# Seconds to wait after a failed receive, doubled while receives keep
+# failing, up to the longest
+ERROR_BACKOFF = 1
+MAX_ERROR_BACKOFF = 60
+
+# Errors of AWS calls: error responses, and failures to get any response
+AWS_ERRORS = (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError)
+
+
+"""Archive the results file of one job to Glacier and remove it from S3
+Returns True once the request is done with: archived, or found already
+archived by someone else.
+"""
+def archive_results(request, table, s3, glacier, sns):
     vault_name = config['aws']['VaultName']
-    topic_arn = config['aws']['AwsSNSTopicArn']
-    bucket = config['aws']['AwsS3ResultsBuckets']
-    dynamo = boto3.resource('dynamodb', region_name=config['aws']['AwsRegionName'])
+    job_id = request['job_id']
+    bucket = request['s3_results_bucket']
+    key = request['s3_key_result_file']
+    file_name = key.split('/')[-1]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, file_name)
+        try:
+            s3.download_file(bucket, key, path)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                print("Results of job {} already removed".format(job_id))
+                return True
+            raise
+
+        # archive to glacier vault
+        with open(path, 'rb') as upload_file:
+            archive = glacier.upload_archive(vaultName=vault_name,
+                archiveDescription=key, body=upload_file)
+    archive_id = str(archive['ResponseMetadata']['HTTPHeaders']['x-amz-archive-id'])
+
+    try:
+        # capture the object’s Glacier ID, unless the results have been
+        # archived meanwhile
+        job_state.transition(table, job_id, job_state.STORAGE_STATUS, job_state.ARCHIVED,
+            {'results_file_archive_id': archive_id})
+    except job_state.TransitionError as e:
+        print(str(e))
+        glacier.delete_archive(vaultName=vault_name, archiveId=archive_id)
+        return True
+
+    # remove from s3 bucket
+    try:
+        s3.delete_object(Bucket=bucket, Key=key)
+    except botocore.exceptions.ClientError:
+        print('Error in removing file!')
+
+    try:
+        # publish a notification message to the SNS topic
+        data = {  "job_id": str(job_id),
+                "user_id": request['user_id'],
+                "file_name": file_name,
+                "s3_results_bucket": str(bucket),
+                "vault_name": str(vault_name),
+                "archive_id": archive_id
+                }
+        sns.publish(TopicArn=config['aws']['AwsSNSTopicArn'], Message=json.dumps(data))
+    except botocore.exceptions.ClientError:
+        print("Error in publishing to SNS topic.")
+
+    print("File archived. Job id: {}".format(job_id))
+    return True
+
+
+def archive():
+    glacier = client_pool.client("glacier", config['aws']['AwsRegionName'])
+    dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
     table = dynamo.Table(config['aws']['AwsDynamoTable'])
-    s3 = boto3.client('s3', region_name=config['aws']['AwsRegionName'])
-    s3_client = boto3.resource('s3', region_name=config['aws']['AwsRegionName'])
-    all_objects = s3.list_objects(Bucket=bucket, Prefix=config['aws']['AwsS3Prefix'])
-
-    for i in all_objects['Contents']:
-        if i['Key'].split('/')[-1].split('~')[-1].split('.')[-1] == 'vcf':
-            job_id = i['Key'].split('/')[-1].split('~')[0]
-            response = table.get_item(Key ={ 'job_id': job_id})['Item']
-            if 'results_file_archive_id' not in response or response['results_file_archive_id'] == '' or response['storage_status'] == 'RESTORED':
-                ts = response['complete_time']
-                if int(datetime.timestamp(datetime.now())) - ts > 300:
-                    # past over 5 mins
-
-                    # archive to glacier vault
-                    file_name = i['Key'].split('/')[-1]
-                    s3_client.meta.client.download_file(bucket, i['Key'], file_name)
-
-                    try:
-                        with open(file_name, 'rb') as upload_file:
-                            archive = glacier.upload_archive(vaultName=vault_name,
-                                archiveDescription=i['Key'], body=upload_file)
-                    except KeyError:
-                        print("Vault not exists.")
-            
-                    try:
-                        # capture the object’s Glacier ID
-                        table.update_item( Key= {'job_id': str(job_id)},
-                                UpdateExpression="SET results_file_archive_id = :a, storage_status = :ss",
-                                ExpressionAttributeValues={
-                                        ':a': str(archive['ResponseMetadata']['HTTPHeaders']['x-amz-archive-id']),
-                                        ':ss': 'ARCHIVED'
-                                        },
-                                ReturnValues="UPDATED_NEW"
-                                )
-                    
-                    except botocore.exceptions.ClientError:
-                        print('Error in updating table!')
-                    
-                    # remove from s3 bucket
-                    try:
-                        s3_client.Object(bucket, i['Key']).delete()
-                    except botocore.exceptions.ClientError:
-                        print('Error in removing file!')
-
-                    # Send message to request queue
-                    try:
-                        # publish a notification message to the SNS topic
-                        data = {  "job_id": str(job_id),
-                                "user_id": response['user_id'],
-                                "file_name": file_name,
-                                "s3_results_bucket": str(bucket),
-                                "vault_name": str(vault_name),
-                                "archive_id": str(archive['ResponseMetadata']['HTTPHeaders']['x-amz-archive-id'])
-                                }
-                        sns = boto3.client('sns', region_name=config['aws']['AwsRegionName'])
-                        sns.publish(TopicArn=topic_arn, Message=json.dumps(data))
-                    except botocore.exceptions.ClientError:
-                        print("Error in publishing to SNS topic.")
-
-                    # Clean up (delete) local job files
-                    try:
-                        os.system('rm {}'.format(file_name))
-                    except KeyError:
-                        print('File not exists!')
-                    
-                    print("File archived. Job id: {}".format(job_id))
-      
-archive()
-### EOF
\ No newline at end of file
+    s3 = client_pool.client('s3', config['aws']['AwsRegionName'])
+    sns = client_pool.client('sns', config['aws']['AwsRegionName'])
+    job_state.publish_events(sns, config['aws']['AwsSNSJobStatusArn'])
+    sqs = client_pool.client('sqs', config['aws']['AwsRegionName'])
+    queue_url = config['aws']['AwsSQSArchiveRequestsUrl']
+    # Enable long polling on an existing SQS queue
+    try:
+        sqs.set_queue_attributes(
+            QueueUrl=queue_url,
+            Attributes={'ReceiveMessageWaitTimeSeconds': '20'}
+        )
+    except AWS_ERRORS as e:
+        print('Error in enabling long polling: {}'.format(e))
+
+    backoff = ERROR_BACKOFF
+    while True:
+        try:
+            response = sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=20,
+                VisibilityTimeout=config.getint('archive', 'VisibilityTimeout')
+            )
+        except AWS_ERRORS as e:
+            print('Error in receiving archive requests: {}'.format(e))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+            continue
+        backoff = ERROR_BACKOFF
+
+        now = int(time.time())
+        due = []
+        for sqs_message in response.get('Messages', []):
+            try:
+                request = json.loads(sqs_message['Body'])
+                if not all(field in request for field in REQUEST_FIELDS):
+                    raise ValueError('missing fields')
+                due_time = int(request['due_time'])
+            except (TypeError, ValueError):
+                # keep listening; malformed messages are left to expire
+                print('Malformed archive request: {}'.format(sqs_message['Body']))
+                continue
+            if due_time > now:
+                # Not yet due: hide it again until it is
+                try:
+                    sqs.change_message_visibility(QueueUrl=queue_url,
+                        ReceiptHandle=sqs_message['ReceiptHandle'],
+                        VisibilityTimeout=min(due_time - now, MAX_VISIBILITY_TIMEOUT))
+                except AWS_ERRORS as e:
+                    # It comes back when its visibility timeout runs out
+                    print('Error in deferring job {}: {}'.format(request['job_id'], e))
+                continue
+            due.append((request, sqs_message['ReceiptHandle']))
+        if not due:
+            continue
+
+        # Roles as they are now, in one lookup for the batch
+        try:
+            profiles = helpers.get_user_profiles(request['user_id'] for request, _ in due)
+        except AWS_ERRORS + (helpers.psycopg2.Error,) as e:
+            # Leave the batch to be received again
+            print('Error in looking up users: {}'.format(e))
+            continue
+
+        for request, receipt_handle in due:
+            profile = profiles.get(request['user_id'])
+            if profile is not None and profile['role'] == 'premium_user':
+                print("User {} is premium; job {} not archived".format(request['user_id'], request['job_id']))
+                done = True
+            else:
+                try:
+                    done = archive_results(request, table, s3, glacier, sns)
+                except AWS_ERRORS as e:
+                    print('Error in archiving job {}: {}'.format(request['job_id'], e))
+                    done = False
+            # Failed requests become visible again for another try
+            if done:
+                try:
+                    sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt_handle)
+                except AWS_ERRORS as e:
+                    # Received again later, and found archived
+                    print('Error in deleting the request of job {}: {}'.format(request['job_id'], e))
+
+
+"""Queue archive requests for completed free jobs whose results are in
+S3 and not yet scheduled: jobs that completed before run.py queued them
+"""
+def backfill():
+    dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
+    table = dynamo.Table(config['aws']['AwsDynamoTable'])
+    sqs = client_pool.client('sqs', config['aws']['AwsRegionName'])
+    now = int(time.time())
+    scan = {
+        'FilterExpression': Attr('job_status').eq(job_state.COMPLETED) &
+            Attr('storage_status').not_exists() &
+            (Attr('job_class').not_exists() | Attr('job_class').ne('premium')),
+        'ProjectionExpression': 'job_id, user_id, s3_results_bucket, s3_key_result_file, complete_time'
+    }
+    queued = 0
+    while True:
+        response = table.scan(**scan)
+        for job in response['Items']:
+            if 's3_key_result_file' not in job:
+                continue
+            due_time = int(job['complete_time']) + config.getint('archive', 'RetentionSecs')
+            sqs.send_message(QueueUrl=config['aws']['AwsSQSArchiveRequestsUrl'],
+                MessageBody=json.dumps({
+                    'job_id': job['job_id'],
+                    'user_id': job['user_id'],
+                    's3_results_bucket': job['s3_results_bucket'],
+                    's3_key_result_file': job['s3_key_result_file'],
+                    'due_time': due_time
+                }),
+                DelaySeconds=max(0, min(due_time - now, MAX_SQS_DELAY)))
+            queued += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    print("Queued {} archive requests".format(queued))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive free users\' results files to Glacier')
+    parser.add_argument('--backfill', action='store_true',
+        help='queue archive requests for jobs completed before archival was scheduled, then exit')
+    args = parser.parse_args()
+    if args.backfill:
+        backfill()
+    else:
+        archive()
+
+### EOF
@@ -0,0 +1,199 @@
+# client_pool.py
+#
+# Shared AWS clients for the web app, annotator and utilities
+#
+# Clients are created once per process (resources once per thread, as
+# boto3 resources are not thread-safe; forked children make their own)
+# from a single session, with keep-alive connection pools and retries,
+# and every AWS call they make is counted and timed per operation.
+#
+# The same calls can be served by a local backend instead of AWS (see
+# local_backend.py), selected with GAS_BACKEND=local or use_backend().
+#
+##
+
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_resources = threading.local()
+
+# Stand-in services (e.g. local_backend.LocalBackend) to hand out instead
+# of AWS clients, if set; see use_backend() and _backend_from_env()
+_backend = None
+
+# '<service>.<operation>' -> {'calls', 'errors', 'total_ms', 'max_ms'}
+_stats = {}
+_stats_lock = threading.Lock()
+
+# Connection and retry settings shared by all clients
+DEFAULT_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=60,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
+
+# Per-service additions to DEFAULT_CONFIG
+SERVICE_CONFIG = {
+    # Presigned URLs and POSTs must be signed with SigV4
+    's3': Config(signature_version='s3v4'),
+}
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+def _config(service):
+    if service in SERVICE_CONFIG:
+        return DEFAULT_CONFIG.merge(SERVICE_CONFIG[service])
+    return DEFAULT_CONFIG
+
+
+def _before_call(model, context, **kwargs):
+    context['gas_operation'] = '{}.{}'.format(
+        model.service_model.service_name, model.name)
+    context['gas_start'] = time.time()
+
+
+"""Record one call; runs on after-call (with the parsed response) and on
+after-call-error (with the exception, for calls that got no response)
+"""
+def _after_call(context, parsed=None, exception=None, **kwargs):
+    start = context.get('gas_start')
+    if start is None:
+        return
+    elapsed_ms = (time.time() - start) * 1000
+    failed = exception is not None or 'Error' in (parsed or {})
+    with _stats_lock:
+        entry = _stats.setdefault(context['gas_operation'],
+            {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        entry['calls'] += 1
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        if failed:
+            entry['errors'] += 1
+
+
+def _instrument(client):
+    client.meta.events.register('before-call', _before_call)
+    client.meta.events.register('after-call', _after_call)
+    client.meta.events.register('after-call-error', _after_call)
+    return client
+
+
+"""Backend selected by the environment
+GAS_BACKEND=local runs every GAS process on one machine: objects, job
+items and queues are kept under GAS_LOCAL_ROOT, and GAS_LOCAL_URL is
+where the web app serves local objects for presigned URLs.
+"""
+def _backend_from_env():
+    if os.environ.get('GAS_BACKEND', 'aws') != 'local':
+        return None
+    import local_backend
+    return local_backend.LocalBackend(os.environ.get('GAS_LOCAL_ROOT', '/var/lib/gas'),
+        os.environ.get('GAS_LOCAL_URL'))
+
+
+"""The backend in use, or None for AWS
+"""
+def backend():
+    return _backend
+
+
+"""Hand out clients and resources from backend instead of AWS
+backend provides client(service) and resource(service); pass None to go
+back to AWS.
+"""
+def use_backend(backend):
+    global _backend
+    with _lock:
+        _backend = backend
+        _clients.clear()
+    _resources.cache = {}
+
+
+"""Shared, thread-safe client for an AWS service
+"""
+def client(service, region_name):
+    if _backend is not None:
+        return _backend.client(service)
+    key = (service, region_name)
+    if key not in _clients:
+        with _lock:
+            if key not in _clients:
+                _clients[key] = _instrument(_get_session().client(service,
+                    region_name=region_name, config=_config(service)))
+    return _clients[key]
+
+
+"""Resource for an AWS service, cached per thread
+"""
+def resource(service, region_name):
+    if _backend is not None:
+        return _backend.resource(service)
+    key = (service, region_name)
+    cache = getattr(_resources, 'cache', None)
+    if cache is None:
+        cache = _resources.cache = {}
+    if key not in cache:
+        # Session objects are not thread-safe; create under the lock
+        with _lock:
+            cache[key] = _get_session().resource(service,
+                region_name=region_name, config=_config(service))
+        _instrument(cache[key].meta.client)
+    return cache[key]
+
+
+_backend = _backend_from_env()
+
+
+"""Drop the clients a forked child inherits, e.g. the web app's workers
+under gunicorn --preload, so that parent and child never share a
+connection pool
+"""
+def _after_fork():
+    global _lock, _session, _resources
+    _lock = threading.Lock()
+    _session = None
+    _clients.clear()
+    _resources = threading.local()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+"""Call counts and latencies per AWS operation since the last reset
+"""
+def stats():
+    with _stats_lock:
+        return {name: dict(entry, avg_ms=entry['total_ms'] / entry['calls'])
+            for name, entry in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+"""One line per operation, busiest first, for logs
+"""
+def format_stats():
+    lines = []
+    for name, entry in sorted(stats().items(), key=lambda item: -item[1]['total_ms']):
+        lines.append('{} calls={} errors={} avg_ms={:.1f} max_ms={:.1f}'.format(
+            name, entry['calls'], entry['errors'], entry['avg_ms'], entry['max_ms']))
+    return '\n'.join(lines)
+
+### EOF
@@ -0,0 +1,74 @@
+# estimator.py
+#
+# Fits the runtime estimator used to pick a job's lane on the timings of
+# recently completed jobs, and stores the model for the web app
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import json
+import time
+import argparse
+from boto3.dynamodb.conditions import Attr
+
+# Import utility helpers
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+import client_pool
+import runtime_estimator
+
+# Get configuration
+from configparser import ConfigParser
+config = ConfigParser(os.environ)
+config.read('estimator_config.ini')
+
+
+"""(estimated variants, annotation seconds) of the jobs completed since
+the given time
+"""
+def samples(since):
+    dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
+    table = dynamo.Table(config['aws']['AwsDynamoTable'])
+    scan = {
+        'FilterExpression': Attr('complete_time').gte(since) & Attr('job_timings').exists() &
+            Attr('estimated_variants').exists(),
+        'ProjectionExpression': 'job_timings, estimated_variants'
+    }
+    points = []
+    while True:
+        response = table.scan(**scan)
+        for item in response['Items']:
+            annotate_ms = item['job_timings']['phases_ms'].get('annotate')
+            # Jobs served from the results cache did not run AnnTools
+            if annotate_ms is not None:
+                points.append((int(item['estimated_variants']), int(annotate_ms) / 1000.0))
+        if 'LastEvaluatedKey' not in response:
+            return points
+        scan['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def fit(hours, dry_run=False):
+    points = samples(int(time.time() - hours * 3600))
+    if len(points) < config.getint('estimator', 'MinSamples'):
+        print("Only {} jobs to fit on; model left unchanged".format(len(points)))
+        return
+
+    model = runtime_estimator.RuntimeModel.fit(points)
+    print(json.dumps(model.to_dict(), sort_keys=True))
+    if not dry_run:
+        s3 = client_pool.client('s3', config['aws']['AwsRegionName'])
+        runtime_estimator.save_model(s3, config['aws']['AwsS3ResultsBuckets'],
+            config['estimator']['ModelKey'], model)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit the job runtime estimator')
+    parser.add_argument('--hours', type=float, default=config.getfloat('estimator', 'WindowHours'))
+    parser.add_argument('--dry-run', action='store_true', help='print the model without storing it')
+    args = parser.parse_args()
+    fit(args.hours, args.dry_run)
+
+### EOF
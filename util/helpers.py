@@ -10,8 +10,8 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
 import os
 import json
-import boto3
-from botocore.exceptions import ClientError
+
+import client_pool
 
 # Get util configuration
 from configparser import SafeConfigParser
@@ -23,58 +23,169 @@ config.read(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'util_confi
 def send_email_ses(recipients=None, 
   sender=None, subject=None, body=None):
 
-  ses = boto3.client('ses', region_name=config['aws']['AwsRegionName'])
+  ses = client_pool.client('ses', config['aws']['AwsRegionName'])
 
-  try:
-    response = ses.send_email(
-      Destination = {
-        'ToAddresses': (recipients if type(recipients) == "list" else [recipients])
-      },
-      Message={
-        'Body': {'Text': {'Charset': "UTF-8", 'Data': body}},
-        'Subject': {'Charset': "UTF-8", 'Data': subject},
-      },
-      Source=(sender or config['gas']['EmailDefaultSender']))
-  except ClientError as e:
-    raise ClientError
+  # ClientErrors are passed on as is, so callers can tell throttling
+  # from other errors
+  response = ses.send_email(
+    Destination = {
+      'ToAddresses': (recipients if isinstance(recipients, list) else [recipients])
+    },
+    Message={
+      'Body': {'Text': {'Charset': "UTF-8", 'Data': body}},
+      'Subject': {'Charset': "UTF-8", 'Data': subject},
+    },
+    Source=(sender or config['gas']['EmailDefaultSender']))
 
   return response
 
 
+import time
+import threading
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 
-"""Access user profile in accounts database
+# Accounts database secret: [time loaded, secret]
+_rds_secret = [0, None]
+# (process id, database name) -> _AccountsPool
+_accounts_pools = {}
+_accounts_lock = threading.Lock()
+
+# Profile lookups, prepared once on each pooled connection
+PROFILE_STATEMENTS = {
+  'gas_profile': "PREPARE gas_profile (uuid) AS SELECT * FROM profiles WHERE identity_id = $1",
+  'gas_profiles': "PREPARE gas_profiles (uuid[]) AS SELECT * FROM profiles WHERE identity_id = ANY($1)"
+}
+
+
+"""Accounts database connection details from AWS Secrets Manager
+Cached for SecretTTL seconds, so rotated credentials are picked up.
 """
-def get_user_profile(id=None, db_name=None):
-  # Get database connection details from AWS Secrets Manager
-  asm = boto3.client('secretsmanager', region_name=config['aws']['AwsRegionName'])
-  try:
-    asm_response = asm.get_secret_value(SecretId='rds/accounts_database')
-    rds_secret = json.loads(asm_response['SecretString'])
-  except ClientError as e:
-    raise ClientError
+def accounts_db_secret():
+  with _accounts_lock:
+    if _rds_secret[1] is not None and \
+      time.time() - _rds_secret[0] < config.getint('accounts', 'SecretTTL'):
+      return _rds_secret[1]
+
+  asm = client_pool.client('secretsmanager', config['aws']['AwsRegionName'])
+  asm_response = asm.get_secret_value(SecretId='rds/accounts_database')
+  rds_secret = json.loads(asm_response['SecretString'])
+
+  with _accounts_lock:
+    _rds_secret[:] = [time.time(), rds_secret]
+  return rds_secret
+
 
-  db_uri = "postgresql://" + rds_secret['username'] + ':' + \
+"""Connection string of the accounts database
+"""
+def accounts_db_uri(db_name=None):
+  rds_secret = accounts_db_secret()
+  return "postgresql://" + rds_secret['username'] + ':' + \
     rds_secret['password'] + '@' + rds_secret['host'] + ':' + \
     str(rds_secret['port']) + '/' + \
     (db_name or config['gas']['AccountsDatabase'])
 
+
+class _AccountsConnection(psycopg2.extensions.connection):
+  """Connection that knows whether the profile statements are prepared
+  on it; prepared statements live and die with their connection
+  """
+  prepared = False
+
+
+class _AccountsPool(object):
+  """Connections to one accounts database; getconn blocks while all
+  PoolMaxConnections are in use rather than failing. PoolMinConnections
+  stay open between lookups; connections above that are closed when
+  they are returned.
+  """
+  def __init__(self, db_uri):
+    self.db_uri = db_uri
+    self.pool = psycopg2.pool.ThreadedConnectionPool(
+      config.getint('accounts', 'PoolMinConnections'),
+      config.getint('accounts', 'PoolMaxConnections'), db_uri,
+      connection_factory=_AccountsConnection)
+    self.slots = threading.BoundedSemaphore(config.getint('accounts', 'PoolMaxConnections'))
+
+  def getconn(self):
+    self.slots.acquire()
+    try:
+      connection = self.pool.getconn()
+      if not connection.prepared:
+        # Lookups are single statements; no transaction is left open
+        # on an idle pooled connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+          for statement in PROFILE_STATEMENTS.values():
+            cursor.execute(statement)
+        connection.prepared = True
+      return connection
+    except Exception:
+      self.slots.release()
+      raise
+
+  def putconn(self, connection, close=False):
+    try:
+      self.pool.putconn(connection, close=close)
+    finally:
+      self.slots.release()
+
+
+"""A pooled connection to the accounts database
+Pools are per process, as connections cannot be shared across a fork,
+and are replaced when the secret changes.
+"""
+@contextmanager
+def accounts_db(db_name=None):
+  db_uri = accounts_db_uri(db_name)
+  key = (os.getpid(), db_name)
+  with _accounts_lock:
+    pool = _accounts_pools.get(key)
+    if pool is None or pool.db_uri != db_uri:
+      # Connections of a replaced pool close once it is dropped
+      pool = _accounts_pools[key] = _AccountsPool(db_uri)
+
+  connection = pool.getconn()
+  broken = False
   try:
-    # Connect to accounts database and get a cursor
-    connection = psycopg2.connect(db_uri)
+    yield connection
+  except (psycopg2.OperationalError, psycopg2.InterfaceError):
+    # The connection is likely dead; do not hand it out again
+    broken = True
+    raise
+  finally:
+    pool.putconn(connection, close=broken or bool(connection.closed))
+
+
+"""Access user profile in accounts database
+"""
+def get_user_profile(id=None, db_name=None):
+  with accounts_db(db_name) as connection:
     cursor = connection.cursor(cursor_factory = psycopg2.extras.DictCursor)
-    
     # Query the database and get the user's profile record
-    query_string = f"SELECT * FROM profiles WHERE identity_id = '{id}'"
-    cursor.execute(query_string)
+    cursor.execute("EXECUTE gas_profile (%s::uuid)", (str(id),))
     profile = cursor.fetchall()[0]
-  
-  except psycopg2.Error as e:
-    connection.rollback()
-    raise psycopg2.Error
 
   # Return user profile record as a dict
   return profile
 
+
+"""Access the profiles of many users in one query
+Returns a dict of identity id -> profile record; ids with no profile
+are left out.
+"""
+def get_user_profiles(ids, db_name=None):
+  ids = list(set(str(id) for id in ids))
+  if not ids:
+    return {}
+
+  with accounts_db(db_name) as connection:
+    cursor = connection.cursor(cursor_factory = psycopg2.extras.DictCursor)
+    cursor.execute("EXECUTE gas_profiles (%s::uuid[])", (ids,))
+    return dict((str(profile['identity_id']), profile) for profile in cursor.fetchall())
+
 ### EOF
\ No newline at end of file
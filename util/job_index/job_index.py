@@ -0,0 +1,82 @@
+# job_index.py
+#
+# Adds the per-user indexes of the annotations table: user_id as their
+# hash key and submit_time or complete_time as their range key, so a
+# page of a user's jobs, in either order, is one query whatever the size
+# of the table
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import time
+
+# Import utility helpers
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+import client_pool
+
+# Get configuration
+from configparser import ConfigParser
+config = ConfigParser(os.environ)
+config.read('job_index_config.ini')
+
+
+"""Status of the index, or None if the table does not have it
+"""
+def index_status(table, index_name):
+    table.reload()
+    for index in table.global_secondary_indexes or []:
+        if index['IndexName'] == index_name:
+            return index['IndexStatus']
+    return None
+
+
+def create_index(table, index_name):
+    section = config['index.{}'.format(index_name)]
+    if index_status(table, index_name) is None:
+        index = {
+            'IndexName': index_name,
+            'KeySchema': [
+                {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+                {'AttributeName': section['RangeKey'], 'KeyType': 'RANGE'}
+            ],
+            'Projection': {
+                'ProjectionType': 'INCLUDE',
+                'NonKeyAttributes': [name.strip() for name in section['NonKeyAttributes'].split(',')]
+            }
+        }
+        if (table.billing_mode_summary or {}).get('BillingMode') != 'PAY_PER_REQUEST':
+            index['ProvisionedThroughput'] = {
+                'ReadCapacityUnits': config.getint('index', 'ReadCapacityUnits'),
+                'WriteCapacityUnits': config.getint('index', 'WriteCapacityUnits')
+            }
+        table.update(
+            AttributeDefinitions=[
+                {'AttributeName': 'user_id', 'AttributeType': 'S'},
+                {'AttributeName': section['RangeKey'], 'AttributeType': 'N'}
+            ],
+            GlobalSecondaryIndexUpdates=[{'Create': index}]
+        )
+        print("Creating index {} on {}".format(index_name, table.name))
+
+    # Existing jobs are backfilled into the index before it is ACTIVE;
+    # DynamoDB builds one new index at a time
+    while index_status(table, index_name) != 'ACTIVE':
+        time.sleep(config.getint('index', 'PollInterval'))
+    print("Index {} is active".format(index_name))
+
+
+def create_indexes():
+    dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
+    table = dynamo.Table(config['aws']['AwsDynamoTable'])
+    for index_name in config['index']['Indexes'].replace(',', ' ').split():
+        create_index(table, index_name)
+
+
+if __name__ == '__main__':
+    create_indexes()
+
+### EOF
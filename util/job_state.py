@@ -0,0 +1,155 @@
+# job_state.py
+#
+# The lifecycle of an annotation job, shared by web, ann and util
+#
+# A job item has two state fields: job_status (the annotation run) and
+# storage_status (where its results file lives). Every change of either
+# is a single conditional update_item that only applies from a state the
+# new one may follow, and returns the whole updated item, so no caller
+# needs to read the item first or again afterwards, and two processes
+# racing on a job cannot both move it. Processes that call
+# publish_events() also announce each change they make on an SNS topic,
+# from which the web app pushes job status to browsers.
+#
+##
+
+import json
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import BotoCoreError, ClientError
+
+JOB_STATUS = 'job_status'
+STORAGE_STATUS = 'storage_status'
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+
+ARCHIVED = 'ARCHIVED'
+RETRIEVING = 'RETRIEVING'
+RESTORED = 'RESTORED'
+
+# field -> new state -> states it may follow; None is a field not yet set
+TRANSITIONS = {
+    JOB_STATUS: {
+        PENDING: (None,),
+        # A job is RUNNING again when its request is redelivered after an
+        # annotator failed part way through it
+        RUNNING: (PENDING, RUNNING),
+        COMPLETED: (RUNNING,)
+    },
+    STORAGE_STATUS: {
+        # Restored results are archived again once they age out
+        ARCHIVED: (None, RESTORED),
+        RETRIEVING: (ARCHIVED,),
+        RESTORED: (RETRIEVING,)
+    }
+}
+
+
+# SNS client and topic ARN that changes are announced on, once set
+_events = {}
+
+
+class TransitionError(Exception):
+    """A transition the job's current state does not allow; item is the
+    job as it stands, or None if there is no such job
+    """
+    def __init__(self, job_id, field, state, item):
+        current = item.get(field) if item else None
+        super(TransitionError, self).__init__('Job {} cannot move from {} {} to {}'.format(
+            job_id, field, current, state))
+        self.job_id = job_id
+        self.field = field
+        self.state = state
+        self.item = item
+
+
+"""Condition allowing field to move to state, with its names and values
+"""
+def _condition(field, state, names, values):
+    allowed = []
+    for i, source in enumerate(TRANSITIONS[field][state]):
+        if source is None:
+            allowed.append('attribute_not_exists(#state)')
+        else:
+            values[':from{}'.format(i)] = source
+            allowed.append('#state = :from{}'.format(i))
+    names['#state'] = field
+    return ' OR '.join(allowed)
+
+
+"""Announce the transitions this process makes from now on on an SNS topic
+Announcing is best effort: a change stands whether or not its
+announcement is published.
+"""
+def publish_events(sns, topic_arn):
+    _events['sns'] = sns
+    _events['topic_arn'] = topic_arn
+
+
+def _announce(item):
+    if not _events:
+        return
+    event = {'job_id': item['job_id'], 'user_id': item['user_id']}
+    for name in (JOB_STATUS, STORAGE_STATUS, 'complete_time'):
+        if name in item:
+            value = item[name]
+            event[name] = int(value) if name == 'complete_time' else value
+    try:
+        _events['sns'].publish(TopicArn=_events['topic_arn'], Message=json.dumps(event))
+    except (BotoCoreError, ClientError) as e:
+        print('Error in announcing job {}: {}'.format(item['job_id'], e))
+
+
+"""Put a new job item in its first state
+Raises TransitionError if a job with the same id already exists.
+"""
+def create(table, item):
+    item = dict(item, **{JOB_STATUS: PENDING})
+    try:
+        table.put_item(Item=item, ConditionExpression='attribute_not_exists(job_id)')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        raise TransitionError(item['job_id'], JOB_STATUS, PENDING, None)
+    _announce(item)
+    return item
+
+
+"""Move field of job_id to state, setting attributes along with it
+Returns the whole updated item. Raises TransitionError, carrying the job
+as it stands, if the job does not exist or its field is in a state the
+new one may not follow; other ClientErrors are passed on.
+"""
+def transition(table, job_id, field, state, attributes=None):
+    names = {}
+    values = {':state': state}
+    condition = 'attribute_exists(job_id) AND ({})'.format(_condition(field, state, names, values))
+    updates = ['#state = :state']
+    for i, (name, value) in enumerate(sorted((attributes or {}).items())):
+        names['#a{}'.format(i)] = name
+        values[':a{}'.format(i)] = value
+        updates.append('#a{0} = :a{0}'.format(i))
+
+    try:
+        response = table.update_item(Key={'job_id': job_id},
+            UpdateExpression='SET ' + ', '.join(updates),
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_NEW',
+            ReturnValuesOnConditionCheckFailure='ALL_OLD')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # The failed update hands back the item, in the low-level format
+        item = e.response.get('Item')
+        if item:
+            deserializer = TypeDeserializer()
+            item = {name: deserializer.deserialize(value) for name, value in item.items()}
+        raise TransitionError(job_id, field, state, item)
+    _announce(response['Attributes'])
+    return response['Attributes']
+
+### EOF
@@ -0,0 +1,1172 @@
+# local_backend.py
+#
+# Local stand-ins for the AWS services used by the GAS
+#
+# Objects are files under a root directory, DynamoDB tables are SQLite
+# tables and SQS queues (fed by SNS topics) are in-process queues. Each
+# stand-in implements the subset of the boto3 client/resource interface
+# the GAS code calls, with the same shapes of requests and responses, so
+# the real code paths run unchanged once client_pool hands these out.
+#
+##
+
+import io
+import os
+import re
+import hmac
+import json
+import time
+import uuid
+import base64
+import shutil
+import hashlib
+import secrets
+import sqlite3
+import threading
+from urllib.parse import quote, urlencode
+from decimal import Decimal
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeSerializer
+
+
+def _error(code, message, operation, **fields):
+    return ClientError(dict({'Error': {'Code': code, 'Message': message}}, **fields), operation)
+
+
+"""Streaming body of a local object; mirrors botocore's StreamingBody
+data is the object's bytes, or a file positioned at the start of the
+body, of which length bytes are read
+"""
+class LocalBody(object):
+    def __init__(self, data, length=None):
+        if isinstance(data, bytes):
+            data, length = io.BytesIO(data), len(data)
+        self._stream = data
+        self._remaining = length
+
+    def read(self, amt=None):
+        if self._remaining is not None and (amt is None or amt > self._remaining):
+            amt = self._remaining
+        data = self._stream.read() if amt is None else self._stream.read(amt)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return data
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                self.close()
+                return
+            yield chunk
+
+    def iter_lines(self, chunk_size=1024, keepends=False):
+        pending = b''
+        for chunk in self.iter_chunks(chunk_size):
+            lines = (pending + chunk).splitlines(True)
+            pending = lines.pop()
+            for line in lines:
+                yield line if keepends else line.rstrip(b'\r\n')
+        if pending:
+            yield pending if keepends else pending.rstrip(b'\r\n')
+
+    def close(self):
+        self._stream.close()
+
+
+class LocalS3(object):
+    """Objects are stored as <root>/<bucket>/<key>
+    Presigned URLs and POSTs are signed with a key kept under root, so the
+    web app's /local/s3 routes can check them as S3 would.
+    """
+    def __init__(self, root, base_url=None):
+        self.root = root
+        self.base_url = base_url or 'file://' + os.path.abspath(root)
+        self._signing_key = None
+
+    """Path of an object's file
+    Keys that would resolve outside of their bucket's directory, through
+    '.' or '..' segments or links, are refused.
+    """
+    def _path(self, bucket, key, operation='GetObject'):
+        bucket_root = os.path.realpath(os.path.join(self.root, bucket))
+        segments = key.split('/')
+        if not bucket or '/' in bucket or bucket in ('.', '..') \
+            or '.' in segments or '..' in segments or key.startswith('/'):
+            raise _error('InvalidArgument', 'Invalid bucket or key', operation)
+        path = os.path.realpath(os.path.join(bucket_root, key))
+        if not path.startswith(bucket_root + os.sep):
+            raise _error('InvalidArgument', 'Invalid bucket or key', operation)
+        return path
+
+    def _open(self, bucket, key, operation):
+        path = self._path(bucket, key, operation)
+        if not os.path.isfile(path):
+            raise _error('NoSuchKey', 'The specified key does not exist.', operation)
+        return open(path, 'rb')
+
+    """Store an object from bytes or a file object
+    """
+    def _write(self, bucket, key, data, operation='PutObject'):
+        path = self._path(bucket, key, operation)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers never see a partial object
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f, 1024 * 1024)
+        os.replace(tmp_path, path)
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        self._write(Bucket, Key, Body)
+        return {'ETag': '"{}"'.format(uuid.uuid4().hex)}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        body = self._open(Bucket, Key, 'GetObject')
+        size = os.fstat(body.fileno()).st_size
+        response = {'ContentLength': size}
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            if start == '':
+                start, end = max(size - int(end), 0), size - 1
+            else:
+                start, end = int(start), min(int(end) if end else size - 1, size - 1)
+            if start >= size:
+                body.close()
+                raise _error('InvalidRange', 'The requested range is not satisfiable', 'GetObject')
+            body.seek(start)
+            response['ContentRange'] = 'bytes {}-{}/{}'.format(start, end, size)
+            response['ContentLength'] = max(end - start + 1, 0)
+        response['Body'] = LocalBody(body, response['ContentLength'])
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key, 'HeadObject')
+        if not os.path.isfile(path):
+            raise _error('404', 'Not Found', 'HeadObject')
+        stat = os.stat(path)
+        return {'ContentLength': stat.st_size, 'LastModified': stat.st_mtime}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key, 'DeleteObject')
+        if os.path.isfile(path):
+            os.remove(path)
+        return {}
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        with self._open(Bucket, Key, 'GetObject') as body, open(Filename, 'wb') as f:
+            shutil.copyfileobj(body, f, 1024 * 1024)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, 'rb') as f:
+            self._write(Bucket, Key, f)
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs=None, Callback=None, SourceClient=None, Config=None):
+        with self._open(CopySource['Bucket'], CopySource['Key'], 'CopyObject') as source:
+            self._write(Bucket, Key, source, 'CopyObject')
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.copy(CopySource, Bucket, Key)
+        return {}
+
+    def list_objects(self, Bucket, Prefix='', **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        contents = []
+        for dirpath, _, filenames in os.walk(bucket_root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, bucket_root).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    contents.append({'Key': key, 'Size': os.path.getsize(path)})
+        contents.sort(key=lambda obj: obj['Key'])
+        return {'Contents': contents} if contents else {}
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        response = self.list_objects(Bucket, Prefix)
+        response['KeyCount'] = len(response.get('Contents', []))
+        return response
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, '.multipart', upload_id))
+        return {'UploadId': upload_id, 'Bucket': Bucket, 'Key': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        with open(os.path.join(self.root, '.multipart', UploadId, str(PartNumber)), 'wb') as f:
+            f.write(Body if isinstance(Body, bytes) else Body.read())
+        return {'ETag': '"{}-{}"'.format(UploadId, PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        parts_dir = os.path.join(self.root, '.multipart', UploadId)
+        path = self._path(Bucket, Key, 'CompleteMultipartUpload')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            for part in MultipartUpload['Parts']:
+                with open(os.path.join(parts_dir, str(part['PartNumber'])), 'rb') as part_file:
+                    shutil.copyfileobj(part_file, f, 1024 * 1024)
+        os.replace(tmp_path, path)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        shutil.rmtree(os.path.join(self.root, '.multipart', UploadId), ignore_errors=True)
+        return {}
+
+    """Key presigned requests are signed with, shared by every process
+    using this root; made on first use
+    """
+    def signing_key(self):
+        if self._signing_key is None:
+            path = os.path.join(self.root, '.signing-key')
+            os.makedirs(self.root, exist_ok=True)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'w') as key_file:
+                    key_file.write(secrets.token_hex(32))
+            except FileExistsError:
+                pass
+            with open(path) as key_file:
+                self._signing_key = key_file.read().strip().encode('ascii')
+        return self._signing_key
+
+    def _signature(self, *parts):
+        message = '\n'.join(str(part) for part in parts).encode('utf-8')
+        return hmac.new(self.signing_key(), message, hashlib.sha256).hexdigest()
+
+    def _check_expiry(self, expires, operation):
+        try:
+            expired = int(expires) < time.time()
+        except (TypeError, ValueError):
+            expired = True
+        if expired:
+            raise _error('AccessDenied', 'Request has expired', operation)
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        expires = int(time.time()) + int(ExpiresIn)
+        return '{}/{}/{}?{}'.format(self.base_url, Params['Bucket'], quote(Params['Key']),
+            urlencode({'Expires': expires,
+                'Signature': self._signature('GET', Params['Bucket'], Params['Key'], expires)}))
+
+    """Check the Expires and Signature query parameters of a presigned GET
+    of bucket/key
+    """
+    def check_presigned_url(self, bucket, key, params):
+        self._check_expiry(params.get('Expires'), 'GetObject')
+        expected = self._signature('GET', bucket, key, params.get('Expires'))
+        if not hmac.compare_digest(expected, params.get('Signature', '')):
+            raise _error('SignatureDoesNotMatch', 'The request signature does not match', 'GetObject')
+
+    """A POST form as S3's: the fields, a base64 JSON policy of its
+    expiry and conditions, and the policy's signature
+    """
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600):
+        fields = dict(Fields or {}, key=Key)
+        conditions = list(Conditions or []) + [{'bucket': Bucket}]
+        if '${filename}' in Key:
+            conditions.append(['starts-with', '$key', Key[:Key.index('${filename}')]])
+        else:
+            conditions.append({'key': Key})
+        policy = base64.b64encode(json.dumps({
+            'expiration': int(time.time()) + int(ExpiresIn),
+            'conditions': conditions}).encode('utf-8')).decode('ascii')
+        fields['policy'] = policy
+        fields['signature'] = self._signature('POST', policy)
+        return {'url': '{}/{}'.format(self.base_url, Bucket), 'fields': fields}
+
+    """Check a POST form to bucket against its signed policy; key is the
+    key it stores the file under
+    """
+    def check_presigned_post(self, bucket, key, form):
+        policy = form.get('policy', '')
+        expected = self._signature('POST', policy)
+        if not hmac.compare_digest(expected, form.get('signature', '')):
+            raise _error('SignatureDoesNotMatch', 'The request signature does not match', 'PostObject')
+        policy = json.loads(base64.b64decode(policy))
+        self._check_expiry(policy.get('expiration'), 'PostObject')
+        values = dict(form, bucket=bucket, key=key)
+        for condition in policy['conditions']:
+            if isinstance(condition, dict):
+                matched = all(values.get(name) == value for name, value in condition.items())
+            else:
+                operator, name, value = condition
+                if operator == 'starts-with':
+                    matched = values.get(name.lstrip('$'), '').startswith(value)
+                else:
+                    matched = values.get(name.lstrip('$')) == value
+            if not matched:
+                raise _error('AccessDenied', 'Invalid according to Policy: {}'.format(condition),
+                    'PostObject')
+
+
+class LocalS3Object(object):
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket_name = bucket
+        self.key = key
+
+    def get(self, **kwargs):
+        return self.s3.get_object(Bucket=self.bucket_name, Key=self.key, **kwargs)
+
+    def delete(self):
+        return self.s3.delete_object(Bucket=self.bucket_name, Key=self.key)
+
+
+class LocalS3Resource(object):
+    class _Meta(object):
+        def __init__(self, client):
+            self.client = client
+
+    def __init__(self, s3):
+        self.meta = self._Meta(s3)
+
+    def Object(self, bucket_name, key):
+        return LocalS3Object(self.meta.client, bucket_name, key)
+
+
+def _to_json(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, float):
+        # boto3 refuses floats too; catch the same mistakes locally
+        raise TypeError('Float types are not supported. Use Decimal types instead.')
+    raise TypeError('Unsupported type: {!r}'.format(value))
+
+
+def _dump(item):
+    return json.dumps(item, default=_to_json, sort_keys=True)
+
+
+def _load(text):
+    return json.loads(text, parse_float=Decimal, parse_int=Decimal)
+
+
+class _Expression(object):
+    """Evaluates the subset of DynamoDB expression syntax the GAS uses:
+    comparisons (=, <>, <, <=, >, >=), IN, BETWEEN, begins_with,
+    attribute_exists/attribute_not_exists, AND, OR, NOT and parentheses
+    """
+    TOKEN = re.compile(r'\s*(<>|<=|>=|[=<>(),]|[#:]?[A-Za-z_][\w.]*)')
+
+    def __init__(self, text, names, values):
+        self.tokens = self.TOKEN.findall(text)
+        self.names = names or {}
+        self.values = values or {}
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _operand(self, item):
+        token = self._next()
+        if token.startswith(':'):
+            return self.values[token]
+        return item.get(self.names.get(token, token))
+
+    def evaluate(self, item):
+        self.pos = 0
+        return self._or(item)
+
+    def _or(self, item):
+        result = self._and(item)
+        while self._peek() and self._peek().upper() == 'OR':
+            self._next()
+            right = self._and(item)
+            result = result or right
+        return result
+
+    def _and(self, item):
+        result = self._not(item)
+        while self._peek() and self._peek().upper() == 'AND':
+            self._next()
+            right = self._not(item)
+            result = result and right
+        return result
+
+    def _not(self, item):
+        if self._peek() and self._peek().upper() == 'NOT':
+            self._next()
+            return not self._not(item)
+        return self._comparison(item)
+
+    def _comparison(self, item):
+        token = self._peek()
+        if token == '(':
+            self._next()
+            result = self._or(item)
+            self._next()
+            return result
+        if token in ('attribute_exists', 'attribute_not_exists', 'begins_with'):
+            self._next()
+            self._next()
+            name = self._next()
+            name = self.names.get(name, name)
+            if token == 'begins_with':
+                self._next()
+                prefix = self.values[self._next()]
+                self._next()
+                return isinstance(item.get(name), str) and item[name].startswith(prefix)
+            self._next()
+            return (name in item) == (token == 'attribute_exists')
+
+        left = self._operand(item)
+        operator = self._next()
+        if operator.upper() == 'IN':
+            self._next()
+            options = [self._operand(item)]
+            while self._next() == ',':
+                options.append(self._operand(item))
+            return left in options
+        if operator.upper() == 'BETWEEN':
+            low = self._operand(item)
+            self._next()
+            high = self._operand(item)
+            return left is not None and low <= left <= high
+        right = self._operand(item)
+        if operator == '=':
+            return left == right
+        if operator == '<>':
+            return left != right
+        if left is None or right is None:
+            return False
+        return {'<': left < right, '<=': left <= right,
+            '>': left > right, '>=': left >= right}[operator]
+
+
+def _condition(condition, names, values, is_key_condition=False):
+    """Turn a boto3 condition object or an expression string into an
+    _Expression"""
+    names = dict(names or {})
+    values = dict(values or {})
+    if isinstance(condition, ConditionBase):
+        built = ConditionExpressionBuilder().build_expression(condition, is_key_condition)
+        names.update(built.attribute_name_placeholders)
+        values.update(built.attribute_value_placeholders)
+        condition = built.condition_expression
+    return _Expression(condition, names, values)
+
+
+def _numeric(values):
+    return {key: Decimal(str(value)) if isinstance(value, int) and not isinstance(value, bool) else value
+        for key, value in (values or {}).items()}
+
+
+def _apply_update(item, expression, names, values):
+    """Apply a SET/ADD/REMOVE update expression; returns updated names"""
+    updated = []
+    clauses = re.split(r'\b(SET|ADD|REMOVE)\b', expression, flags=re.IGNORECASE)
+    action = None
+    for clause in clauses:
+        if clause.upper() in ('SET', 'ADD', 'REMOVE'):
+            action = clause.upper()
+            continue
+        for part in [p.strip() for p in clause.split(',') if p.strip()]:
+            if action == 'SET':
+                name, _, value = [p.strip() for p in part.partition('=')]
+                name = names.get(name, name)
+                match = re.match(r'if_not_exists\s*\(\s*([#\w]+)\s*,\s*(:\w+)\s*\)', value)
+                if match:
+                    existing = names.get(match.group(1), match.group(1))
+                    item[name] = item.get(existing, values[match.group(2)])
+                elif '+' in value or ' - ' in value:
+                    operator = '+' if '+' in value else '-'
+                    left, right = [p.strip() for p in value.split(operator, 1)]
+                    left = values[left] if left.startswith(':') else item.get(names.get(left, left), 0)
+                    right = values[right] if right.startswith(':') else item.get(names.get(right, right), 0)
+                    item[name] = left + right if operator == '+' else left - right
+                else:
+                    item[name] = values[value] if value.startswith(':') else item.get(names.get(value, value))
+            elif action == 'ADD':
+                name, value = part.split()
+                name = names.get(name, name)
+                item[name] = item.get(name, Decimal(0)) + values[value]
+            elif action == 'REMOVE':
+                name = names.get(part, part)
+                item.pop(name, None)
+            updated.append(name)
+    return updated
+
+
+def _project(item, projection, names):
+    if not projection:
+        return item
+    fields = [names.get(name.strip(), name.strip()) for name in projection.split(',')]
+    return {name: item[name] for name in fields if name in item}
+
+
+class LocalTable(object):
+    """A DynamoDB table stored as JSON items in a SQLite table
+    """
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def _key_names(self):
+        return self.db.key_schema(self.name)
+
+    def _key(self, key):
+        hash_key, range_key = self._key_names()
+        return _dump([key[hash_key], key.get(range_key) if range_key else None])
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        item = self.db.get(self.name, self._key(Key))
+        if item is None:
+            return {}
+        return {'Item': _project(item, ProjectionExpression, ExpressionAttributeNames or {})}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None, **kwargs):
+        hash_key, range_key = self._key_names()
+        key = self._key(Item)
+        item = _load(_dump(Item))
+        with self.db.transaction():
+            if ConditionExpression is not None:
+                current = self.db.get(self.name, key) or {}
+                expression = _condition(ConditionExpression, ExpressionAttributeNames,
+                    _numeric(ExpressionAttributeValues))
+                if not expression.evaluate(current):
+                    raise _error('ConditionalCheckFailedException', 'The conditional request failed', 'PutItem')
+            self.db.put(self.name, key, item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+        ExpressionAttributeNames=None, ConditionExpression=None, ReturnValues='NONE',
+        ReturnValuesOnConditionCheckFailure='NONE', **kwargs):
+        names = ExpressionAttributeNames or {}
+        values = _load(_dump(_numeric(ExpressionAttributeValues)))
+        key = self._key(Key)
+        with self.db.transaction():
+            current = self.db.get(self.name, key)
+            if ConditionExpression is not None:
+                expression = _condition(ConditionExpression, names, values)
+                if not expression.evaluate(current or {}):
+                    fields = {}
+                    if ReturnValuesOnConditionCheckFailure == 'ALL_OLD' and current:
+                        # As DynamoDB sends it: in the low-level format
+                        serializer = TypeSerializer()
+                        fields['Item'] = {name: serializer.serialize(value)
+                            for name, value in current.items()}
+                    raise _error('ConditionalCheckFailedException', 'The conditional request failed',
+                        'UpdateItem', **fields)
+            item = dict(current or {}, **Key)
+            updated = _apply_update(item, UpdateExpression, names, values)
+            self.db.put(self.name, key, item)
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': item}
+        if ReturnValues == 'UPDATED_NEW':
+            return {'Attributes': {name: item[name] for name in updated if name in item}}
+        if ReturnValues == 'ALL_OLD' and current:
+            return {'Attributes': current}
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None, **kwargs):
+        key = self._key(Key)
+        with self.db.transaction():
+            if ConditionExpression is not None:
+                current = self.db.get(self.name, key) or {}
+                expression = _condition(ConditionExpression, ExpressionAttributeNames,
+                    _numeric(ExpressionAttributeValues))
+                if not expression.evaluate(current):
+                    raise _error('ConditionalCheckFailedException', 'The conditional request failed', 'DeleteItem')
+            self.db.delete(self.name, key)
+        return {}
+
+    def _page(self, items, Limit=None, ExclusiveStartKey=None, index_keys=()):
+        hash_key, range_key = self._key_names()
+        if ExclusiveStartKey:
+            start = self._key(ExclusiveStartKey)
+            for i, item in enumerate(items):
+                if self._key(item) == start:
+                    items = items[i + 1:]
+                    break
+        response = {}
+        if Limit and len(items) > Limit:
+            items = items[:Limit]
+            last = items[-1]
+            response['LastEvaluatedKey'] = {name: last[name]
+                for name in (hash_key, range_key) + tuple(index_keys) if name}
+        response['Items'] = items
+        response['Count'] = len(items)
+        return response
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None, Limit=None, ExclusiveStartKey=None, **kwargs):
+        names = ExpressionAttributeNames or {}
+        items = self.db.all(self.name)
+        if FilterExpression is not None:
+            expression = _condition(FilterExpression, names, _numeric(ExpressionAttributeValues))
+            items = [item for item in items if expression.evaluate(item)]
+        response = self._page(items, Limit, ExclusiveStartKey)
+        response['Items'] = [_project(item, ProjectionExpression, names) for item in response['Items']]
+        return response
+
+    def query(self, KeyConditionExpression, IndexName=None, FilterExpression=None,
+        ProjectionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+        ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, **kwargs):
+        names = ExpressionAttributeNames or {}
+        values = _numeric(ExpressionAttributeValues)
+        if IndexName is None:
+            hash_key, range_key = self._key_names()
+        else:
+            index = self.db.indexes(self.name).get(IndexName)
+            if index is None:
+                raise _error('ValidationException',
+                    'The table does not have the specified index: {}'.format(IndexName), 'Query')
+            hash_key, range_key = index['HASH'], index.get('RANGE')
+        key_condition = _condition(KeyConditionExpression, names, values, is_key_condition=True)
+        # Items without the index's keys are not in the index
+        items = [item for item in self.db.all(self.name) if hash_key in item and
+            (range_key is None or range_key in item) and key_condition.evaluate(item)]
+        if range_key is not None:
+            items.sort(key=lambda item: item[range_key], reverse=not ScanIndexForward)
+        # As in DynamoDB, Limit counts the items read, before the filter
+        response = self._page(items, Limit, ExclusiveStartKey, (hash_key, range_key) if IndexName else ())
+        if FilterExpression is not None:
+            expression = _condition(FilterExpression, names, values)
+            response['Items'] = [item for item in response['Items'] if expression.evaluate(item)]
+            response['Count'] = len(response['Items'])
+        response['Items'] = [_project(item, ProjectionExpression, names) for item in response['Items']]
+        return response
+
+    @property
+    def global_secondary_indexes(self):
+        return [{'IndexName': index_name, 'IndexStatus': 'ACTIVE',
+            'KeySchema': [{'AttributeName': name, 'KeyType': key_type} for key_type, name in keys.items()]}
+            for index_name, keys in self.db.indexes(self.name).items()]
+
+    @property
+    def billing_mode_summary(self):
+        return {'BillingMode': 'PAY_PER_REQUEST'}
+
+    def reload(self):
+        pass
+
+    """Only creating global secondary indexes is supported; the index
+    is ready as soon as this returns
+    """
+    def update(self, AttributeDefinitions=None, GlobalSecondaryIndexUpdates=None, **kwargs):
+        for index_update in GlobalSecondaryIndexUpdates or []:
+            if 'Create' in index_update:
+                self.db.create_index(self.name, index_update['Create']['IndexName'],
+                    index_update['Create']['KeySchema'])
+        return {}
+
+
+class _Database(object):
+    """SQLite database shared by the services of a LocalBackend, and by
+    every process that uses the same root (web server, annotator, run.py,
+    utilities)
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self.connection()
+        db.execute('CREATE TABLE IF NOT EXISTS _tables (name TEXT PRIMARY KEY, '
+            'hash_key TEXT, range_key TEXT, indexes TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS items (tbl TEXT, key TEXT, item TEXT, '
+            'PRIMARY KEY (tbl, key))')
+        db.execute('CREATE TABLE IF NOT EXISTS queues (url TEXT PRIMARY KEY, attributes TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS messages (id TEXT PRIMARY KEY, queue TEXT, '
+            'body TEXT, attributes TEXT, sent REAL, visible_at REAL, receive_count INTEGER, '
+            'receipt TEXT)')
+        db.execute('CREATE INDEX IF NOT EXISTS messages_visible ON messages (queue, visible_at)')
+        db.execute('CREATE INDEX IF NOT EXISTS messages_receipt ON messages (receipt)')
+        db.execute('CREATE TABLE IF NOT EXISTS subscriptions (topic TEXT, endpoint TEXT, '
+            'filter TEXT, PRIMARY KEY (topic, endpoint))')
+
+    def connection(self):
+        # Connections are per thread, and never carried over into a
+        # forked process (e.g. a warm worker)
+        db, pid = getattr(self._local, 'db', (None, None))
+        if db is None or pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = (db, os.getpid())
+        return db
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    """Serialize read-modify-write updates, within this process (lock) and
+    across processes (SQLite write lock)
+    """
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            db = self.connection()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+
+class LocalDynamoDB(object):
+    """DynamoDB resource; items are JSON documents in the shared database
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def transaction(self):
+        return self.db.transaction()
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=None, **kwargs):
+        keys = {entry['KeyType']: entry['AttributeName'] for entry in KeySchema}
+        indexes = {index['IndexName']: {entry['KeyType']: entry['AttributeName'] for entry in index['KeySchema']}
+            for index in (GlobalSecondaryIndexes or [])}
+        self.db.execute('INSERT OR REPLACE INTO _tables VALUES (?, ?, ?, ?)',
+            (TableName, keys['HASH'], keys.get('RANGE'), json.dumps(indexes)))
+        return self.Table(TableName)
+
+    def key_schema(self, name):
+        row = self.db.execute(
+            'SELECT hash_key, range_key FROM _tables WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise _error('ResourceNotFoundException', 'Requested resource not found: {}'.format(name), 'DescribeTable')
+        return row
+
+    def indexes(self, name):
+        row = self.db.execute('SELECT indexes FROM _tables WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def create_index(self, name, index_name, key_schema):
+        with self.db.transaction():
+            indexes = self.indexes(name)
+            indexes[index_name] = {entry['KeyType']: entry['AttributeName'] for entry in key_schema}
+            self.db.execute('UPDATE _tables SET indexes = ? WHERE name = ?', (json.dumps(indexes), name))
+
+    def Table(self, name):
+        return LocalTable(self, name)
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        if sum(len(request['Keys']) for request in RequestItems.values()) > 100:
+            raise _error('ValidationException',
+                'Too many items requested for the BatchGetItem call', 'BatchGetItem')
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            responses[name] = []
+            for key in request['Keys']:
+                response = table.get_item(Key=key,
+                    ProjectionExpression=request.get('ProjectionExpression'),
+                    ExpressionAttributeNames=request.get('ExpressionAttributeNames'))
+                if 'Item' in response:
+                    responses[name].append(response['Item'])
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def get(self, table, key):
+        row = self.db.execute(
+            'SELECT item FROM items WHERE tbl = ? AND key = ?', (table, key)).fetchone()
+        return _load(row[0]) if row else None
+
+    def put(self, table, key, item):
+        self.db.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?)', (table, key, _dump(item)))
+
+    def delete(self, table, key):
+        self.db.execute('DELETE FROM items WHERE tbl = ? AND key = ?', (table, key))
+
+    def all(self, table):
+        rows = self.db.execute('SELECT item FROM items WHERE tbl = ? ORDER BY key', (table,))
+        return [_load(row[0]) for row in rows]
+
+
+class LocalSQS(object):
+    """SQS queues with visibility timeouts and long polling; queues are
+    created on first use
+    Messages live in the shared database, so any process can send to and
+    receive from a queue. Receivers in the sending process are woken at
+    once; receivers in other processes see new messages within
+    POLL_INTERVAL.
+    """
+    POLL_INTERVAL = 0.1
+    # URLs of queues made with create_queue
+    QUEUE_URL_PREFIX = 'https://sqs.local'
+
+    def __init__(self, db):
+        self.db = db
+        self._cond = threading.Condition()
+
+    def _attributes(self, url):
+        row = self.db.execute('SELECT attributes FROM queues WHERE url = ?', (url,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def create_queue(self, QueueName, Attributes=None, **kwargs):
+        url = '{}/{}'.format(self.QUEUE_URL_PREFIX, QueueName)
+        self.set_queue_attributes(url, Attributes or {})
+        return {'QueueUrl': url}
+
+    def delete_queue(self, QueueUrl, **kwargs):
+        with self.db.transaction() as db:
+            db.execute('DELETE FROM queues WHERE url = ?', (QueueUrl,))
+            db.execute('DELETE FROM messages WHERE queue = ?', (QueueUrl,))
+            db.execute('DELETE FROM subscriptions WHERE endpoint = ?', (QueueUrl,))
+        return {}
+
+    def set_queue_attributes(self, QueueUrl, Attributes):
+        with self.db.transaction() as db:
+            attributes = self._attributes(QueueUrl)
+            attributes.update(Attributes)
+            db.execute('INSERT OR REPLACE INTO queues VALUES (?, ?)', (QueueUrl, json.dumps(attributes)))
+        return {}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        now = time.time()
+        visible, total = self.db.execute(
+            'SELECT COALESCE(SUM(visible_at <= ?), 0), COUNT(*) FROM messages WHERE queue = ?',
+            (now, QueueUrl)).fetchone()
+        # Local queues are addressed by their URL, in place of an ARN
+        return {'Attributes': dict(self._attributes(QueueUrl), QueueArn=QueueUrl,
+            ApproximateNumberOfMessages=str(visible),
+            ApproximateNumberOfMessagesNotVisible=str(total - visible))}
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, MessageAttributes=None, **kwargs):
+        message_id = str(uuid.uuid4())
+        now = time.time()
+        self.db.execute('INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, 0, NULL)',
+            (message_id, QueueUrl, MessageBody, json.dumps(MessageAttributes or {}), now, now + DelaySeconds))
+        with self._cond:
+            self._cond.notify_all()
+        return {'MessageId': message_id}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        for entry in Entries:
+            self.send_message(QueueUrl, entry['MessageBody'], entry.get('DelaySeconds', 0),
+                entry.get('MessageAttributes'))
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def _receive(self, url, max_messages, visibility_timeout):
+        now = time.time()
+        messages = []
+        with self.db.transaction() as db:
+            rows = db.execute('SELECT id, body, attributes, sent, receive_count FROM messages '
+                'WHERE queue = ? AND visible_at <= ? ORDER BY sent LIMIT ?',
+                (url, now, max_messages)).fetchall()
+            for message_id, body, attributes, sent, receive_count in rows:
+                receipt = uuid.uuid4().hex
+                db.execute('UPDATE messages SET visible_at = ?, receive_count = ?, receipt = ? '
+                    'WHERE id = ?', (now + visibility_timeout, receive_count + 1, receipt, message_id))
+                messages.append({
+                    'MessageId': message_id,
+                    'ReceiptHandle': receipt,
+                    'Body': body,
+                    'MessageAttributes': json.loads(attributes),
+                    'Attributes': {
+                        'SentTimestamp': str(int(sent * 1000)),
+                        'ApproximateReceiveCount': str(receive_count + 1)
+                    }
+                })
+        return messages
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=None,
+        VisibilityTimeout=None, AttributeNames=None, MessageAttributeNames=None, **kwargs):
+        attributes = self._attributes(QueueUrl)
+        if WaitTimeSeconds is None:
+            WaitTimeSeconds = int(attributes.get('ReceiveMessageWaitTimeSeconds', 0))
+        if VisibilityTimeout is None:
+            VisibilityTimeout = int(attributes.get('VisibilityTimeout', 30))
+        deadline = time.time() + WaitTimeSeconds
+        while True:
+            messages = self._receive(QueueUrl, MaxNumberOfMessages, VisibilityTimeout)
+            remaining = deadline - time.time()
+            if messages or remaining <= 0:
+                break
+            with self._cond:
+                self._cond.wait(min(remaining, self.POLL_INTERVAL))
+        return {'Messages': messages} if messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.db.execute('DELETE FROM messages WHERE queue = ? AND receipt = ?', (QueueUrl, ReceiptHandle))
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        for entry in Entries:
+            self.delete_message(QueueUrl, entry['ReceiptHandle'])
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        cursor = self.db.execute('UPDATE messages SET visible_at = ? WHERE queue = ? AND receipt = ?',
+            (time.time() + VisibilityTimeout, QueueUrl, ReceiptHandle))
+        if cursor.rowcount == 0:
+            raise _error('ReceiptHandleIsInvalid', 'The receipt handle is not valid', 'ChangeMessageVisibility')
+        return {}
+
+
+class LocalSNS(object):
+    """Topics fan out to the SQS queues subscribed to them, wrapping each
+    message in an SNS notification envelope as SNS does
+    A subscription's FilterPolicy ({attribute: [values]}) limits it to
+    messages whose string attributes match, as on SNS.
+    """
+    def __init__(self, db, sqs):
+        self.db = db
+        self.sqs = sqs
+
+    def subscribe(self, TopicArn, Protocol='sqs', Endpoint=None, Attributes=None, **kwargs):
+        self.db.execute('INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?)',
+            (TopicArn, Endpoint, (Attributes or {}).get('FilterPolicy')))
+        return {'SubscriptionArn': '{}:{}'.format(TopicArn, Endpoint)}
+
+    def unsubscribe(self, SubscriptionArn, **kwargs):
+        self.db.execute("DELETE FROM subscriptions WHERE topic || ':' || endpoint = ?",
+            (SubscriptionArn,))
+        return {}
+
+    def _matches(self, filter_policy, message_attributes):
+        if not filter_policy:
+            return True
+        for name, values in json.loads(filter_policy).items():
+            attribute = message_attributes.get(name)
+            if attribute is None or attribute.get('StringValue') not in values:
+                return False
+        return True
+
+    def publish(self, TopicArn, Message, Subject=None, MessageAttributes=None, **kwargs):
+        message_id = str(uuid.uuid4())
+        envelope = json.dumps({
+            'Type': 'Notification',
+            'MessageId': message_id,
+            'TopicArn': TopicArn,
+            'Subject': Subject,
+            'Message': Message,
+            'Timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'MessageAttributes': MessageAttributes or {}
+        })
+        rows = self.db.execute('SELECT endpoint, filter FROM subscriptions WHERE topic = ?',
+            (TopicArn,)).fetchall()
+        for queue_url, filter_policy in rows:
+            if self._matches(filter_policy, MessageAttributes or {}):
+                self.sqs.send_message(QueueUrl=queue_url, MessageBody=envelope)
+        return {'MessageId': message_id}
+
+
+class LocalGlacier(object):
+    """Archives are files under <root>/<vault>; retrievals complete at once
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, vault, archive_id):
+        return os.path.join(self.root, vault, archive_id)
+
+    def upload_archive(self, vaultName, body, archiveDescription='', **kwargs):
+        archive_id = uuid.uuid4().hex
+        path = self._path(vaultName, archive_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as archive_file:
+            archive_file.write(body if isinstance(body, bytes) else body.read())
+        with open(path + '.json', 'w') as meta_file:
+            json.dump({'description': archiveDescription}, meta_file)
+        return {
+            'archiveId': archive_id,
+            'location': '/-/vaults/{}/archives/{}'.format(vaultName, archive_id),
+            'ResponseMetadata': {'HTTPHeaders': {'x-amz-archive-id': archive_id}}
+        }
+
+    def initiate_job(self, vaultName, jobParameters, **kwargs):
+        job_id = uuid.uuid4().hex
+        jobs_dir = os.path.join(self.root, vaultName, 'jobs')
+        os.makedirs(jobs_dir, exist_ok=True)
+        with open(os.path.join(jobs_dir, job_id), 'w') as job_file:
+            json.dump(jobParameters, job_file)
+        return {'jobId': job_id}
+
+    def describe_job(self, vaultName, jobId, **kwargs):
+        with open(os.path.join(self.root, vaultName, 'jobs', jobId)) as job_file:
+            parameters = json.load(job_file)
+        return {'JobId': jobId, 'ArchiveId': parameters['ArchiveId'],
+            'StatusCode': 'Succeeded', 'Completed': True}
+
+    def get_job_output(self, vaultName, jobId, **kwargs):
+        archive_id = self.describe_job(vaultName, jobId)['ArchiveId']
+        path = self._path(vaultName, archive_id)
+        with open(path, 'rb') as archive_file, open(path + '.json') as meta_file:
+            return {'body': LocalBody(archive_file.read()),
+                'archiveDescription': json.load(meta_file)['description']}
+
+    def delete_archive(self, vaultName, archiveId, **kwargs):
+        path = self._path(vaultName, archiveId)
+        for archive_file in (path, path + '.json'):
+            if os.path.exists(archive_file):
+                os.remove(archive_file)
+        return {}
+
+
+class LocalGlacierJob(object):
+    def __init__(self, glacier, vault_name, job_id):
+        self.glacier = glacier
+        self.vault_name = vault_name
+        self.id = job_id
+
+    @property
+    def status_code(self):
+        return self.glacier.describe_job(self.vault_name, self.id)['StatusCode']
+
+    def get_output(self, **kwargs):
+        return self.glacier.get_job_output(self.vault_name, self.id)
+
+
+class LocalGlacierArchive(object):
+    def __init__(self, glacier, vault_name, archive_id):
+        self.glacier = glacier
+        self.vault_name = vault_name
+        self.id = archive_id
+
+    def initiate_archive_retrieval(self, **kwargs):
+        job_id = self.glacier.initiate_job(self.vault_name,
+            {'Type': 'archive-retrieval', 'ArchiveId': self.id})['jobId']
+        return LocalGlacierJob(self.glacier, self.vault_name, job_id)
+
+    def delete(self):
+        return self.glacier.delete_archive(self.vault_name, self.id)
+
+
+class LocalGlacierResource(object):
+    def __init__(self, glacier):
+        self.glacier = glacier
+
+    def Archive(self, account_id, vault_name, id):
+        return LocalGlacierArchive(self.glacier, vault_name, id)
+
+    def Job(self, account_id, vault_name, id):
+        return LocalGlacierJob(self.glacier, vault_name, id)
+
+
+class LocalSES(object):
+    """Emails are written to <root>, one JSON file per message
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def send_email(self, Destination, Message, Source, **kwargs):
+        message_id = uuid.uuid4().hex
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, '{}.json'.format(message_id)), 'w') as mail_file:
+            json.dump({'Source': Source, 'Destination': Destination, 'Message': Message,
+                'sent': time.time()}, mail_file, indent=2)
+        return {'MessageId': message_id}
+
+    def get_send_quota(self, **kwargs):
+        # The default SES sandbox quota
+        return {'Max24HourSend': 200.0, 'MaxSendRate': 1.0, 'SentLast24Hours': 0.0}
+
+
+class LocalSecretsManager(object):
+    """Secrets are JSON files at <root>/<SecretId>.json
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def get_secret_value(self, SecretId, **kwargs):
+        path = os.path.join(self.root, SecretId + '.json')
+        if not os.path.isfile(path):
+            raise _error('ResourceNotFoundException',
+                "Secrets Manager can't find the specified secret.", 'GetSecretValue')
+        with open(path) as secret_file:
+            return {'Name': SecretId, 'SecretString': secret_file.read()}
+
+
+class LocalBackend(object):
+    """All local services under one root directory
+    base_url is where the web app serves local objects (see the /local/s3
+    routes in web/views.py), for presigned URLs and POSTs.
+    """
+    def __init__(self, root, base_url=None):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.db = _Database(os.path.join(root, 'gas.sqlite3'))
+        self.s3 = LocalS3(os.path.join(root, 's3'), base_url)
+        self.dynamodb = LocalDynamoDB(self.db)
+        self.sqs = LocalSQS(self.db)
+        self.sns = LocalSNS(self.db, self.sqs)
+        self.glacier = LocalGlacier(os.path.join(root, 'glacier'))
+        self._clients = {
+            's3': self.s3,
+            'sqs': self.sqs,
+            'sns': self.sns,
+            'glacier': self.glacier,
+            'ses': LocalSES(os.path.join(root, 'ses')),
+            'secretsmanager': LocalSecretsManager(os.path.join(root, 'secrets'))
+        }
+        self._resources = {
+            's3': LocalS3Resource(self.s3),
+            'dynamodb': self.dynamodb,
+            'glacier': LocalGlacierResource(self.glacier)
+        }
+
+    def client(self, service):
+        if service not in self._clients:
+            raise NotImplementedError('No local {} client'.format(service))
+        return self._clients[service]
+
+    def resource(self, service):
+        if service not in self._resources:
+            raise NotImplementedError('No local {} resource'.format(service))
+        return self._resources[service]
+
+
+"""Create the tables and topic subscriptions a GAS node needs, as listed
+in local_backend_config.ini
+"""
+def setup(backend, setup_config):
+    for table, keys in setup_config.items('tables'):
+        hash_key, _, range_key = keys.partition(',')
+        key_schema = [{'AttributeName': hash_key.strip(), 'KeyType': 'HASH'}]
+        if range_key:
+            key_schema.append({'AttributeName': range_key.strip(), 'KeyType': 'RANGE'})
+        backend.dynamodb.create_table(TableName=table, KeySchema=key_schema)
+    for table, indexes in setup_config.items('indexes'):
+        # <index name>: <hash key>, <range key>
+        for index in indexes.splitlines():
+            if not index.strip():
+                continue
+            index_name, _, keys = index.partition(':')
+            hash_key, _, range_key = keys.partition(',')
+            key_schema = [{'AttributeName': hash_key.strip(), 'KeyType': 'HASH'}]
+            if range_key:
+                key_schema.append({'AttributeName': range_key.strip(), 'KeyType': 'RANGE'})
+            backend.dynamodb.create_index(table, index_name.strip(), key_schema)
+    for topic, queues in setup_config.items('subscriptions'):
+        # <queue url>[;<attribute>=<value>] subscribes with a filter policy
+        for subscription in queues.split():
+            queue_url, _, attribute = subscription.partition(';')
+            attributes = {}
+            if attribute:
+                name, _, value = attribute.partition('=')
+                attributes['FilterPolicy'] = json.dumps({name: [value]})
+            backend.sns.subscribe(TopicArn=topic, Protocol='sqs', Endpoint=queue_url,
+                Attributes=attributes)
+
+
+if __name__ == '__main__':
+    from configparser import ConfigParser
+    # Topic ARNs contain ':', so only '=' separates names from values
+    setup_config = ConfigParser(delimiters=('=',))
+    setup_config.optionxform = str
+    setup_config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_backend_config.ini'))
+    root = os.environ.get('GAS_LOCAL_ROOT', setup_config['local']['Root'])
+    setup(LocalBackend(root), setup_config)
+    print('Local backend ready in {}'.format(os.path.abspath(root)))
+
+### EOF
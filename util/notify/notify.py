@@ -0,0 +1,247 @@
+# notify.py
+#
+# NOTE: This file lives on the Utils instance
+#
+# Emails users when their annotation jobs complete
+#
+# Completion messages are long polled from the results queue in batches,
+# and the recipients of a whole batch are looked up in one query. Emails
+# go out on a pool of threads, no faster than SES allows, and sends that
+# SES throttles anyway are retried with backoff. Completions for the same
+# user close together can be sent as one digest email.
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Import utility helpers
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+import helpers
+import client_pool
+
+# Get configuration
+from configparser import ConfigParser
+config = ConfigParser(os.environ)
+config.read('notify_config.ini')
+
+# Error codes of a send refused for going over the SES send rate
+THROTTLED = ('Throttling', 'ThrottlingException', 'TooManyRequestsException')
+
+# Seconds to wait after a failed receive, doubled while receives keep
+# failing, up to the longest
+ERROR_BACKOFF = 1
+MAX_ERROR_BACKOFF = 60
+
+
+class TokenBucket(object):
+    """Allows rate acquisitions per second on average, and bursts of up to
+    capacity; shared by the sending threads
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    """Block until a token is free, and take it
+    """
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                shortfall = (1 - self.tokens) / self.rate
+            time.sleep(shortfall)
+
+
+class Digest(object):
+    """Completions waiting to be sent to one user
+    """
+    def __init__(self, email):
+        self.email = email
+        self.first = time.time()
+        self.jobs = []
+        self.receipt_handles = []
+
+
+"""Subject and body of the email for one or more completed jobs
+"""
+def email_text(jobs):
+    url = config['gas']['AnnotationsUrl']
+    if len(jobs) == 1:
+        job = jobs[0]
+        return ('Results available for job {}'.format(job['job_id']),
+            'Your annotation job for {} has completed.\n\nView the results at {}/{}\n'.format(
+                job['input_file_name'], url, job['job_id']))
+    lines = ['{}: {}/{}'.format(job['input_file_name'], url, job['job_id']) for job in jobs]
+    return ('Results available for {} jobs'.format(len(jobs)),
+        'Your annotation jobs have completed.\n\n{}\n'.format('\n'.join(lines)))
+
+
+"""Send one email, waiting for a send token first and retrying when SES
+throttles it; then delete the messages it covers from the queue
+Runs on a sending thread; a failed send leaves its messages to become
+visible again.
+"""
+def send(sqs, queue_url, bucket, digest):
+    subject, body = email_text(digest.jobs)
+    for attempt in range(config.getint('notify', 'MaxRetries') + 1):
+        bucket.acquire()
+        try:
+            helpers.send_email_ses(recipients=digest.email, subject=subject, body=body)
+            break
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLED or \
+                attempt == config.getint('notify', 'MaxRetries'):
+                print('Error in sending email to {}: {}'.format(digest.email, e))
+                return False
+            # Full jitter, so throttled threads do not retry in step
+            time.sleep(random.uniform(0, config.getfloat('notify', 'RetryBaseSecs') * 2 ** attempt))
+
+    delete(sqs, queue_url, digest.receipt_handles)
+    print('Notified {} of {} job(s)'.format(digest.email, len(digest.jobs)))
+    return True
+
+
+"""Delete messages from the queue; messages that cannot be deleted are
+received again, and their jobs notified again
+"""
+def delete(sqs, queue_url, receipt_handles):
+    for start in range(0, len(receipt_handles), 10):
+        try:
+            sqs.delete_message_batch(QueueUrl=queue_url, Entries=[
+                {'Id': str(i), 'ReceiptHandle': receipt_handle}
+                for i, receipt_handle in enumerate(receipt_handles[start:start + 10])])
+        except (BotoCoreError, ClientError) as e:
+            print('Error in deleting notified messages: {}'.format(e))
+
+
+"""Email address of the user of each job, by user id
+Messages may carry the address already; the rest are looked up in one
+query for the whole batch, which is timed here now that run.py no longer
+does the lookup.
+"""
+def recipients(jobs):
+    emails = dict((job['user_id'], job['user_email']) for job in jobs if job.get('user_email'))
+    missing = set(job['user_id'] for job in jobs) - set(emails)
+    if missing:
+        start = time.time()
+        for user_id, profile in helpers.get_user_profiles(missing).items():
+            emails[user_id] = profile['email']
+        print('Profile lookup: {} user(s) for {} job(s) in {}ms'.format(
+            len(missing), len(jobs), int(round((time.time() - start) * 1000))))
+    return emails
+
+
+def notify():
+    sqs = client_pool.client('sqs', config['aws']['AwsRegionName'])
+    queue_url = config['aws']['AwsSQSResultsUrl']
+    # Enable long polling on an existing SQS queue
+    try:
+        sqs.set_queue_attributes(
+            QueueUrl=queue_url,
+            Attributes={'ReceiveMessageWaitTimeSeconds': '20'}
+        )
+    except (BotoCoreError, ClientError) as e:
+        print('Error in enabling long polling: {}'.format(e))
+
+    send_rate = config.getfloat('notify', 'SendRate')
+    if not send_rate:
+        ses = client_pool.client('ses', config['aws']['AwsRegionName'])
+        send_rate = ses.get_send_quota()['MaxSendRate']
+    bucket = TokenBucket(send_rate)
+    concurrency = config.getint('notify', 'SendConcurrency')
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    sending = set()
+
+    batch_size = min(config.getint('notify', 'BatchSize'), 10)
+    wait_time = config.getint('notify', 'WaitTimeSeconds')
+    window = config.getfloat('notify', 'DigestWindowSecs')
+    digest_max = config.getint('notify', 'DigestMaxJobs')
+    # user id (or, without digests, receipt handle) -> Digest not yet sent
+    pending = {}
+
+    backoff = ERROR_BACKOFF
+    while True:
+        # Hold off receiving while the senders are behind, so messages are
+        # not received only to wait out their visibility timeout
+        while len(sending) >= concurrency * 2:
+            done, sending = wait_futures(sending, return_when=FIRST_COMPLETED)
+
+        # Wake in time to send the oldest digest
+        wait = wait_time
+        if pending:
+            first = min(digest.first for digest in pending.values())
+            wait = int(max(0, min(wait_time, first + window - time.time())))
+        try:
+            response = sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=batch_size,
+                WaitTimeSeconds=wait,
+                VisibilityTimeout=config.getint('notify', 'VisibilityTimeout')
+            )
+            backoff = ERROR_BACKOFF
+        except (BotoCoreError, ClientError) as e:
+            # Digests already received are still sent below
+            print('Error in receiving completions: {}'.format(e))
+            time.sleep(min(backoff, wait) if pending else backoff)
+            backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+            response = {}
+
+        jobs = []
+        for sqs_message in response.get('Messages', []):
+            try:
+                job = json.loads(json.loads(sqs_message['Body'])['Message'])
+            except (KeyError, ValueError):
+                # keep listening; malformed messages are left to expire
+                continue
+            jobs.append((job, sqs_message['ReceiptHandle']))
+
+        emails = {}
+        if jobs:
+            try:
+                emails = recipients([job for job, _ in jobs])
+            except (BotoCoreError, ClientError, helpers.psycopg2.Error) as e:
+                # Leave the batch to be received again
+                print('Error in looking up recipients: {}'.format(e))
+                jobs = []
+        for job, receipt_handle in jobs:
+            email = emails.get(job['user_id'])
+            if not email:
+                print('No email address for user {}; job {} not notified'.format(
+                    job['user_id'], job['job_id']))
+                delete(sqs, queue_url, [receipt_handle])
+                continue
+            # Without a digest window each completion is sent on its own
+            digest = pending.setdefault(job['user_id'] if window else receipt_handle, Digest(email))
+            digest.jobs.append(job)
+            digest.receipt_handles.append(receipt_handle)
+
+        # Send the digests whose window is over, or that are full
+        now = time.time()
+        for user_id, digest in list(pending.items()):
+            if now - digest.first >= window or len(digest.jobs) >= digest_max:
+                del pending[user_id]
+                sending.add(executor.submit(send, sqs, queue_url, bucket, digest))
+        sending = set(future for future in sending if not future.done())
+
+
+if __name__ == '__main__':
+    notify()
+
+### EOF
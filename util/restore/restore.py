@@ -10,7 +10,6 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 import os
 import sys
 import json
-import boto3
 import botocore
 import subprocess
 
@@ -18,6 +17,8 @@ import subprocess
 # Import utility helpers
 sys.path.insert(1, os.path.realpath(os.path.pardir))
 import helpers
+import client_pool
+import job_state
 
 # Get configuration
 from configparser import ConfigParser
@@ -25,9 +26,9 @@ config = ConfigParser(os.environ)
 config.read('restore_config.ini')
 
 def restore():
-    glacier = boto3.resource("glacier", region_name=config['aws']['AwsRegionName'])
+    glacier = client_pool.resource("glacier", config['aws']['AwsRegionName'])
     # Connect to SQS and get the message queue
-    sqs = boto3.client('sqs', region_name=config['aws']['AwsRegionName'])
+    sqs = client_pool.client('sqs', config['aws']['AwsRegionName'])
     queue_url = config['aws']['AwsSQSArchiveUrl']
     topic_arn = config['aws']['AwsSNSRestoreArn']
     # Enable long polling on an existing SQS queue
@@ -35,8 +36,10 @@ def restore():
         QueueUrl=queue_url,
         Attributes={'ReceiveMessageWaitTimeSeconds': '20'}
     )
-    dynamo = boto3.resource('dynamodb', region_name=config['aws']['AwsRegionName'])
+    dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
     table = dynamo.Table(config['aws']['AwsDynamoTable'])
+    job_state.publish_events(client_pool.client('sns', config['aws']['AwsRegionName']),
+        config['aws']['AwsSNSJobStatusArn'])
     while True:
         # Attempt to read a message from the queue
         try:
@@ -56,19 +59,17 @@ def restore():
 
         try:
             # change storage status
-            table.update_item( Key= {'job_id': str(message['job_id'])},
-                            UpdateExpression="SET results_file_retrieval_id = :r, storage_status = :ss",
-                            ExpressionAttributeValues={
-                                    ':r': str(job.id),
-                                    ':ss': 'RETRIEVING'
-                                    },
-                            ReturnValues="UPDATED_NEW"
-                            )
-        
+            job_state.transition(table, str(message['job_id']), job_state.STORAGE_STATUS, job_state.RETRIEVING,
+                {'results_file_retrieval_id': str(job.id)})
+        except job_state.TransitionError as e:
+            # Already being retrieved, or restored; thaw needs no second
+            # notice of it
+            print(str(e))
+            sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt_handle)
+            continue
         except botocore.exceptions.ClientError:
             print('Error in updating table!')
-        
-        
+
         # Delete the message from the queue, if job was successfully submitted
         sqs.delete_message(
             QueueUrl=queue_url,
@@ -81,7 +82,7 @@ def restore():
             data = {"retrieval_id": str(job.id),
                     "archive_id": str(message['archive_id'])
                     }
-            sns = boto3.client('sns', region_name=config['aws']['AwsRegionName'])
+            sns = client_pool.client('sns', config['aws']['AwsRegionName'])
             sns.publish(TopicArn=topic_arn, Message=json.dumps(data))
         except botocore.exceptions.ClientError:
             print("Error in publishing to SNS topic.")
@@ -0,0 +1,143 @@
+# runtime_estimator.py
+#
+# Estimates how long a job will take to annotate, and its lane
+#
+# The number of variants in an input is estimated from the object's size
+# and a sniff of its first bytes; a linear model fitted on the timings of
+# past jobs (see util/estimator) turns that into seconds of annotation,
+# and the estimate picks the small, medium or large lane the job is
+# queued in.
+#
+##
+
+import json
+import time
+
+from botocore.exceptions import ClientError
+
+LANES = ('small', 'medium', 'large')
+
+# Bytes read from the start of an input to estimate its record size
+SNIFF_BYTES = 65536
+
+# Seconds a loaded model is used before it is read again
+MODEL_TTL = 300
+
+# Used until enough jobs have run to fit a model
+DEFAULT_INTERCEPT_SECS = 5.0
+DEFAULT_SECS_PER_VARIANT = 0.001
+
+# Bytes per record assumed when the sniff holds no complete record
+DEFAULT_RECORD_BYTES = 100
+
+# model key -> (time loaded, RuntimeModel)
+_models = {}
+
+
+"""Size in bytes and estimated number of variants of an input object
+Files that fit in the sniff are counted exactly; for larger ones the
+records in the sniff give the average record size. An empty object has
+no range to read, and no variants.
+"""
+def sniff(s3, bucket, key):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key, Range='bytes=0-{}'.format(SNIFF_BYTES - 1))
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'InvalidRange':
+            raise
+        return 0, 0
+    size = int(response.get('ContentRange', '/{}'.format(response['ContentLength'])).rpartition('/')[2])
+    data = response['Body'].read()
+
+    lines = data.split(b'\n')
+    if size > len(data):
+        # The last line is cut off by the range
+        lines = lines[:-1]
+    header_bytes = 0
+    records = 0
+    record_bytes = 0
+    for line in lines:
+        if line.startswith(b'#'):
+            header_bytes += len(line) + 1
+        elif line.strip():
+            records += 1
+            record_bytes += len(line) + 1
+
+    if size <= len(data):
+        return size, records
+    average = float(record_bytes) / records if records else DEFAULT_RECORD_BYTES
+    return size, int((size - header_bytes) / average)
+
+
+class RuntimeModel(object):
+    """Annotation seconds = intercept_secs + secs_per_variant * variants
+    """
+    def __init__(self, intercept_secs=DEFAULT_INTERCEPT_SECS,
+        secs_per_variant=DEFAULT_SECS_PER_VARIANT, samples=0):
+        self.intercept_secs = intercept_secs
+        self.secs_per_variant = secs_per_variant
+        self.samples = samples
+
+    def estimate(self, variants):
+        return self.intercept_secs + self.secs_per_variant * variants
+
+    def to_dict(self):
+        return {
+            'intercept_secs': self.intercept_secs,
+            'secs_per_variant': self.secs_per_variant,
+            'samples': self.samples,
+            'fitted_time': int(time.time())
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['intercept_secs'], data['secs_per_variant'], data.get('samples', 0))
+
+    """Least squares fit on (variants, seconds) pairs
+    The slope is kept non-negative, so the fit cannot order large inputs
+    before small ones.
+    """
+    @classmethod
+    def fit(cls, points):
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / float(n)
+        mean_y = sum(y for _, y in points) / float(n)
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        if var_x == 0:
+            return cls(mean_y, 0.0, n)
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+        slope = max(slope, 0.0)
+        return cls(max(mean_y - slope * mean_x, 0.0), slope, n)
+
+
+"""The fitted model stored at bucket/key, or the default model if none
+has been fitted yet; cached for MODEL_TTL seconds
+"""
+def load_model(s3, bucket, key):
+    loaded = _models.get((bucket, key))
+    if loaded and time.time() - loaded[0] < MODEL_TTL:
+        return loaded[1]
+    try:
+        data = json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+        model = RuntimeModel.from_dict(data)
+    except ClientError:
+        model = RuntimeModel()
+    _models[(bucket, key)] = (time.time(), model)
+    return model
+
+
+def save_model(s3, bucket, key, model):
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(model.to_dict()).encode('utf-8'))
+    _models.pop((bucket, key), None)
+
+
+"""Lane for a job estimated to take estimated_secs
+"""
+def lane(estimated_secs, small_max_secs, medium_max_secs):
+    if estimated_secs <= small_max_secs:
+        return 'small'
+    if estimated_secs <= medium_max_secs:
+        return 'medium'
+    return 'large'
+
+### EOF
@@ -16,6 +16,8 @@ import json
 # Import utility helpers
 sys.path.insert(1, os.path.realpath(os.path.pardir))
 import helpers
+import client_pool
+import job_state
 
 # Get configuration
 from configparser import ConfigParser
@@ -23,11 +25,13 @@ config = ConfigParser(os.environ)
 config.read('thaw_config.ini')
 
 def thaw():
-    glacier = boto3.resource("glacier", region_name=config['aws']['AwsRegionName'])
-    s3_client = boto3.client('s3', region_name=config['aws']['AwsRegionName'])
-    dynamo = boto3.resource('dynamodb', region_name=config['aws']['AwsRegionName'])
+    glacier = client_pool.resource("glacier", config['aws']['AwsRegionName'])
+    s3_client = client_pool.client('s3', config['aws']['AwsRegionName'])
+    dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
     table = dynamo.Table(config['aws']['AwsDynamoTable'])
-    sqs = boto3.client('sqs', region_name=config['aws']['AwsRegionName'])
+    job_state.publish_events(client_pool.client('sns', config['aws']['AwsRegionName']),
+        config['aws']['AwsSNSJobStatusArn'])
+    sqs = client_pool.client('sqs', config['aws']['AwsRegionName'])
     queue_url = config['aws']['AwsSQSRestoreUrl']
     # Enable long polling on an existing SQS queue
     sqs.set_queue_attributes(
@@ -54,13 +58,13 @@ def thaw():
         if job.status_code == 'Succeeded':
             response = job.get_output()
             out_bytes = response['body'].read()
-            archive_str = out_bytes.decode('utf-8')
-            # restore to file
+            # restore to file; written as bytes since compressed results
+            # (.annot.vcf.gz) are not text
             file_name = response['archiveDescription'].split('/')[-1]
             job_id = file_name.split('~')[0]
             path = '/'.join(response['archiveDescription'].split('/')[:2])
-            with open(file_name, 'a') as out:
-                out.write(archive_str)
+            with open(file_name, 'wb') as out:
+                out.write(out_bytes)
             
             try:
                 # Upload the results file
@@ -70,17 +74,13 @@ def thaw():
 
             try:
                 # change storage status
-                table.update_item( Key= {'job_id': str(job_id)},
-                                UpdateExpression="SET storage_status = :ss, results_file_archive_id = :a",
-                                ExpressionAttributeValues={
-                                        ':ss': 'RESTORED',
-                                        ':a': ''
-                                        },
-                                ReturnValues="UPDATED_NEW"
-                                )
+                job_state.transition(table, str(job_id), job_state.STORAGE_STATUS, job_state.RESTORED,
+                    {'results_file_archive_id': ''})
+            except job_state.TransitionError as e:
+                print(str(e))
             except botocore.exceptions.ClientError:
                 print('Error in updating table!')
-            
+
             # Clean up (delete) local job files
             try:
                 os.system('rm {}'.format(file_name))
@@ -0,0 +1,96 @@
+# timings.py
+#
+# Reports per-phase latency percentiles of recent annotation jobs,
+# from the job_timings record run.py stores on each job item
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import json
+import time
+import argparse
+from boto3.dynamodb.conditions import Attr
+
+# Import utility helpers
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+import client_pool
+
+# Get configuration
+from configparser import ConfigParser
+config = ConfigParser(os.environ)
+config.read('timings_config.ini')
+
+
+"""Nearest-rank percentile of a sorted list
+"""
+def percentile(values, pct):
+    rank = max(int(-(-pct * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+"""Timing records of the jobs completed since the given time
+"""
+def recent_timings(since):
+    dynamo = client_pool.resource('dynamodb', config['aws']['AwsRegionName'])
+    table = dynamo.Table(config['aws']['AwsDynamoTable'])
+    scan = {
+        'FilterExpression': Attr('complete_time').gte(since) & Attr('job_timings').exists(),
+        'ProjectionExpression': 'job_timings, job_class'
+    }
+    records = []
+    while True:
+        response = table.scan(**scan)
+        records.extend(dict(item['job_timings'], job_class=item.get('job_class'))
+            for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return records
+        scan['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def report(hours, as_json=False):
+    records = recent_timings(int(time.time() - hours * 3600))
+
+    durations = {}
+    for record in records:
+        for phase, ms in record['phases_ms'].items():
+            durations.setdefault(phase, []).append(int(ms))
+        # Queue waits also per job class (premium, free)
+        if record['job_class'] and 'queue_wait' in record['phases_ms']:
+            durations.setdefault('queue_wait.' + record['job_class'], []).append(
+                int(record['phases_ms']['queue_wait']))
+        durations.setdefault('total', []).append(int(record['total_ms']))
+
+    summary = {}
+    for phase, values in durations.items():
+        values.sort()
+        summary[phase] = {
+            'jobs': len(values),
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+            'max_ms': values[-1]
+        }
+
+    if as_json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+        return
+
+    print("{} jobs completed in the last {} hours".format(len(records), hours))
+    print("{:<18}{:>8}{:>10}{:>10}{:>10}{:>10}".format('phase', 'jobs', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+    for phase, row in sorted(summary.items(), key=lambda item: -item[1]['p50_ms']):
+        print("{:<18}{:>8}{:>10}{:>10}{:>10}{:>10}".format(phase, row['jobs'],
+            row['p50_ms'], row['p95_ms'], row['p99_ms'], row['max_ms']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-phase job latency percentiles')
+    parser.add_argument('--hours', type=float, default=config.getfloat('timings', 'WindowHours'))
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+    report(args.hours, args.json)
+
+### EOF
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# boot_bench.py
+#
+# Startup time of the GAS web app
+#
+# Boots gas:app in fresh interpreters, one after another, as a gunicorn
+# worker would without --preload, and reports how long importing gas
+# takes (configuration and secrets, views, templates' modules) and how
+# long until it has served its first request. Runs with the environment
+# the app would run with; with GAS_BACKEND=local no AWS account is
+# needed. --cold removes the secrets cache before each boot, to measure
+# a boot that has to go to Secrets Manager.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+WEB_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(WEB_DIR, '..', 'util'))
+
+
+"""Boot the app in this process and print its timings as JSON
+"""
+def boot():
+  start = time.time()
+  from gas import app
+  imported = time.time()
+  app.test_client().get('/')
+  served = time.time()
+  import client_pool
+  print(json.dumps({
+    'import_secs': imported - start,
+    'first_request_secs': served - imported,
+    'boot_secs': served - start,
+    'aws_calls': dict((name, entry['calls']) for name, entry in client_pool.stats().items())
+  }))
+
+
+"""Slowest modules to import, from the output of python -X importtime
+"""
+def slowest_imports(importtime_output, count):
+  imports = []
+  for line in importtime_output.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, name = line[len('import time:'):].split('|')
+    imports.append((int(cumulative) / 1e6, name.strip()))
+  return sorted(imports, reverse=True)[:count]
+
+
+def _percentile(values, p):
+  values = sorted(values)
+  return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+def main():
+  parser = argparse.ArgumentParser(description='GAS web app startup time')
+  parser.add_argument('--runs', type=int, default=5,
+    help='number of boots to time')
+  parser.add_argument('--cold', action='store_true',
+    help='remove the secrets cache before each boot')
+  parser.add_argument('--imports', type=int, default=10,
+    help='number of slowest imports of the last boot to list')
+  parser.add_argument('--output', default='boot_bench_results.json')
+  parser.add_argument('--boot', action='store_true', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+  if args.boot:
+    boot()
+    return
+
+  import secret_cache
+  runs = []
+  for run in range(args.runs):
+    if args.cold and os.path.exists(secret_cache.SECRETS_CACHE_FILE):
+      os.remove(secret_cache.SECRETS_CACHE_FILE)
+    process = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--boot'],
+      cwd=WEB_DIR, capture_output=True, text=True)
+    if process.returncode != 0:
+      print(process.stderr)
+      sys.exit(1)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    runs.append(result)
+    print('boot {}: import={:.3f}s first_request={:.3f}s aws_calls={}'.format(run + 1,
+      result['import_secs'], result['first_request_secs'], sum(result['aws_calls'].values())))
+
+  results = {'settings': {'runs': args.runs, 'cold': args.cold}, 'runs': runs}
+  for name in ('import_secs', 'first_request_secs', 'boot_secs'):
+    values = [result[name] for result in runs]
+    results[name] = {'p50': _percentile(values, 50), 'p95': _percentile(values, 95),
+      'max': max(values)}
+    print('{}: p50={:.3f} p95={:.3f} max={:.3f}'.format(name,
+      results[name]['p50'], results[name]['p95'], results[name]['max']))
+  results['slowest_imports'] = slowest_imports(process.stderr, args.imports)
+  print('slowest imports (cumulative secs):')
+  for secs, name in results['slowest_imports']:
+    print('  {:.3f} {}'.format(secs, name))
+
+  output = os.path.abspath(args.output)
+  with open(output, 'w') as results_file:
+    json.dump(results, results_file, indent=2, sort_keys=True)
+  print('Results written to {}'.format(output))
+
+
+if __name__ == '__main__':
+  main()
+
+### EOF
@@ -0,0 +1,313 @@
+# cache.py
+#
+# Short-lived cache of job items, presigned download URLs and profiles
+#
+# Entries are keyed by user and job, so a user only ever sees their own
+# jobs from the cache. Jobs still changing (PENDING, RUNNING, or being
+# restored) are cached for a few seconds; jobs that have settled for
+# longer, though never past the time a free user's results are due to
+# be archived. Each user's entries carry a generation number, and
+# bumping it drops them all at once, e.g. when a subscription starts a
+# restore. The cache is per process, or, with JOB_CACHE_REDIS_URL set,
+# shared by all the app's workers through Redis.
+#
+# Each user also has a count of the changes to their jobs, which the job
+# status API waits on (see status.py and annotations_status in views.py).
+#
+# User profiles, which hold the role every premium page checks, are
+# cached too, and dropped whenever the accounts database session commits
+# a write of one (e.g. update_profile on subscribe and unsubscribe).
+# Only the worker that commits sees that, so profiles are cached across
+# requests only in the shared store; with a cache of its own, a worker
+# reads them once per request.
+#
+##
+
+import time
+import uuid
+import pickle
+import threading
+from collections import OrderedDict
+
+from flask import g, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from gas import app, db
+from models import Profile
+from helpers import batch_get_items
+
+import job_state
+
+
+class LocalStore(object):
+  """Per-process store of at most max_entries entries; expired entries are
+  dropped when read, or when the store is full, and then the least
+  recently used ones. Counters are kept apart and never dropped.
+  """
+  def __init__(self, max_entries):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.counters = {}
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      if entry[0] <= time.time():
+        del self.entries[key]
+        return None
+      self.entries.move_to_end(key)
+      return entry[1]
+
+  def set(self, key, value, ttl):
+    with self.lock:
+      self.entries.pop(key, None)
+      if len(self.entries) >= self.max_entries:
+        now = time.time()
+        for expired in [k for k, entry in self.entries.items() if entry[0] <= now]:
+          del self.entries[expired]
+        while len(self.entries) >= self.max_entries:
+          self.entries.popitem(last=False)
+      self.entries[key] = (time.time() + ttl, value)
+
+  def delete(self, key):
+    with self.lock:
+      self.entries.pop(key, None)
+
+  def counter(self, key):
+    with self.lock:
+      return self.counters.get(key, 0)
+
+  def incr(self, key):
+    with self.lock:
+      self.counters[key] = self.counters.get(key, 0) + 1
+      return self.counters[key]
+
+
+class RedisStore(object):
+  """Store shared by every worker of the app
+  """
+  def __init__(self, url):
+    # Only needed when a shared cache is configured
+    import redis
+    self.redis = redis.Redis.from_url(url)
+
+  def get(self, key):
+    value = self.redis.get(key)
+    return pickle.loads(value) if value is not None else None
+
+  def set(self, key, value, ttl):
+    self.redis.set(key, pickle.dumps(value), px=max(int(ttl * 1000), 1))
+
+  def delete(self, key):
+    self.redis.delete(key)
+
+  def counter(self, key):
+    return int(self.redis.get(key) or 0)
+
+  def incr(self, key):
+    return self.redis.incr(key)
+
+
+_store = []
+
+
+def store():
+  if not _store:
+    if app.config['JOB_CACHE_REDIS_URL']:
+      _store.append(RedisStore(app.config['JOB_CACHE_REDIS_URL']))
+    else:
+      _store.append(LocalStore(app.config['JOB_CACHE_MAX_ENTRIES']))
+  return _store[0]
+
+
+def _generation(user_id):
+  return store().counter('gen:{}'.format(user_id))
+
+
+def _job_key(job_id, user_id):
+  return 'job:{}:{}:{}'.format(user_id, _generation(user_id), job_id)
+
+
+"""Seconds a job item may be cached for
+"""
+def _item_ttl(item):
+  storage_status = item.get(job_state.STORAGE_STATUS)
+  if item['job_status'] != job_state.COMPLETED or storage_status == job_state.RETRIEVING:
+    return app.config['JOB_CACHE_ACTIVE_TTL']
+  ttl = app.config['JOB_CACHE_SETTLED_TTL']
+  if storage_status is None and item.get('job_class', 'free') == 'free':
+    # Archival is the next change; do not serve the item past it
+    archive_due = int(item['complete_time']) + app.config['FREE_USER_DATA_RETENTION']
+    ttl = min(ttl, max(archive_due - time.time(), app.config['JOB_CACHE_ACTIVE_TTL']))
+  return ttl
+
+
+"""The job item of job_id if it belongs to user_id, else None
+"""
+def get_job(table, job_id, user_id):
+  key = _job_key(job_id, user_id)
+  item = store().get(key)
+  if item is None:
+    item = table.get_item(Key={'job_id': job_id}).get('Item')
+    if item is None or item['user_id'] != user_id:
+      return None
+    store().set(key, item, _item_ttl(item))
+  return item
+
+
+"""Job items of those of job_ids that belong to user_id, by job id
+Cached items are used as they are; the rest are read in batches, and
+cached.
+"""
+def get_jobs(dynamo, table_name, job_ids, user_id):
+  jobs = {}
+  missing = []
+  for job_id in job_ids:
+    item = store().get(_job_key(job_id, user_id))
+    if item is None:
+      missing.append(job_id)
+    else:
+      jobs[job_id] = item
+  for item in batch_get_items(dynamo, table_name, 'job_id', missing):
+    if item['user_id'] == user_id:
+      store().set(_job_key(item['job_id'], user_id), item, _item_ttl(item))
+      jobs[item['job_id']] = item
+  return jobs
+
+
+"""Presigned GET URL for an object of one of user_id's jobs
+Cached for a quarter of the URL's lifetime at most, so a URL handed out
+from the cache always has most of its lifetime left.
+"""
+def presigned_url(s3, job_id, user_id, bucket, key_name):
+  key = 'url:{}:{}:{}:{}'.format(user_id, _generation(user_id), job_id, key_name)
+  url = store().get(key)
+  if url is None:
+    expiration = app.config['AWS_SIGNED_REQUEST_EXPIRATION']
+    url = s3.generate_presigned_url(
+      'get_object',
+      Params={'Bucket': bucket, 'Key': key_name},
+      ExpiresIn=expiration)
+    store().set(key, url, min(expiration / 4.0, app.config['JOB_CACHE_SETTLED_TTL']))
+  return url
+
+
+# Notified whenever this process counts a change to someone's jobs
+_changed = threading.Condition()
+
+
+def _count_change(user_id):
+  store().incr('changes:{}'.format(user_id))
+  with _changed:
+    _changed.notify_all()
+
+
+"""Drop the cached item of a job whose state has changed
+"""
+def invalidate_job(job_id, user_id):
+  store().delete(_job_key(job_id, user_id))
+  _count_change(user_id)
+
+
+"""Drop every cached entry of user_id, e.g. once their jobs' storage is
+about to change
+"""
+def invalidate_user(user_id):
+  store().incr('gen:{}'.format(user_id))
+  _count_change(user_id)
+
+
+"""Count of the changes to user_id's jobs so far
+"""
+def changes(user_id):
+  return store().counter('changes:{}'.format(user_id))
+
+
+"""Wait until the count of changes to user_id's jobs is past seen, for at
+most timeout seconds; returns whether it is
+Changes counted by this process end the wait at once. Those counted by
+another worker through the shared store are seen within
+STATUS_CHECK_SECS.
+"""
+def wait_for_change(user_id, seen, timeout):
+  deadline = time.time() + timeout
+  with _changed:
+    while changes(user_id) == seen:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        return False
+      _changed.wait(min(remaining, app.config['STATUS_CHECK_SECS']))
+  return True
+
+
+def _read_profile(identity_id):
+  columns = Profile.__table__.c
+  query = select(columns.name, columns.email, columns.institution, columns.role) \
+    .where(columns.identity_id == uuid.UUID(identity_id))
+  if 'replica' in app.config['SQLALCHEMY_BINDS'] and \
+    not store().get('profile-changed:{}'.format(identity_id)):
+    with db.engines['replica'].connect() as connection:
+      row = connection.execute(query).first()
+  else:
+    row = db.session.execute(query).first()
+  return dict(row._mapping) if row else None
+
+
+"""Profile of identity_id (name, email, institution and role), or None
+if there is no such profile
+Kept for the rest of the request once read, and, in the shared store,
+for PROFILE_CACHE_TTL. Read from the replica, when there is one, unless
+the profile has just changed and the replica may not have caught up yet.
+"""
+def get_profile(identity_id):
+  if identity_id is None:
+    return None
+  identity_id = str(identity_id)
+  profiles = g.setdefault('profiles', {})
+  if identity_id not in profiles:
+    shared = bool(app.config['JOB_CACHE_REDIS_URL'])
+    key = 'profile:{}'.format(identity_id)
+    profile = store().get(key) if shared else None
+    if profile is None:
+      profile = _read_profile(identity_id)
+      if profile is not None and shared:
+        store().set(key, profile, app.config['PROFILE_CACHE_TTL'])
+    profiles[identity_id] = profile
+  return profiles[identity_id]
+
+
+"""Drop the cached profile of identity_id
+"""
+def invalidate_profile(identity_id):
+  identity_id = str(identity_id)
+  store().delete('profile:{}'.format(identity_id))
+  store().set('profile-changed:{}'.format(identity_id), True, app.config['PROFILE_REPLICA_LAG'])
+  if has_app_context():
+    g.get('profiles', {}).pop(identity_id, None)
+
+
+# Any write of a profile, wherever it is made, drops it from the cache
+# once committed; dropped any earlier, a request reading the profile
+# before the commit would cache it again as it was
+@event.listens_for(Profile, 'after_insert')
+@event.listens_for(Profile, 'after_update')
+def _profile_written(mapper, connection, target):
+  session = Session.object_session(target)
+  session.info.setdefault('profiles_written', set()).add(str(target.identity_id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _profiles_committed(session):
+  for identity_id in session.info.pop('profiles_written', ()):
+    invalidate_profile(identity_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _profiles_rolled_back(session):
+  session.info.pop('profiles_written', None)
+
+### EOF
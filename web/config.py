@@ -9,13 +9,15 @@
 __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
 import os
-import json
-import boto3
-import base64
-from botocore.exceptions import ClientError
+import sys
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# client_pool, which secret_cache.py gets its Secrets Manager client from,
+# lives with the utilities
+sys.path.append(os.path.join(basedir, '..', 'util'))
+import secret_cache
+
 class Config(object):
   GAS_LOG_LEVEL = os.environ['GAS_LOG_LEVEL'] \
     if ('GAS_LOG_LEVEL' in os.environ) else 'INFO'
@@ -37,25 +39,15 @@ class Config(object):
   AWS_REGION_NAME = os.environ['AWS_REGION_NAME'] \
     if ('AWS_REGION_NAME' in  os.environ) else "us-east-1"
 
-  # Get various credentials from AWS Secrets Manager
-  asm = boto3.client('secretsmanager', region_name=AWS_REGION_NAME)
+  # Get various credentials from AWS Secrets Manager, or their cache
+  secrets = secret_cache.load_secrets(AWS_REGION_NAME)
 
   # Get Flask application secret
-  try:
-    asm_response = asm.get_secret_value(SecretId='gas/web_server')
-    flask_secret = json.loads(asm_response['SecretString'])
-  except ClientError as e:
-    print(f"Unable to retrieve Flask secret from ASM: {e}")
-    raise e
+  flask_secret = secrets['gas/web_server']
   SECRET_KEY = flask_secret['flask_secret_key']
 
   # Get RDS secret and construct database URI
-  try:
-    asm_response = asm.get_secret_value(SecretId='rds/accounts_database')
-    rds_secret = json.loads(asm_response['SecretString'])
-  except ClientError as e:
-    print(f"Unable to retrieve accounts database credentials from ASM: {e}")
-    raise e
+  rds_secret = secrets['rds/accounts_database']
 
   SQLALCHEMY_DATABASE_TABLE = os.environ['ACCOUNTS_DATABASE_TABLE']
   SQLALCHEMY_DATABASE_URI = "postgresql://" + \
@@ -64,13 +56,29 @@ class Config(object):
     '/' + SQLALCHEMY_DATABASE_TABLE
   SQLALCHEMY_TRACK_MODIFICATIONS = True
 
+  # Accounts database connection pool of each worker; connections are
+  # checked before use and replaced before the server or a load balancer
+  # drops them as idle
+  SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': int(os.environ['ACCOUNTS_DATABASE_POOL_SIZE']) \
+      if ('ACCOUNTS_DATABASE_POOL_SIZE' in os.environ) else 5,
+    'max_overflow': int(os.environ['ACCOUNTS_DATABASE_MAX_OVERFLOW']) \
+      if ('ACCOUNTS_DATABASE_MAX_OVERFLOW' in os.environ) else 5,
+    'pool_timeout': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': int(os.environ['ACCOUNTS_DATABASE_POOL_RECYCLE']) \
+      if ('ACCOUNTS_DATABASE_POOL_RECYCLE' in os.environ) else 1800
+  }
+  # Read replica for profile lookups (see cache.py), if there is one
+  SQLALCHEMY_BINDS = {}
+  if 'ACCOUNTS_DATABASE_REPLICA_HOST' in os.environ:
+    SQLALCHEMY_BINDS['replica'] = "postgresql://" + \
+      rds_secret['username'] + ':' + rds_secret['password'] + \
+      '@' + os.environ['ACCOUNTS_DATABASE_REPLICA_HOST'] + ':' + str(rds_secret['port']) + \
+      '/' + SQLALCHEMY_DATABASE_TABLE
+
   # Get the Globus Auth client ID and secret
-  try:
-    asm_response = asm.get_secret_value(SecretId='globus/auth_client')
-    globus_auth = json.loads(asm_response['SecretString'])
-  except ClientError as e:
-    print(f"Unable to retrieve Globus Auth credentials from ASM: {e}")
-    raise e
+  globus_auth = secrets['globus/auth_client']
 
   # Set the Globus Auth client ID and secret
   GAS_CLIENT_ID = globus_auth['gas_client_id']
@@ -93,11 +101,41 @@ class Config(object):
   # Change the ARNs below to reflect your SNS topics
   AWS_SNS_JOB_REQUEST_TOPIC = \
     "arn:aws:sns:us-east-1:659248683008:hklu21_job_requests"
+  # Job requests by job class; each class has its own queue, which the
+  # annotator polls with a weight (see [class.*] in ann_config.ini)
+  AWS_SNS_JOB_REQUEST_TOPICS = {
+    "premium": "arn:aws:sns:us-east-1:659248683008:hklu21_job_requests_premium",
+    "free": AWS_SNS_JOB_REQUEST_TOPIC
+  }
   AWS_SNS_JOB_COMPLETE_TOPIC = \
     "some-arn-job-results:hklu21_job_results"
+  # Topic ann and util announce job state changes on, and the queue
+  # subscribed to it that the app's processes share; see status.py
+  AWS_SNS_JOB_STATUS_TOPIC = \
+    "arn:aws:sns:us-east-1:659248683008:hklu21_job_status"
+  AWS_SQS_JOB_STATUS_URL = \
+    "https://sqs.us-east-1.amazonaws.com/659248683008/hklu21_job_status"
+
+  # Jobs are queued in the small, medium or large lane by their estimated
+  # annotation time in seconds; the estimator's model is fitted by
+  # util/estimator and stored in the results bucket
+  AWS_S3_ESTIMATOR_MODEL_KEY = "hklu21/estimator/runtime_model.json"
+  JOB_LANE_SMALL_MAX_SECS = 60
+  JOB_LANE_MEDIUM_MAX_SECS = 900
 
   # Change the table name to your own
   AWS_DYNAMODB_ANNOTATIONS_TABLE = "hklu21_annotations"
+  # user_id + submit_time index of the annotations table; see
+  # util/job_index
+  AWS_DYNAMODB_USER_INDEX = "user_id_submit_time_index"
+  AWS_DYNAMODB_USER_COMPLETE_INDEX = "user_id_complete_time_index"
+
+  # Jobs per page of the annotations list, and most index reads made to
+  # fill a page when a status filter leaves out most jobs
+  ANNOTATIONS_PAGE_SIZE = 25
+  ANNOTATIONS_PAGE_MAX_READS = 5
+  # Most jobs in one response of the job status API
+  STATUS_API_MAX_JOBS = 500
 
   # Change the email address to your username
   MAIL_DEFAULT_SENDER = "hklu21@mpcs-cc.com"
@@ -105,6 +143,29 @@ class Config(object):
   # Time before free user results are archived (in seconds)
   FREE_USER_DATA_RETENTION = 300
 
+  # Cache of job items and presigned download URLs (see cache.py); in
+  # seconds, for jobs still changing and for settled ones
+  JOB_CACHE_ACTIVE_TTL = 5
+  JOB_CACHE_SETTLED_TTL = 300
+  JOB_CACHE_MAX_ENTRIES = 10000
+  # Set to share the cache between the app's workers
+  JOB_CACHE_REDIS_URL = os.environ.get('JOB_CACHE_REDIS_URL')
+  # Seconds user profiles (and so roles) are cached for in the shared
+  # cache, and for which a changed profile is read from the primary
+  # rather than the replica
+  PROFILE_CACHE_TTL = 60
+  PROFILE_REPLICA_LAG = 10
+
+  # Log viewer: bytes shown per page
+  LOG_PAGE_BYTES = 64 * 1024
+
+  # Job status on pages (see status.py): most seconds a request of the
+  # job status API waits for the user's jobs to change, kept under the
+  # gunicorn worker timeout, and seconds between looks at the change
+  # counts other workers share through Redis
+  STATUS_WAIT_SECS = 20
+  STATUS_CHECK_SECS = 1
+
 class DevelopmentConfig(Config):
   DEBUG = True
   GAS_LOG_LEVEL = 'DEBUG'
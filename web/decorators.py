@@ -11,8 +11,7 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 from flask import redirect, request, session, url_for
 from functools import wraps
 
-from gas import db
-from models import Profile
+import cache
 
 """Mark a route as requiring authentication
 """
@@ -38,12 +37,12 @@ Subscriber must have profile.role = premium_user
 def is_premium(fn):
   @wraps(fn)
   def decorated_function(*args, **kwargs):
-    # Check if user is a subscriber
-    profile = db.session.query(Profile).filter_by(identity_id=session.get('primary_identity')).first()
+    # Check if user is a subscriber; the role is cached (see cache.py)
+    profile = cache.get_profile(session.get('primary_identity'))
     if not profile:
       # Force login
       return redirect(url_for('login', next=request.url))
-    elif (profile.role != "premium_user"):
+    elif (profile['role'] != "premium_user"):
       # Redirect free user to subscribe
       return redirect(url_for('subscribe', next=request.url))
 
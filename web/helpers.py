@@ -10,9 +10,14 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
 import re
 import json
+import time
+import codecs
+import base64
+from decimal import Decimal
 
 from flask import request, render_template
 from threading import Lock
+from botocore.exceptions import ClientError
 
 import globus_sdk
 
@@ -23,6 +28,79 @@ except:
 
 from gas import app, db
 
+"""Opaque page cursor for a DynamoDB LastEvaluatedKey
+"""
+def encode_cursor(last_evaluated_key):
+  key = dict((name, int(value) if isinstance(value, Decimal) else value)
+    for name, value in last_evaluated_key.items())
+  return base64.urlsafe_b64encode(json.dumps(key, sort_keys=True).encode('utf-8')).decode('ascii')
+
+"""ExclusiveStartKey from a page cursor; raises ValueError if the
+cursor is not one encode_cursor made
+"""
+def decode_cursor(cursor):
+  try:
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+  except (TypeError, UnicodeError, base64.binascii.Error) as e:
+    raise ValueError(str(e))
+  if not isinstance(key, dict):
+    raise ValueError('Not a page cursor')
+  return key
+
+"""Items of table_name with the given hash key values, holding only the
+named attributes, or all of them if attributes is None
+Read with BatchGetItem, 100 keys (its limit) at a time; keys DynamoDB
+leaves unprocessed are asked for again, backing off. Items are returned
+in no particular order, and keys with no item are left out.
+"""
+def batch_get_items(dynamo, table_name, key_name, values, attributes=None):
+  items = []
+  for start in range(0, len(values), 100):
+    request_items = {table_name: {
+      'Keys': [{key_name: value} for value in values[start:start + 100]]
+    }}
+    if attributes is not None:
+      names = dict(('#a{}'.format(i), name) for i, name in enumerate(attributes))
+      request_items[table_name]['ProjectionExpression'] = ', '.join(names)
+      request_items[table_name]['ExpressionAttributeNames'] = names
+    attempt = 0
+    while request_items:
+      response = dynamo.batch_get_item(RequestItems=request_items)
+      items.extend(response['Responses'].get(table_name, []))
+      request_items = response.get('UnprocessedKeys')
+      if request_items:
+        time.sleep(min(0.05 * 2 ** attempt, 1))
+        attempt += 1
+  return items
+
+"""Size in bytes of an S3 object, or None if there is no such object
+"""
+def object_size(s3, bucket, key):
+  try:
+    return s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+  except ClientError as e:
+    if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+      return None
+    raise
+
+"""Text of bytes start to end (exclusive) of an S3 object
+Fetched with one ranged GET and decoded chunk_size bytes at a time as it
+is consumed, so only one chunk is held in memory. Characters cut by the
+range are replaced.
+"""
+def iter_object_text(s3, bucket, key, start, end, chunk_size=64 * 1024):
+  if end <= start:
+    return
+  response = s3.get_object(Bucket=bucket, Key=key,
+    Range='bytes={}-{}'.format(start, end - 1))
+  decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+  try:
+    for chunk in response['Body'].iter_chunks(chunk_size):
+      yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+  finally:
+    response['Body'].close()
+
 """Create an AuthClient for the GAS app
 """
 def load_portal_client():
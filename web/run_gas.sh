@@ -15,10 +15,17 @@ if [ "$1" = "console" ]; then
 else
     LOG_TARGET=/home/ec2-user/mpcs-cc/gas/web/log/$GAS_LOG_FILE_NAME
 fi
+# --preload imports the app (and reads its secrets) once, before the
+# workers are forked. Threaded workers, so that requests of the job
+# status API waiting on job changes (see status.py) each hold a thread
+# rather than a whole worker
 /home/ec2-user/mpcs-cc/bin/gunicorn \
   --log-file=$LOG_TARGET \
   --log-level=debug \
   --workers=$GUNICORN_WORKERS \
+  --worker-class=gthread \
+  --threads=$GUNICORN_THREADS \
+  --preload \
   --certfile="/home/ec2-user/mpcs-cc/fullchain.pem" \
   --keyfile="/home/ec2-user/mpcs-cc/privkey.pem" \
   --bind=$GAS_APP_HOST:$GAS_HOST_PORT gas:app
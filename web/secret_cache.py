@@ -0,0 +1,118 @@
+# secret_cache.py
+#
+# Secrets the web app is configured from, and their local cache
+#
+# config.py needs every secret when the app is created, and gas.py reads
+# all of the configuration at once, so the secrets cannot be put off
+# past boot. Instead they are fetched in parallel, and kept in a file
+# encrypted with GAS_SECRETS_CACHE_KEY (a Fernet key; the cryptography
+# package is only needed when it is set), so that workers booting after
+# the first read the file rather than wait on Secrets Manager.
+#
+##
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+import client_pool
+
+# Secrets Manager secrets the app is configured from
+SECRET_IDS = ('gas/web_server', 'rds/accounts_database', 'globus/auth_client')
+
+# The cache, used only when GAS_SECRETS_CACHE_KEY is set
+SECRETS_CACHE_FILE = os.environ['GAS_SECRETS_CACHE_FILE'] \
+  if ('GAS_SECRETS_CACHE_FILE' in os.environ) \
+  else os.path.join(os.path.dirname(os.path.abspath(__file__)), '.secrets_cache')
+SECRETS_CACHE_KEY = os.environ.get('GAS_SECRETS_CACHE_KEY')
+# Seconds before cached secrets are refreshed, and after which they are
+# no longer used at all
+SECRETS_CACHE_TTL = int(os.environ['GAS_SECRETS_CACHE_TTL']) \
+  if ('GAS_SECRETS_CACHE_TTL' in os.environ) else 3600
+SECRETS_CACHE_MAX_STALE = int(os.environ['GAS_SECRETS_CACHE_MAX_STALE']) \
+  if ('GAS_SECRETS_CACHE_MAX_STALE' in os.environ) else 86400
+
+
+"""Get every secret from Secrets Manager, in parallel
+"""
+def fetch_secrets(region_name):
+  asm = client_pool.client('secretsmanager', region_name)
+  def fetch(secret_id):
+    try:
+      asm_response = asm.get_secret_value(SecretId=secret_id)
+    except ClientError as e:
+      print(f"Unable to retrieve {secret_id} secret from ASM: {e}")
+      raise e
+    return json.loads(asm_response['SecretString'])
+  with ThreadPoolExecutor(max_workers=len(SECRET_IDS)) as executor:
+    return dict(zip(SECRET_IDS, executor.map(fetch, SECRET_IDS)))
+
+
+def _fernet():
+  # Only needed when the cache is enabled
+  from cryptography.fernet import Fernet
+  return Fernet(SECRETS_CACHE_KEY.encode('ascii'))
+
+
+"""Cached secrets and their age in seconds, or None if there are none
+usable
+"""
+def read_secrets_cache():
+  if not SECRETS_CACHE_KEY or not os.path.isfile(SECRETS_CACHE_FILE):
+    return None
+  try:
+    with open(SECRETS_CACHE_FILE, 'rb') as cache_file:
+      cached = json.loads(_fernet().decrypt(cache_file.read()).decode('utf-8'))
+  except Exception as e:
+    print(f"Unable to read secrets cache {SECRETS_CACHE_FILE}: {e}")
+    return None
+  age = time.time() - cached['fetched_at']
+  if age > SECRETS_CACHE_MAX_STALE or set(cached['secrets']) != set(SECRET_IDS):
+    return None
+  return cached['secrets'], age
+
+
+def write_secrets_cache(secrets):
+  if not SECRETS_CACHE_KEY:
+    return
+  data = _fernet().encrypt(json.dumps({'fetched_at': time.time(), 'secrets': secrets}).encode('utf-8'))
+  # Write then rename, readable by this user only
+  tmp_path = f"{SECRETS_CACHE_FILE}.{os.getpid()}.tmp"
+  with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as cache_file:
+    cache_file.write(data)
+  os.replace(tmp_path, SECRETS_CACHE_FILE)
+
+
+def _refresh_secrets(region_name):
+  try:
+    write_secrets_cache(fetch_secrets(region_name))
+  except Exception as e:
+    print(f"Unable to refresh secrets cache {SECRETS_CACHE_FILE}: {e}")
+
+
+"""The app's secrets, by id
+Served from the cache when there is one, so that with gunicorn --preload
+Secrets Manager is called once per server, and without it once per
+SECRETS_CACHE_TTL rather than once per worker. Cached secrets past
+their TTL are still used, while a background thread refreshes them for
+the next boot; with no usable cache they are fetched, then cached.
+"""
+def load_secrets(region_name):
+  cached = read_secrets_cache()
+  if cached is None:
+    secrets = fetch_secrets(region_name)
+    try:
+      write_secrets_cache(secrets)
+    except Exception as e:
+      print(f"Unable to write secrets cache {SECRETS_CACHE_FILE}: {e}")
+    return secrets
+  secrets, age = cached
+  if age > SECRETS_CACHE_TTL:
+    threading.Thread(target=_refresh_secrets, args=(region_name,),
+      name='secrets-refresh', daemon=True).start()
+  return secrets
+
+### EOF
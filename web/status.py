@@ -0,0 +1,82 @@
+# status.py
+#
+# Job status changes, as seen by the web app
+#
+# ann and util announce every job state change on the job status topic
+# (see util/job_state.py). A thread in each app process takes its turn
+# draining the AWS_SQS_JOB_STATUS_URL queue subscribed to the topic, and
+# drops each changed job from the cache (see cache.py), which wakes the
+# /annotations/status requests waiting on that user's jobs. Pages wait
+# there for the jobs they show that are still changing.
+#
+# With JOB_CACHE_REDIS_URL set, the cache and the change counts are
+# shared, so every process sees every change. Otherwise a change is seen
+# at once only by the process that received it; pages served by the
+# others see it when their wait times out, within STATUS_WAIT_SECS.
+#
+##
+
+import time
+import json
+import threading
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from gas import app
+import cache
+
+import client_pool
+
+# Seconds to wait after a failed receive
+ERROR_BACKOFF = 5
+
+_consumer = []
+_consumer_lock = threading.Lock()
+
+
+"""Start this process's consumer of the job status queue, once
+"""
+def start_consumer():
+  if _consumer:
+    return
+  with _consumer_lock:
+    if not _consumer:
+      thread = threading.Thread(target=consume, name='job-status', daemon=True)
+      thread.start()
+      _consumer.append(thread)
+
+
+def consume():
+  sqs = client_pool.client('sqs', app.config['AWS_REGION_NAME'])
+  queue_url = app.config['AWS_SQS_JOB_STATUS_URL']
+  while True:
+    try:
+      response = sqs.receive_message(QueueUrl=queue_url,
+        MaxNumberOfMessages=10, WaitTimeSeconds=20)
+    except (BotoCoreError, ClientError) as e:
+      app.logger.error(f"Unable to receive job status events: {e}")
+      time.sleep(ERROR_BACKOFF)
+      continue
+
+    entries = []
+    for sqs_message in response.get('Messages', []):
+      try:
+        record(json.loads(json.loads(sqs_message['Body'])['Message']))
+      except (KeyError, ValueError):
+        # Malformed; nothing to drop
+        pass
+      entries.append({'Id': str(len(entries)),
+        'ReceiptHandle': sqs_message['ReceiptHandle']})
+    if entries:
+      try:
+        sqs.delete_message_batch(QueueUrl=queue_url, Entries=entries)
+      except (BotoCoreError, ClientError) as e:
+        app.logger.error(f"Unable to delete job status events: {e}")
+
+
+"""Drop the job of a status event from the cache
+"""
+def record(event):
+  cache.invalidate_job(event['job_id'], event['user_id'])
+
+### EOF
@@ -8,24 +8,73 @@
 ##
 __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
+import os
+import sys
 import uuid
 import time
 import json
-from datetime import datetime
+import hashlib
+from datetime import datetime, timezone
 import subprocess
 
 
-import boto3
-from boto3.dynamodb.conditions import Key
-from botocore.client import Config
+import botocore
+from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 
-from flask import (abort, flash, redirect, render_template,
-  request, session, url_for, jsonify)
+from urllib.parse import urlencode
+
+from flask import (abort, redirect, render_template,
+  request, session, url_for, jsonify, Response, stream_template)
 
 from gas import app, db
-from decorators import authenticated, is_premium
-from auth import get_profile, update_profile
+import cache
+import status
+from decorators import authenticated
+from auth import update_profile
+
+# Shared AWS clients live with the utilities; appended so that this
+# directory's helpers.py is not shadowed by util/helpers.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+import client_pool
+import job_state
+import runtime_estimator
+from helpers import (encode_cursor, decode_cursor, object_size,
+  iter_object_text, get_safe_redirect)
+
+# Sort fields of the annotations list, with the config key of the index
+# each is read from
+ANNOTATIONS_SORTS = {
+  'submit_time': 'AWS_DYNAMODB_USER_INDEX',
+  'complete_time': 'AWS_DYNAMODB_USER_COMPLETE_INDEX'
+}
+
+
+"""Role of the signed-in user, from their profile rather than the session,
+which keeps the role the user signed in with
+"""
+def _role():
+  profile = cache.get_profile(session.get('primary_identity'))
+  return profile['role'] if profile else None
+
+
+"""Serve the profile page from the cached profile (see cache.py)
+Runs ahead of auth.profile, which is left to handle updates, users with
+no profile yet, and users not signed in.
+"""
+@app.before_request
+def cached_profile_page():
+  if request.endpoint != 'profile' or request.method != 'GET' or \
+    not session.get('is_authenticated') or not session.get('name') or not session.get('email'):
+    return None
+  profile = cache.get_profile(session.get('primary_identity'))
+  if profile is None:
+    return None
+  session.update(name=profile['name'], email=profile['email'],
+    institution=profile['institution'], role=profile['role'])
+  if request.args.get('next'):
+    session['next'] = get_safe_redirect()
+  return render_template('profile.html', profile=profile)
 
 
 """Start annotation request
@@ -40,9 +89,7 @@ but you can replace the code below with your own if you prefer.
 def annotate():
   # Create a session client to the S3 service
   
-  s3 = boto3.client('s3',
-    region_name=app.config['AWS_REGION_NAME'],
-    config=Config(signature_version='s3v4'))
+  s3 = client_pool.client('s3', app.config['AWS_REGION_NAME'])
 
   bucket_name = app.config['AWS_S3_INPUTS_BUCKET']
   user_id = session['primary_identity']
@@ -114,12 +161,24 @@ def create_annotation_job_request():
       message="No input file uploaded."
     ), 500
 
+  # Size the job from its input, to queue it in the lane for its
+  # estimated runtime
+  try:
+    s3 = client_pool.client('s3', app.config['AWS_REGION_NAME'])
+    input_size, estimated_variants = runtime_estimator.sniff(s3, bucket_name, s3_key)
+    model = runtime_estimator.load_model(s3, app.config['AWS_S3_RESULTS_BUCKET'],
+      app.config['AWS_S3_ESTIMATOR_MODEL_KEY'])
+  except ClientError as e:
+    app.logger.error(f"Unable to read input file {s3_key}: {e}")
+    return abort(500)
+  estimated_secs = model.estimate(estimated_variants)
+  job_lane = runtime_estimator.lane(estimated_secs,
+    app.config['JOB_LANE_SMALL_MAX_SECS'], app.config['JOB_LANE_MEDIUM_MAX_SECS'])
+
   # Persist job to database
   try:
     # Create a job item and persist it to the annotations database
-    dynamo = boto3.resource('dynamodb',
-      region_name=app.config['AWS_REGION_NAME'],
-      config=Config(signature_version='s3v4'))
+    dynamo = client_pool.resource('dynamodb', app.config['AWS_REGION_NAME'])
     table = dynamo.Table(app.config['AWS_DYNAMODB_ANNOTATIONS_TABLE'])
     data = {  "job_id": str(job_id),
               "user_id": str(user_id),
@@ -127,22 +186,35 @@ def create_annotation_job_request():
               "s3_inputs_bucket": str(bucket_name),
               "s3_key_input_file": str(s3_key),
               "submit_time": int(time.time()),
-              "job_status": "PENDING"
+              # Premium jobs are queued ahead of free ones
+              "job_class": "premium" if _role() == 'premium_user' else "free",
+              "input_size": input_size,
+              "estimated_variants": estimated_variants,
+              "estimated_secs": int(round(estimated_secs)),
+              "job_lane": job_lane
             }
 
-    res = table.put_item(Item=data)
-  except botocore.exceptions.ClientError:
-    internal_error(error)
+    data = job_state.create(table, data)
+  except job_state.TransitionError:
+    # The job was submitted already, e.g. the redirect was reloaded
+    return render_template('annotate_confirm.html', job_id=job_id)
+  except botocore.exceptions.ClientError as error:
+    app.logger.error(f"Unable to create job {job_id}: {error}")
+    return internal_error(error)
 
   # Send message to request queue
   try:
     # publish a notification message to the SNS topic
-    sns = boto3.client('sns',
-      region_name=app.config['AWS_REGION_NAME'],
-      config=Config(signature_version='s3v4'))
-    sns.publish(TopicArn=app.config['AWS_SNS_JOB_REQUEST_TOPIC'], Message=json.dumps(data))
-  except botocore.exceptions.ClientError:
-    internal_error(error)
+    sns = client_pool.client('sns', app.config['AWS_REGION_NAME'])
+    # The topic's subscriptions route the request to its lane's queue
+    sns.publish(TopicArn=app.config['AWS_SNS_JOB_REQUEST_TOPICS'][data['job_class']],
+      Message=json.dumps(data),
+      MessageAttributes={
+        'job_lane': {'DataType': 'String', 'StringValue': job_lane}
+      })
+  except botocore.exceptions.ClientError as error:
+    app.logger.error(f"Unable to publish job request {job_id}: {error}")
+    return internal_error(error)
 
   return render_template('annotate_confirm.html', job_id=job_id)
 
@@ -152,50 +224,92 @@ def create_annotation_job_request():
 @app.route('/annotations', methods=['GET'])
 @authenticated
 def annotations_list():
-  if session.get('role') == 'free_user':
-    # archive to glacier vault
-    try:
-      subprocess.Popen(['sh', '-c', 'cd ../util/archive && python3 archive.py'])
-    except subprocess.CalledProcessError:
-        internal_error(error)
-  elif session.get('role') == 'premium_user':
-    #restore()
-    try:
-      subprocess.Popen(['sh', '-c', 'cd ../util/restore && python3 restore.py'])
-    except subprocess.CalledProcessError:
-        internal_error(error)
+  # Filters, sort order and page, from the query string
+  status = request.args.get('status', '')
+  sort = request.args.get('sort', 'submit_time')
+  order = request.args.get('order', 'desc')
+  date_from = request.args.get('from', '')
+  date_to = request.args.get('to', '')
+  if sort not in ANNOTATIONS_SORTS or order not in ('asc', 'desc') or \
+    (status and status not in job_state.TRANSITIONS[job_state.JOB_STATUS]):
+    return abort(400)
+  # Only completed jobs have a completion time, and so are in its index;
+  # jobs in any other status would never be found
+  if sort == 'complete_time' and status and status != job_state.COMPLETED:
+    return abort(400)
+  try:
+    # Dates are whole UTC days; 'to' includes the day itself
+    start_time = int(datetime.strptime(date_from, '%Y-%m-%d')
+      .replace(tzinfo=timezone.utc).timestamp()) if date_from else None
+    end_time = int(datetime.strptime(date_to, '%Y-%m-%d')
+      .replace(tzinfo=timezone.utc).timestamp()) + 86399 if date_to else None
+    start_key = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+  except ValueError:
+    return abort(400)
+
+  # One page of the user's jobs from the index for the sort field: the
+  # date range is part of the key condition and the status a filter, so
+  # only matching jobs leave DynamoDB, with only the fields shown
+  key_condition = Key('user_id').eq(session['primary_identity'])
+  if start_time is not None and end_time is not None:
+    key_condition = key_condition & Key(sort).between(start_time, end_time)
+  elif start_time is not None:
+    key_condition = key_condition & Key(sort).gte(start_time)
+  elif end_time is not None:
+    key_condition = key_condition & Key(sort).lte(end_time)
+  query = {
+    'IndexName': app.config[ANNOTATIONS_SORTS[sort]],
+    'KeyConditionExpression': key_condition,
+    'ProjectionExpression': 'job_id, submit_time, complete_time, input_file_name, job_status',
+    'ScanIndexForward': order == 'asc'
+  }
+  if status:
+    query['FilterExpression'] = Attr('job_status').eq(status)
+  if start_key:
+    query['ExclusiveStartKey'] = start_key
 
-  # Get list of annotations to display
+  page_size = app.config['ANNOTATIONS_PAGE_SIZE']
+  max_reads = app.config['ANNOTATIONS_PAGE_MAX_READS']
   annotations = []
-  s3 = boto3.client("s3", 
-    region_name=app.config['AWS_REGION_NAME'],
-    config=Config(signature_version='s3v4'))
-  all_objects = s3.list_objects(Bucket=app.config['AWS_S3_INPUTS_BUCKET'], Prefix=app.config['AWS_S3_KEY_PREFIX'])
-
-  dynamo = boto3.resource('dynamodb',
-      region_name=app.config['AWS_REGION_NAME'],
-      config=Config(signature_version='s3v4'))
+  next_cursor = None
+  dynamo = client_pool.resource('dynamodb', app.config['AWS_REGION_NAME'])
   table = dynamo.Table(app.config['AWS_DYNAMODB_ANNOTATIONS_TABLE'])
+  try:
+    # The filter is applied after Limit, so a page may take a few reads;
+    # after max_reads, a short page is returned with the cursor instead
+    reads = 0
+    while len(annotations) < page_size and reads < max_reads:
+      reads += 1
+      query['Limit'] = page_size - len(annotations)
+      response = table.query(**query)
+      for item in response['Items']:
+        annotations.append({
+          'job_id': item['job_id'],
+          'submit_time': datetime.fromtimestamp(int(item['submit_time'])),
+          'complete_time': datetime.fromtimestamp(int(item['complete_time']))
+            if 'complete_time' in item else None,
+          'input_file_name': item['input_file_name'],
+          'job_status': item['job_status']
+        })
+      if 'LastEvaluatedKey' not in response:
+        next_cursor = None
+        break
+      next_cursor = encode_cursor(response['LastEvaluatedKey'])
+      query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+  except ClientError as e:
+    if e.response['Error']['Code'] == 'ValidationException' and start_key:
+      # A cursor from another user or another sort order
+      return abort(400)
+    app.logger.error(f"Unable to query annotations: {e}")
+    return render_template('error.html',
+      title='Server error', alert_level='danger',
+      message="No record in databases."
+    ), 500
 
-  for i in all_objects['Contents']:
-    annotation = {}
-    if i['Key'].split('/')[-1].split('~')[-1] != '':
-      job_id = i['Key'].split('/')[-1].split('~')[0]
-      response = table.get_item(Key ={ 'job_id': job_id})['Item']
-      input_file_name = i['Key'].split('/')[-1].split('~')[-1]
-      annotation['job_id'] = job_id
-      annotation['submit_time'] = datetime.fromtimestamp(response['submit_time'])
-      annotation['input_file_name'] = input_file_name
-      try:
-        annotation['job_status'] = response['job_status']
-      except botocore.exceptions.ClientError:
-        return render_template('error.html',
-          title='Server error', alert_level='danger',
-          message="No record in databases."
-        ), 500
-      annotations.append(annotation)
-  
-  return render_template('annotations.html', annotations=annotations)
+  filters = {'status': status, 'sort': sort, 'order': order, 'from': date_from, 'to': date_to}
+  return render_template('annotations.html', annotations=annotations,
+    filters=filters, statuses=sorted(job_state.TRANSITIONS[job_state.JOB_STATUS]),
+    next_cursor=next_cursor, first_page=start_key is None)
 
 
 """Display details of a specific annotation job
@@ -203,65 +317,204 @@ def annotations_list():
 @app.route('/annotations/<id>', methods=['GET'])
 @authenticated
 def annotation_details(id):
-  dynamo = boto3.resource('dynamodb',
-      region_name=app.config['AWS_REGION_NAME'],
-      config=Config(signature_version='s3v4'))
+  dynamo = client_pool.resource('dynamodb', app.config['AWS_REGION_NAME'])
   table = dynamo.Table(app.config['AWS_DYNAMODB_ANNOTATIONS_TABLE'])
-  response = table.get_item(Key ={ 'job_id': id})['Item']
+  user_id = session['primary_identity']
+  response = cache.get_job(table, id, user_id)
+  if response is None:
+    return abort(404)
   annotation = {}
   annotation['job_id'] = id
-  annotation['submit_time'] = datetime.fromtimestamp(response['submit_time'])
+  annotation['submit_time'] = datetime.fromtimestamp(int(response['submit_time']))
   annotation['input_file_name'] = response['input_file_name']
   annotation['job_status'] = response['job_status']
   # if not premium, show the driect to subsribe
   free_access_expired = False
-  if session.get('role') != 'premium_user':
+  if _role() != 'premium_user':
     free_access_expired = True
-  if annotation['job_status'] == 'COMPLETED':
-    annotation['complete_time'] = datetime.fromtimestamp(response['complete_time'])
+  if annotation['job_status'] == job_state.COMPLETED:
+    annotation['complete_time'] = datetime.fromtimestamp(int(response['complete_time']))
     # get pre-signed url to download
-    s3 = boto3.client('s3',
-      region_name=app.config['AWS_REGION_NAME'],
-      config=Config(signature_version='s3v4'))
+    s3 = client_pool.client('s3', app.config['AWS_REGION_NAME'])
     bucket_name = app.config['AWS_S3_RESULTS_BUCKET']
-    user_id = session['primary_identity']
-    key_name = app.config['AWS_S3_KEY_PREFIX'] + user_id + '/' + \
+    # The results key is .annot.vcf or, for compressed results, .annot.vcf.gz
+    key_name = response.get('s3_key_result_file') or \
+      app.config['AWS_S3_KEY_PREFIX'] + user_id + '/' + \
       id + '~' + str(annotation['input_file_name'])[:-3] + 'annot.vcf'
     try:
-      url = s3.generate_presigned_url(
-        'get_object',
-        Params={'Bucket': bucket_name, 'Key': key_name},
-        ExpiresIn=app.config['AWS_SIGNED_REQUEST_EXPIRATION'])
+      url = cache.presigned_url(s3, id, user_id, bucket_name, key_name)
     except ClientError as e:
       app.logger.error(f"Unable to generate presigned URL for download: {e}")
       return abort(500)
     annotation['result_file_url'] = url
-  if 'storage_status' in response and response['storage_status'] == 'RETRIEVING':
+  if response.get(job_state.STORAGE_STATUS) == job_state.RETRIEVING:
     annotation['restore_message'] = "The results file is being restored"
 
   return render_template('annotation_details.html', annotation=annotation, free_access_expired=free_access_expired)
 
 
-"""Display the log file contents for an annotation job
+# Job attributes returned by the job status API
+STATUS_ATTRIBUTES = ('job_id', 'input_file_name', 'submit_time',
+  'complete_time', job_state.JOB_STATUS, job_state.STORAGE_STATUS)
+
+
+"""Statuses of many of the user's jobs in one JSON response
+For programs that submit jobs and wait on them, and for pages to follow
+the jobs they show (see followJobStatus in scripts.html). ?ids=<id>,<id>,... (may
+be repeated) names the jobs; or ?since=<epoch seconds> asks for every
+job submitted since then, oldest first, and a "cursor" to pass back
+along with since for the rest when there are more than fit in one
+response. Jobs that do not exist or are not the user's are listed under
+"missing". Responses carry an ETag, so polling with If-None-Match gets
+a 304 while nothing has changed; with ?wait=<seconds> as well (up to
+STATUS_WAIT_SECS), the 304 is held back until one of the user's jobs
+changes or the time is up. Jobs are read through the cache (see
+cache.py), so only jobs that have changed are read again.
+"""
+@app.route('/annotations/status', methods=['GET'])
+@authenticated
+def annotations_status():
+  dynamo = client_pool.resource('dynamodb', app.config['AWS_REGION_NAME'])
+  table_name = app.config['AWS_DYNAMODB_ANNOTATIONS_TABLE']
+  user_id = session['primary_identity']
+  max_jobs = app.config['STATUS_API_MAX_JOBS']
+
+  requested_ids = []
+  for value in request.args.getlist('ids'):
+    for job_id in value.split(','):
+      if job_id.strip() and job_id.strip() not in requested_ids:
+        requested_ids.append(job_id.strip())
+  if bool(requested_ids) == ('since' in request.args) or len(requested_ids) > max_jobs:
+    return abort(400)
+  try:
+    wait = min(max(float(request.args.get('wait', 0)), 0), app.config['STATUS_WAIT_SECS'])
+  except ValueError:
+    return abort(400)
+  deadline = time.time() + wait
+
+  while True:
+    # Counted before reading, so no change made during the read is missed
+    seen = cache.changes(user_id)
+    body = {}
+    job_ids = list(requested_ids)
+    try:
+      if 'since' in request.args:
+        # The user's jobs from their index
+        query = {
+          'IndexName': app.config['AWS_DYNAMODB_USER_INDEX'],
+          'KeyConditionExpression': Key('user_id').eq(user_id) &
+            Key('submit_time').gte(int(request.args['since'])),
+          'ProjectionExpression': 'job_id, user_id, submit_time'
+        }
+        if request.args.get('cursor'):
+          query['ExclusiveStartKey'] = decode_cursor(request.args['cursor'])
+        table = dynamo.Table(table_name)
+        while len(job_ids) < max_jobs:
+          query['Limit'] = max_jobs - len(job_ids)
+          response = table.query(**query)
+          job_ids.extend(item['job_id'] for item in response['Items'])
+          if 'LastEvaluatedKey' not in response:
+            break
+          query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        if 'LastEvaluatedKey' in response:
+          body['cursor'] = encode_cursor(response['LastEvaluatedKey'])
+      jobs = cache.get_jobs(dynamo, table_name, job_ids, user_id)
+    except ValueError:
+      return abort(400)
+    except ClientError as e:
+      if e.response['Error']['Code'] == 'ValidationException' and request.args.get('cursor'):
+        return abort(400)
+      app.logger.error(f"Unable to read job statuses: {e}")
+      return abort(500)
+
+    body['jobs'] = []
+    for job_id in job_ids:
+      if job_id in jobs:
+        job = dict((name, int(value) if name.endswith('_time') else value)
+          for name, value in jobs[job_id].items() if name in STATUS_ATTRIBUTES)
+        body['jobs'].append(job)
+    body['missing'] = [job_id for job_id in job_ids if job_id not in jobs]
+
+    response = jsonify(body)
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    # Hold back a 304 until the user's jobs change, then look again
+    if not wait or not request.if_none_match.contains(response.get_etag()[0]) or \
+      not cache.wait_for_change(user_id, seen, deadline - time.time()):
+      break
+
+  response.headers['Cache-Control'] = 'private, no-cache'
+  return response.make_conditional(request)
+
+
+"""Start the job status consumer of this process with its first request,
+after any fork of the app server
+"""
+@app.before_request
+def start_status_consumer():
+  status.start_consumer()
+
+
+"""Display the log file of an annotation job
+The log is read from S3 in byte ranges and streamed, so memory use does
+not grow with its size. The first and last pages are shown by default,
+and ?offset=N shows the page starting at byte N. Logs are uploaded
+when their job completes.
 """
 @app.route('/annotations/<id>/log', methods=['GET'])
 @authenticated
 def annotation_log(id):
-  dynamo = boto3.resource('dynamodb',
-      region_name=app.config['AWS_REGION_NAME'],
-      config=Config(signature_version='s3v4'))
+  dynamo = client_pool.resource('dynamodb', app.config['AWS_REGION_NAME'])
   table = dynamo.Table(app.config['AWS_DYNAMODB_ANNOTATIONS_TABLE'])
-  response = table.get_item(Key ={ 'job_id': id})['Item']
-  s3 = boto3.resource('s3',
-      region_name=app.config['AWS_REGION_NAME'],
-      config=Config(signature_version='s3v4'))
-  bucket_name = app.config['AWS_S3_RESULTS_BUCKET']
   user_id = session['primary_identity']
-  key_name = app.config['AWS_S3_KEY_PREFIX'] + user_id + '/' + \
+  response = cache.get_job(table, id, user_id)
+  if response is None:
+    return abort(404)
+  s3 = client_pool.client('s3', app.config['AWS_REGION_NAME'])
+  bucket_name = app.config['AWS_S3_RESULTS_BUCKET']
+  key_name = response.get('s3_key_log_file') or \
+    app.config['AWS_S3_KEY_PREFIX'] + user_id + '/' + \
     id + '~' + response['input_file_name'] + '.count.log'
+  page_size = app.config['LOG_PAGE_BYTES']
 
-  contents = s3.Object(bucket_name, key_name).get()['Body'].read().decode('utf-8')
-  return render_template('view_log.html', job_id=id, log_file_contents=contents)
+  try:
+    offset = int(request.args['offset']) if 'offset' in request.args else None
+  except ValueError:
+    return abort(400)
+
+  # Logs are uploaded when the job completes
+  size = None
+  if response['job_status'] == job_state.COMPLETED:
+    size = object_size(s3, bucket_name, key_name)
+  if size is None:
+    return render_template('view_log.html', job_id=id, size=None,
+      job_status=response['job_status'], sections=[])
+  if offset is not None and not 0 <= offset < max(size, 1):
+    return abort(400)
+
+  if offset is not None:
+    ranges = [(offset, min(offset + page_size, size))]
+  elif size <= 2 * page_size:
+    ranges = [(0, size)]
+  else:
+    # Head and tail
+    ranges = [(0, page_size), (size - page_size, size)]
+  sections = [{'start': start, 'end': end,
+    'text': iter_object_text(s3, bucket_name, key_name, start, end)}
+    for start, end in ranges]
+
+  pages = {'first': None, 'previous': None, 'next': None, 'last': None}
+  if offset is not None:
+    if offset > 0:
+      pages['first'] = 0
+      pages['previous'] = max(offset - page_size, 0)
+    if offset + page_size < size:
+      pages['next'] = offset + page_size
+      pages['last'] = size - page_size
+  elif len(ranges) > 1:
+    pages['next'] = page_size
+
+  return stream_template('view_log.html', job_id=id, size=size,
+    job_status=response['job_status'], sections=sections, pages=pages)
 
 
 """Subscription management handler
@@ -271,7 +524,7 @@ def annotation_log(id):
 def subscribe():
   if (request.method == 'GET'):
     # Display form to get subscriber credit card info
-    if (session.get('role') == "free_user"):
+    if (_role() == "free_user"):
       return render_template('subscribe.html')
     else:
       return redirect(url_for('profile'))
@@ -286,11 +539,14 @@ def subscribe():
     # Update role in the session
     session['role'] = "premium_user"
 
-    # Request restoration of the user's data from Glacier
+    # Request restoration of the user's data from Glacier; only needed
+    # once, when the user becomes premium
     try:
-      subprocess.Popen(['sh', '-c', 'cd ../util/restore && python3 restore.py'])
-    except subprocess.CalledProcessError:
-        internal_error(error)
+      subprocess.Popen([sys.executable, 'restore.py'], cwd='../util/restore')
+    except OSError as e:
+      app.logger.error(f"Unable to start restoring archived results: {e}")
+    # The user's jobs are about to change storage status
+    cache.invalidate_user(session['primary_identity'])
 
     # Display confirmation page
     return render_template('subscribe_confirm.html') 
@@ -308,6 +564,61 @@ def unsubscribe():
   return redirect(url_for('profile'))
 
 
+"""Local object store upload
+Stands in for S3's presigned POST when the GAS runs on the local backend
+(GAS_BACKEND=local): checks the form against its signed policy, stores
+the file under the form's key and redirects to success_action_redirect
+with the bucket and key, as S3 does.
+"""
+@app.route('/local/s3/<bucket>', methods=['POST'])
+def local_s3_upload(bucket):
+  if client_pool.backend() is None:
+    abort(404)
+  upload = request.files.get('file')
+  if upload is None or 'key' not in request.form:
+    abort(400)
+  key = request.form['key'].replace('${filename}', upload.filename or '')
+  s3 = client_pool.client('s3', app.config['AWS_REGION_NAME'])
+  try:
+    s3.check_presigned_post(bucket, key, request.form)
+  except ClientError as e:
+    app.logger.warning(f"Refused local upload to {bucket}/{key}: {e}")
+    abort(403)
+  try:
+    s3.put_object(Bucket=bucket, Key=key, Body=upload.stream)
+  except ClientError:
+    abort(400)
+
+  redirect_url = request.form.get('success_action_redirect')
+  if not redirect_url:
+    return '', 204
+  separator = '&' if '?' in redirect_url else '?'
+  return redirect(redirect_url + separator + urlencode({'bucket': bucket, 'key': key}))
+
+
+"""Local object store download
+Stands in for S3 presigned GET URLs on the local backend; the URL's
+signature and expiry are checked as S3 would.
+"""
+@app.route('/local/s3/<bucket>/<path:key>', methods=['GET'])
+def local_s3_download(bucket, key):
+  if client_pool.backend() is None:
+    abort(404)
+  s3 = client_pool.client('s3', app.config['AWS_REGION_NAME'])
+  try:
+    s3.check_presigned_url(bucket, key, request.args)
+  except ClientError as e:
+    app.logger.warning(f"Refused local download of {bucket}/{key}: {e}")
+    abort(403)
+  try:
+    response = s3.get_object(Bucket=bucket, Key=key)
+  except ClientError:
+    abort(404)
+  return Response(response['Body'].iter_chunks(1024 * 1024),
+    mimetype='application/octet-stream',
+    headers={'Content-Disposition': 'attachment; filename=' + key.split('/')[-1]})
+
+
 """DO NOT CHANGE CODE BELOW THIS LINE
 *******************************************************************************
 """